@@ -14,6 +14,7 @@ from . import instrument_version
 from . import survey_response_line
 from . import survey_response_audio
 from . import survey_user_input_line_extension
+from . import survey_user_input_answer_index
 from . import survey_user_input_custom_save
 from . import survey_condition_logic
 from . import survey_block_message
@@ -2,14 +2,46 @@
 # Versionamiento formal de instrumentos (survey.survey)
 # Permite crear snapshots de un instrumento en un momento dado,
 # seleccionar qué preguntas incluir, nombrar la versión y hacer seguimiento.
+import base64
 import hashlib
 import json
 import logging
+import zlib
+from collections import defaultdict
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
 
 _logger = logging.getLogger(__name__)
 
+# Campos de survey.question que forman parte del snapshot estructural.
+# Un cambio en cualquiera de ellos cambia el hash de la pregunta.
+CAMPOS_SNAPSHOT_PREGUNTA = [
+    'title', 'description', 'question_type', 'sequence', 'page_id',
+    'id_question_type', 'flg_required', 'des_config_json',
+    'flg_time_limit', 'unidad_limite_tiempo', 'valor_limite_tiempo',
+    'flg_allow_image_attachment', 'flg_auto_voice_record', 'modo_grabacion_voz',
+    'condiciones_fin_json',
+    'reading_grid_rows', 'reading_grid_cols', 'reading_grid_content',
+    'math_grid_rows', 'math_grid_cols',
+]
+
+
+def _serializar_snapshot(data):
+    """JSON canónico (sin espacios, claves ordenadas) comprimido con zlib."""
+    raw = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return base64.b64encode(zlib.compress(raw.encode('utf-8'), 9))
+
+
+def _deserializar_snapshot(blob):
+    if not blob:
+        return {}
+    return json.loads(zlib.decompress(base64.b64decode(blob)).decode('utf-8'))
+
+
+def _hash_corto(data):
+    raw = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16].upper()
+
 
 class LukerInstrumentVersion(models.Model):
     _name        = 'luker.instrument.version'
@@ -84,6 +116,13 @@ class LukerInstrumentVersion(models.Model):
         compute='_compute_diff_preguntas',
         store=False,
     )
+    # IDs de preguntas presentes en ambas versiones cuyo contenido cambió
+    # (título, opciones, celdas de grilla, condiciones, configuración…)
+    ids_preguntas_modificadas = fields.Char(
+        string='IDs preguntas modificadas',
+        compute='_compute_diff_preguntas',
+        store=False,
+    )
 
     # ── Trazabilidad ─────────────────────────────────────────────────────────
     fecha_creacion  = fields.Datetime(
@@ -139,6 +178,17 @@ class LukerInstrumentVersion(models.Model):
         readonly=True,
         help='Huella digital del contenido — garantiza que no fue alterado.',
     )
+    hashes_preguntas = fields.Json(
+        string='Hashes por pregunta',
+        readonly=True, copy=False,
+        help='{id_pregunta: hash} del contenido estructural de cada pregunta.',
+    )
+    snapshot_estructura = fields.Binary(
+        string='Snapshot de estructura',
+        attachment=False, readonly=True, copy=False,
+        help='Estructura completa (preguntas, opciones, grillas, condiciones) '
+             'en JSON comprimido.',
+    )
 
     # ── Cómputos ─────────────────────────────────────────────────────────────
     @api.depends('question_ids')
@@ -146,19 +196,26 @@ class LukerInstrumentVersion(models.Model):
         for v in self:
             v.num_preguntas = len(v.question_ids)
 
-    @api.depends('question_ids', 'version_anterior_id', 'version_anterior_id.question_ids')
+    @api.depends(
+        'question_ids', 'hashes_preguntas',
+        'version_anterior_id', 'version_anterior_id.question_ids',
+        'version_anterior_id.hashes_preguntas',
+    )
     def _compute_diff_preguntas(self):
         for v in self:
             if not v.version_anterior_id:
                 v.ids_preguntas_nuevas = ''
                 v.ids_preguntas_quitadas = ''
+                v.ids_preguntas_modificadas = ''
                 continue
-            ids_actuales = set(v.question_ids.ids)
-            ids_anteriores = set(v.version_anterior_id.question_ids.ids)
-            nuevas = ids_actuales - ids_anteriores
-            quitadas = ids_anteriores - ids_actuales
+            hashes_actuales = v._get_hashes_preguntas()
+            hashes_anteriores = v.version_anterior_id._get_hashes_preguntas()
+            nuevas, quitadas, modificadas = self._comparar_hashes(
+                hashes_anteriores, hashes_actuales
+            )
             v.ids_preguntas_nuevas = ','.join(str(i) for i in nuevas)
             v.ids_preguntas_quitadas = ','.join(str(i) for i in quitadas)
+            v.ids_preguntas_modificadas = ','.join(str(i) for i in modificadas)
 
     def _compute_version_siguiente(self):
         for v in self:
@@ -209,12 +266,19 @@ class LukerInstrumentVersion(models.Model):
 
         records = super().create(vals_list)
 
-        # Calcular hash de contenido inicial
-        for rec in records:
-            rec._calcular_hash()
+        # Calcular snapshot y hash de contenido inicial
+        records._calcular_hash()
 
         return records
 
+    def write(self, vals):
+        res = super().write(vals)
+        # Mientras la versión es borrador su selección de preguntas puede
+        # cambiar: el snapshot debe seguirla.
+        if 'question_ids' in vals:
+            self.filtered(lambda v: v.estado == 'borrador')._calcular_hash()
+        return res
+
     # ── Campo instrumento generado ───────────────────────────────────────────
     survey_nueva_id = fields.Many2one(
         'survey.survey',
@@ -334,15 +398,145 @@ class LukerInstrumentVersion(models.Model):
 
     # ── Helpers ───────────────────────────────────────────────────────────────
     def _calcular_hash(self):
-        """Genera un hash SHA-256 del contenido del instrumento."""
+        """
+        Genera el snapshot estructural de cada versión, el hash por pregunta
+        y el hash SHA-256 global del contenido del instrumento.
+        Las preguntas de todas las versiones de self se leen en bloque.
+        """
+        if not self:
+            return
+        estructura = self._construir_snapshot_preguntas(self.mapped('question_ids'))
+        for rec in self:
+            preguntas = {
+                str(qid): estructura[qid]
+                for qid in rec.question_ids.ids if qid in estructura
+            }
+            hashes = {qid: _hash_corto(data) for qid, data in preguntas.items()}
+            contenido = {
+                'survey_id': rec.survey_id.id,
+                'anio': rec.anio,
+                'preguntas': sorted(hashes.items()),
+            }
+            rec.write({
+                'hash_contenido': _hash_corto(contenido),
+                'hashes_preguntas': hashes,
+                'snapshot_estructura': _serializar_snapshot({
+                    'survey_id': rec.survey_id.id,
+                    'anio': rec.anio,
+                    'preguntas': preguntas,
+                }),
+            })
+
+    @api.model
+    def _construir_snapshot_preguntas(self, questions):
+        """
+        Devuelve {id_pregunta: estructura} con campos de la pregunta,
+        opciones, celdas de grilla de lectura y celdas de grilla matemática.
+        Usa una lectura por modelo, sin importar cuántas preguntas haya.
+        """
+        if not questions:
+            return {}
+        question_ids = questions.ids
+
+        opciones = defaultdict(list)
+        for opt in self.env['survey.question.answer'].sudo().search_read(
+            [('question_id', 'in', question_ids)],
+            ['question_id', 'sequence', 'value', 'flg_is_correct', 'valor_puntaje'],
+            order='sequence, id',
+        ):
+            opciones[opt['question_id'][0]].append([
+                opt['sequence'], opt['value'] or '',
+                bool(opt['flg_is_correct']), opt['valor_puntaje'] or 0.0,
+            ])
+
+        celdas_lectura = defaultdict(list)
+        for cell in self.env['survey.question.reading.grid.cell'].sudo().search_read(
+            [('question_id', 'in', question_ids)],
+            ['question_id', 'fila', 'columna', 'valor', 'es_encabezado'],
+            order='fila, columna, id',
+        ):
+            celdas_lectura[cell['question_id'][0]].append([
+                cell['fila'], cell['columna'], cell['valor'] or '',
+                bool(cell['es_encabezado']),
+            ])
+
+        celdas_math = defaultdict(list)
+        for cell in self.env['survey.question.math.grid.cell'].sudo().search_read(
+            [('question_id', 'in', question_ids)],
+            ['question_id', 'row_index', 'col_index', 'cell_value', 'correct_value'],
+        ):
+            celdas_math[cell['question_id'][0]].append([
+                cell['row_index'], cell['col_index'],
+                cell['cell_value'] or '', cell['correct_value'] or '',
+            ])
+
+        resultado = {}
+        for q in questions.sudo().read(CAMPOS_SNAPSHOT_PREGUNTA):
+            qid = q.pop('id')
+            for campo in ('page_id', 'id_question_type'):
+                q[campo] = q[campo][0] if q[campo] else False
+            q['opciones'] = opciones.get(qid, [])
+            q['celdas_lectura'] = celdas_lectura.get(qid, [])
+            q['celdas_math'] = celdas_math.get(qid, [])
+            resultado[qid] = q
+        return resultado
+
+    def _get_hashes_preguntas(self):
+        """Hashes por pregunta; versiones sin snapshot se comparan solo por ids."""
         self.ensure_one()
-        contenido = {
-            'survey_id': self.survey_id.id,
-            'anio': self.anio,
-            'preguntas': sorted(self.question_ids.ids),
+        if self.hashes_preguntas:
+            return self.hashes_preguntas
+        return {str(qid): False for qid in self.question_ids.ids}
+
+    @api.model
+    def _comparar_hashes(self, hashes_anteriores, hashes_actuales):
+        """Devuelve (nuevas, quitadas, modificadas) como listas de ids ordenadas."""
+        claves_actuales = set(hashes_actuales)
+        claves_anteriores = set(hashes_anteriores)
+        nuevas = claves_actuales - claves_anteriores
+        quitadas = claves_anteriores - claves_actuales
+        modificadas = {
+            qid for qid in claves_actuales & claves_anteriores
+            if hashes_actuales[qid] and hashes_anteriores[qid]
+            and hashes_actuales[qid] != hashes_anteriores[qid]
         }
-        raw = json.dumps(contenido, sort_keys=True).encode('utf-8')
-        self.hash_contenido = hashlib.sha256(raw).hexdigest()[:16].upper()
+        return (
+            sorted(int(i) for i in nuevas),
+            sorted(int(i) for i in quitadas),
+            sorted(int(i) for i in modificadas),
+        )
+
+    def obtener_snapshot(self):
+        """Estructura completa almacenada de la versión (dict)."""
+        self.ensure_one()
+        return _deserializar_snapshot(self.snapshot_estructura)
+
+    def diff_con(self, otra_version):
+        """
+        Compara esta versión contra otra usando los hashes por pregunta.
+        Solo se descomprime el detalle de las preguntas que cambiaron.
+        Retorna:
+            {'nuevas': [ids], 'quitadas': [ids],
+             'modificadas': {id: {campo: [antes, despues]}}}
+        """
+        self.ensure_one()
+        otra_version.ensure_one()
+        nuevas, quitadas, modificadas = self._comparar_hashes(
+            otra_version._get_hashes_preguntas(), self._get_hashes_preguntas()
+        )
+        detalle = {}
+        if modificadas:
+            antes = otra_version.obtener_snapshot().get('preguntas', {})
+            despues = self.obtener_snapshot().get('preguntas', {})
+            for qid in modificadas:
+                q_antes = antes.get(str(qid), {})
+                q_despues = despues.get(str(qid), {})
+                detalle[qid] = {
+                    campo: [q_antes.get(campo), q_despues.get(campo)]
+                    for campo in set(q_antes) | set(q_despues)
+                    if q_antes.get(campo) != q_despues.get(campo)
+                }
+        return {'nuevas': nuevas, 'quitadas': quitadas, 'modificadas': detalle}
 
 
 class SurveySurveyVersionExtend(models.Model):
@@ -387,6 +581,42 @@ class SurveySurveyVersionExtend(models.Model):
             ], order='fecha_creacion desc', limit=1)
             s.ultima_version_id = v
 
+    def _get_hash_contenido_servido(self):
+        """
+        Huella del contenido actual del instrumento tal como lo sirve la API.
+        Cambia con cualquier alta, baja o edición del instrumento, de sus
+        preguntas, de sus opciones o de los tipos de pregunta que usa, esté
+        o no congelado. Es la clave de caché del payload y el ETag; se
+        obtiene con una consulta agregada, sin serializar el instrumento.
+        """
+        self.ensure_one()
+        for model in ('survey.survey', 'survey.question', 'survey.question.answer',
+                      'survey.question.type'):
+            self.env[model].flush_model()
+        self.env.cr.execute(
+            """
+            SELECT s.write_date, q.n, q.ids, q.ultima, q.ultima_tipo,
+                   o.n, o.ids, o.ultima
+              FROM survey_survey s,
+                   LATERAL (
+                       SELECT count(*) AS n, sum(q.id) AS ids,
+                              max(q.write_date) AS ultima,
+                              max(t.write_date) AS ultima_tipo
+                         FROM survey_question q
+                         LEFT JOIN survey_question_type t ON t.id = q.id_question_type
+                        WHERE q.survey_id = s.id) q,
+                   LATERAL (
+                       SELECT count(*) AS n, sum(a.id) AS ids, max(a.write_date) AS ultima
+                         FROM survey_question_answer a
+                         JOIN survey_question qa
+                           ON qa.id = a.question_id OR qa.id = a.matrix_question_id
+                        WHERE qa.survey_id = s.id) o
+             WHERE s.id = %s
+            """,
+            [self.id],
+        )
+        return _hash_corto([self.id, *self.env.cr.fetchone()])
+
     def action_crear_version(self):
         """Botón 'Versionar' en el formulario del instrumento."""
         self.ensure_one()
@@ -17,9 +17,7 @@ class SurveySurvey(models.Model):
         if not question:
             return ""
 
-        answer_lines = user_input.user_input_line_ids.filtered(
-            lambda l: l.id_question_audio.id == question.id
-        )
+        answer_lines = user_input._get_indexed_native_lines(question)
 
         if not answer_lines:
             _logger.warning(
@@ -1,7 +1,41 @@
 # -*- coding: utf-8 -*-
+import logging
+import time
+
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
 
+_logger = logging.getLogger(__name__)
+
+# Campos que siempre se copian de la pregunta origen.
+CAMPOS_BASE = [
+    'title', 'question_type', 'sequence', 'page_id',
+    # Nativo Odoo
+    'description', 'constr_mandatory', 'constr_error_msg',
+    'comments_allowed', 'comment_count_as_answer',
+    'save_as_email', 'save_as_nickname',
+    # Campos custom SISPAR
+    'id_question_type', 'des_config_json', 'flg_required',
+    'mostrar_info_seccion', 'condiciones_fin_json',
+]
+
+# Campos copiados solo con incluir_config_especial.
+CAMPOS_CONFIG_ESPECIAL = [
+    'flg_time_limit', 'valor_limite_tiempo', 'unidad_limite_tiempo',
+    'flg_auto_voice_record', 'modo_grabacion_voz',
+    'flg_allow_image_attachment',
+    'reading_grid_rows', 'reading_grid_cols', 'reading_grid_content',
+    'math_grid_rows', 'math_grid_cols',
+]
+
+CAMPOS_OPCION = ['value', 'sequence', 'is_correct', 'flg_is_correct', 'valor_puntaje']
+CAMPOS_CELDA_LECTURA = ['fila', 'columna', 'valor', 'es_encabezado']
+CAMPOS_CELDA_MATH = ['row_index', 'col_index', 'cell_value', 'correct_value']
+
+
+class _RollbackBenchmark(Exception):
+    """Fuerza el rollback del savepoint usado por el benchmark."""
+
 
 class SurveyCopyQuestionsWizard(models.TransientModel):
     _name = 'survey.copy.questions.wizard'
@@ -106,97 +140,199 @@ class SurveyCopyQuestionsWizard(models.TransientModel):
         if not self.survey_destino_id:
             raise ValidationError('Selecciona el instrumento destino.')
 
+        self._trasladar_lote(self.pregunta_ids)
+
+        # ── Si modo = mover, eliminar del origen ────────────────────────
+        if self.modo == 'mover':
+            self.pregunta_ids.unlink()
+
+        return {'type': 'ir.actions.act_window_close'}
+
+    def _trasladar_lote(self, preguntas):
+        """
+        Copia las preguntas al destino en lote:
+        1. Lee preguntas, opciones y celdas de grilla con una consulta por modelo.
+        2. Crea las secciones faltantes con un único create(), cada una con la
+           secuencia previa a su primera pregunta para conservar la estructura.
+        3. Crea todas las preguntas con un único create() y remapea ids en memoria
+           (sección, condiciones de finalización que apuntan a preguntas copiadas).
+        4. Crea opciones y celdas con un create() por modelo.
+        Retorna el recordset de preguntas creadas, en el orden de origen.
+        """
+        self.ensure_one()
         destino = self.survey_destino_id
+        Question = self.env['survey.question']
+
+        preguntas = preguntas.sorted(key=lambda q: (q.sequence, q.id))
+        campos = list(CAMPOS_BASE)
+        if self.incluir_config_especial:
+            campos += CAMPOS_CONFIG_ESPECIAL
+        datos = preguntas.read(campos)
 
         # Secuencia base al final del destino
-        items_dst = destino.question_and_page_ids.sorted(
-            key=lambda q: (q.sequence, q.id)
-        )
+        items_dst = destino.question_and_page_ids
         seq = (max(items_dst.mapped('sequence')) + 10) if items_dst else 10
 
-        secciones_cache = {}  # titulo → id sección en destino
-
-        preguntas_ordenadas = self.pregunta_ids.sorted(
-            key=lambda q: (q.sequence, q.id)
-        )
-
-        for pregunta in preguntas_ordenadas:
-
-            # ── Sección ─────────────────────────────────────────────────
-            page_id = False
-            if self.incluir_secciones and pregunta.page_id:
-                titulo = (pregunta.page_id.title or '').strip()
-                if titulo not in secciones_cache:
-                    existente = destino.question_and_page_ids.filtered(
-                        lambda q: q.is_page and (q.title or '').strip() == titulo
-                    )
-                    if existente:
-                        secciones_cache[titulo] = existente[0].id
-                    else:
-                        nueva_sec = self.env['survey.question'].create({
-                            'survey_id':     destino.id,
-                            'title':         titulo,
-                            'is_page':       True,
-                            'question_type': 'text_box',
-                            'sequence':      seq,
-                        })
-                        secciones_cache[titulo] = nueva_sec.id
-                        seq += 10
-                page_id = secciones_cache[titulo]
-
-            # ── Campos base ─────────────────────────────────────────────
-            vals = {
-                'survey_id':    destino.id,
-                'title':        pregunta.title,
-                'question_type': pregunta.question_type or 'text_box',
-                'is_page':      False,
-                'sequence':     seq,
-                'page_id':      page_id or False,
-                # Nativo Odoo
-                'description':            pregunta.description,
-                'constr_mandatory':        pregunta.constr_mandatory,
-                'constr_error_msg':        pregunta.constr_error_msg,
-                'comments_allowed':        pregunta.comments_allowed,
-                'comment_count_as_answer': pregunta.comment_count_as_answer,
-                'save_as_email':           pregunta.save_as_email,
-                'save_as_nickname':        pregunta.save_as_nickname,
-                # Campos custom SISPAR
-                'id_question_type':  pregunta.id_question_type.id if pregunta.id_question_type else False,
-                'des_config_json':   pregunta.des_config_json,
-                'flg_required':      pregunta.flg_required,
-                'mostrar_info_seccion': pregunta.mostrar_info_seccion,
-                'condiciones_fin_json': pregunta.condiciones_fin_json,
+        # ── Secciones y preguntas, en el orden de origen ────────────────
+        # page_id se deriva del orden por secuencia: cada sección nueva toma
+        # la secuencia inmediatamente anterior a su primera pregunta.
+        secciones = {}  # titulo → id sección en destino
+        titulos_origen = {}
+        if self.incluir_secciones:
+            for sec in items_dst.filtered('is_page'):
+                secciones.setdefault((sec.title or '').strip(), sec.id)
+            titulos_origen = {
+                p.id: (p.title or '').strip() for p in preguntas.mapped('page_id')
             }
 
-            # ── Config especial ─────────────────────────────────────────
-            if self.incluir_config_especial:
-                vals.update({
-                    'flg_time_limit':        pregunta.flg_time_limit,
-                    'valor_limite_tiempo':   pregunta.valor_limite_tiempo,
-                    'unidad_limite_tiempo':  pregunta.unidad_limite_tiempo,
-                    'flg_auto_voice_record': pregunta.flg_auto_voice_record,
-                    'modo_grabacion_voz':    pregunta.modo_grabacion_voz,
-                    'flg_allow_image_attachment': pregunta.flg_allow_image_attachment,
+        vals_secciones = []
+        vals_list = []
+        titulos_pregunta = []
+        for d in datos:
+            titulo_sec = titulos_origen.get(d['page_id'] and d['page_id'][0])
+            if titulo_sec is not None and titulo_sec not in secciones:
+                secciones[titulo_sec] = None        # se crea abajo
+                vals_secciones.append({
+                    'survey_id':     destino.id,
+                    'title':         titulo_sec,
+                    'is_page':       True,
+                    'question_type': 'text_box',
+                    'sequence':      seq,
                 })
-
-            nueva = self.env['survey.question'].create(vals)
+                seq += 10
+            vals = {campo: d[campo] for campo in campos if campo not in ('page_id', 'id_question_type')}
+            vals.update({
+                'survey_id':        destino.id,
+                'question_type':    d['question_type'] or 'text_box',
+                'is_page':          False,
+                'sequence':         seq,
+                'id_question_type': d['id_question_type'][0] if d['id_question_type'] else False,
+            })
+            vals_list.append(vals)
+            titulos_pregunta.append(titulo_sec)
             seq += 10
 
-            # ── Opciones de respuesta ───────────────────────────────────
-            if self.incluir_opciones and pregunta.suggested_answer_ids:
-                for opt in pregunta.suggested_answer_ids.sorted('sequence'):
-                    self.env['survey.question.answer'].create({
-                        'question_id':    nueva.id,
-                        'value':          opt.value,
-                        'sequence':       opt.sequence,
-                        'is_correct':     opt.is_correct,
-                        'flg_is_correct': opt.flg_is_correct,
-                        'valor_puntaje':  opt.valor_puntaje,
-                    })
+        if vals_secciones:
+            for vals_sec, sec in zip(vals_secciones, Question.create(vals_secciones)):
+                secciones[vals_sec['title']] = sec.id
+        for vals, titulo_sec in zip(vals_list, titulos_pregunta):
+            vals['page_id'] = secciones.get(titulo_sec) or False
+        nuevas = Question.create(vals_list)
+        mapa_ids = dict(zip(preguntas.ids, nuevas.ids))
 
-        # ── Si modo = mover, eliminar del origen ────────────────────────
-        if self.modo == 'mover':
-            self.pregunta_ids.unlink()
+        # Condiciones que referencian preguntas copiadas apuntan a las nuevas
+        for nueva, d in zip(nuevas, datos):
+            condiciones = self._remapear_condiciones(d['condiciones_fin_json'], mapa_ids)
+            if condiciones != d['condiciones_fin_json']:
+                nueva.condiciones_fin_json = condiciones
 
-        n = len(preguntas_ordenadas)
-        return {'type': 'ir.actions.act_window_close'}
+        # ── Opciones de respuesta ───────────────────────────────────────
+        if self.incluir_opciones:
+            self._copiar_hijos('survey.question.answer', CAMPOS_OPCION, mapa_ids, 'sequence, id')
+
+        # ── Celdas de grilla ────────────────────────────────────────────
+        if self.incluir_config_especial:
+            self._copiar_hijos('survey.question.reading.grid.cell', CAMPOS_CELDA_LECTURA, mapa_ids, 'id')
+            self._copiar_hijos('survey.question.math.grid.cell', CAMPOS_CELDA_MATH, mapa_ids, 'id')
+
+        return nuevas
+
+    def _copiar_hijos(self, modelo, campos, mapa_ids, order):
+        """Copia registros hijos (question_id) de las preguntas origen con un solo create()."""
+        Model = self.env[modelo]
+        origen = Model.search_read(
+            [('question_id', 'in', list(mapa_ids))],
+            ['question_id'] + campos,
+            order=order,
+        )
+        if not origen:
+            return Model
+        vals_list = []
+        for r in origen:
+            vals = {campo: r[campo] for campo in campos}
+            vals['question_id'] = mapa_ids[r['question_id'][0]]
+            vals_list.append(vals)
+        return Model.create(vals_list)
+
+    @api.model
+    def _remapear_condiciones(self, condiciones, mapa_ids):
+        """Cambia compare_question_id / target_question_id según mapa_ids."""
+        if not isinstance(condiciones, list):
+            return condiciones
+
+        def _remap(valor):
+            try:
+                return mapa_ids.get(int(valor), valor)
+            except (TypeError, ValueError):
+                return valor
+
+        resultado = []
+        for regla in condiciones:
+            if not isinstance(regla, dict):
+                resultado.append(regla)
+                continue
+            regla = dict(regla)
+            if regla.get('target_question_id'):
+                regla['target_question_id'] = _remap(regla['target_question_id'])
+            conds = []
+            for cond in regla.get('conditions') or []:
+                if isinstance(cond, dict) and cond.get('compare_question_id'):
+                    cond = dict(cond, compare_question_id=_remap(cond['compare_question_id']))
+                conds.append(cond)
+            if 'conditions' in regla:
+                regla['conditions'] = conds
+            resultado.append(regla)
+        return resultado
+
+    # ── Benchmark ─────────────────────────────────────────────────────────
+    @api.model
+    def _benchmark_traslado(self, num_preguntas=500, opciones_por_pregunta=4):
+        """
+        Mide la copia en lote de num_preguntas preguntas (con opciones) entre
+        dos instrumentos temporales. Todo se revierte al terminar.
+        Uso desde shell: env['survey.copy.questions.wizard']._benchmark_traslado()
+        """
+        resultado = {}
+        cr = self.env.cr
+        try:
+            with cr.savepoint():
+                Survey = self.env['survey.survey']
+                origen = Survey.create({'title': 'Benchmark traslado — origen'})
+                destino = Survey.create({'title': 'Benchmark traslado — destino'})
+                pagina = self.env['survey.question'].create({
+                    'survey_id': origen.id, 'title': 'Sección benchmark',
+                    'is_page': True, 'sequence': 1,
+                })
+                preguntas = self.env['survey.question'].create([{
+                    'survey_id': origen.id,
+                    'title': f'Pregunta {i}',
+                    'question_type': 'simple_choice',
+                    'sequence': 10 + i,
+                    'page_id': pagina.id,
+                    'suggested_answer_ids': [
+                        (0, 0, {'value': f'Opción {j}', 'sequence': j, 'flg_is_correct': j == 0})
+                        for j in range(opciones_por_pregunta)
+                    ],
+                } for i in range(num_preguntas)])
+                wizard = self.create({
+                    'survey_origen_id': origen.id,
+                    'survey_destino_id': destino.id,
+                    'pregunta_ids': [(6, 0, preguntas.ids)],
+                })
+                self.env.flush_all()
+
+                consultas_ini = cr.sql_log_count
+                t0 = time.perf_counter()
+                nuevas = wizard._trasladar_lote(wizard.pregunta_ids)
+                self.env.flush_all()
+                resultado = {
+                    'preguntas': len(nuevas),
+                    'opciones': len(nuevas.mapped('suggested_answer_ids')),
+                    'segundos': round(time.perf_counter() - t0, 3),
+                    'consultas': cr.sql_log_count - consultas_ini,
+                }
+                raise _RollbackBenchmark()
+        except _RollbackBenchmark:
+            self.env.invalidate_all()
+        _logger.info('Benchmark traslado de preguntas: %s', resultado)
+        return resultado
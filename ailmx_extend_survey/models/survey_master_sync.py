@@ -113,12 +113,13 @@ class SurveyMasterSync(models.Model):
             return vals
 
         # -----------------------------------------------------
-        # Buscar asignación actual del participante
+        # Asignación vigente del participante a la fecha de la
+        # aplicación (consulta por rango de vigencia)
         # -----------------------------------------------------
-        current_assignment = self.env['luker.participant.assignment'].search([
-            ('participante_id', '=', luker_participant.id),
-            ('vigencia_hasta', '=', False),
-        ], order='vigencia_desde desc, id desc', limit=1)
+        fecha = (self.create_date or fields.Datetime.now()).date()
+        current_assignment = luker_participant._get_contexto_en_fecha(fecha)[
+            luker_participant.id
+        ]['asignacion']
 
         if not current_assignment:
             return vals
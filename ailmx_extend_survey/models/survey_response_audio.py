@@ -1,6 +1,54 @@
 # -*- coding: utf-8 -*-
+# Audios de respuesta y su post-procesamiento en segundo plano.
+#
+# Tras cada carga, un cron analiza el audio (duración, pico/RMS, proporción
+# de silencio y una forma de onda reducida) y, si está habilitado y existe
+# ffmpeg en el servidor, lo transcodifica a Opus para ahorrar almacenamiento.
+# Sin ffmpeg solo se pueden analizar archivos WAV; el resto queda marcado
+# como "Sin análisis" conservando el archivo original.
 
-from odoo import models, fields
+import base64
+import io
+import logging
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import wave
+from array import array
+
+from odoo import models, fields, api, tools
+from odoo.tools.misc import find_in_path
+
+_logger = logging.getLogger(__name__)
+
+# Frecuencia a la que se decodifica el audio para analizarlo
+SAMPLE_RATE_ANALISIS = 8000
+# Ventana para detectar silencio (20 ms)
+VENTANA_SILENCIO_SEG = 0.02
+# Umbral de silencio en dBFS
+UMBRAL_SILENCIO_DBFS = -40.0
+# Puntos de la forma de onda guardada
+PUNTOS_FORMA_ONDA = 100
+# Tiempo máximo por llamada a ffmpeg
+TIMEOUT_FFMPEG = 120
+
+PARAM_TRANSCODIFICAR = 'ailmx_extend_survey.audio_transcodificar'
+PARAM_BITRATE = 'ailmx_extend_survey.audio_bitrate_opus'
+
+
+def _ffmpeg():
+    try:
+        return find_in_path('ffmpeg')
+    except IOError:
+        return None
+
+
+def _a_dbfs(valor):
+    if valor <= 0:
+        return -120.0
+    return round(20 * math.log10(valor / 32768.0), 2)
 
 
 class SurveyResponseAudio(models.Model):
@@ -12,6 +60,7 @@ class SurveyResponseAudio(models.Model):
         comodel_name='survey.response.line',
         string='Línea de respuesta',
         required=True,
+        index=True,
         ondelete='cascade'
     )
 
@@ -46,9 +95,280 @@ class SurveyResponseAudio(models.Model):
         string='Tamaño'
     )
 
+    # ── Post-procesamiento ───────────────────────────────────────────────────
+    estado_procesamiento = fields.Selection([
+        ('pendiente',    'Pendiente'),
+        ('procesado',    'Procesado'),
+        ('sin_analisis', 'Sin análisis'),
+        ('error',        'Error'),
+    ], string='Procesamiento', default='pendiente', index=True, copy=False)
+
+    duracion_seg = fields.Float(
+        string='Duración (s)', digits=(10, 2), readonly=True
+    )
+
+    pico_dbfs = fields.Float(
+        string='Pico (dBFS)', digits=(6, 2), readonly=True
+    )
+
+    rms_dbfs = fields.Float(
+        string='RMS (dBFS)', digits=(6, 2), readonly=True
+    )
+
+    ratio_silencio = fields.Float(
+        string='Proporción de silencio', digits=(4, 3), readonly=True,
+        help='Fracción (0-1) de ventanas de 20 ms por debajo de -40 dBFS.'
+    )
+
+    forma_onda = fields.Json(
+        string='Forma de onda', readonly=True,
+        help='Picos normalizados (0-100) en 100 tramos, para vista previa.'
+    )
+
+    tam_archivo_original = fields.Integer(
+        string='Tamaño original', readonly=True
+    )
+
+    fecha_procesamiento = fields.Datetime(
+        string='Procesado el', readonly=True
+    )
+
+    error_procesamiento = fields.Char(
+        string='Error de procesamiento', readonly=True
+    )
+
+    def _auto_init(self):
+        # Los audios anteriores a este post-procesamiento no se encolan: si la
+        # columna es nueva quedan como "Sin análisis" en lugar de "Pendiente",
+        # para que la primera corrida del cron no recorra todo el histórico.
+        columna_nueva = not tools.column_exists(
+            self._cr, self._table, 'estado_procesamiento'
+        )
+        res = super()._auto_init()
+        if columna_nueva:
+            self._cr.execute(
+                f"UPDATE {self._table} SET estado_procesamiento = 'sin_analisis'"
+            )
+        return res
+
+    def init(self):
+        tools.create_index(
+            self._cr,
+            'survey_response_audio_header_question_idx',
+            self._table,
+            ['id_response_header', 'id_question'],
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env['survey.user_input']._invalidate_answer_index(
+            records.mapped('id_response_header').ids
+        )
+        # El análisis se hace fuera de la petición de guardado
+        cron = self.env.ref(
+            'ailmx_extend_survey.cron_procesar_audios_respuesta',
+            raise_if_not_found=False,
+        )
+        if cron:
+            cron.sudo()._trigger()
+        return records
+
     def unlink(self):
         attachments = self.mapped('id_adjunto')
+        header_ids = self.mapped('id_response_header').ids
         res = super().unlink()
+        self.env['survey.user_input']._invalidate_answer_index(header_ids)
         if attachments:
             attachments.sudo().unlink()
-        return res
\ No newline at end of file
+        return res
+
+    # =========================================================
+    # POST-PROCESAMIENTO
+    # =========================================================
+
+    @api.model
+    def _cron_procesar_audios(self, limite=50):
+        """
+        Procesa audios pendientes por lotes. Si quedan pendientes, vuelve
+        a programar el cron para no bloquear el worker con un lote enorme.
+        """
+        pendientes = self.sudo().search(
+            [('estado_procesamiento', '=', 'pendiente')],
+            order='id asc', limit=limite,
+        )
+        for audio in pendientes:
+            try:
+                with self.env.cr.savepoint():
+                    audio._procesar_audio()
+            except Exception as e:
+                _logger.exception('Error procesando audio id=%s', audio.id)
+                audio.write({
+                    'estado_procesamiento': 'error',
+                    'error_procesamiento': str(e)[:250],
+                    'fecha_procesamiento': fields.Datetime.now(),
+                })
+            self.env.cr.commit()
+
+        if len(pendientes) == limite:
+            self.env.ref('ailmx_extend_survey.cron_procesar_audios_respuesta')._trigger()
+        return True
+
+    def _procesar_audio(self):
+        self.ensure_one()
+        attachment = self.id_adjunto.sudo()
+        datos = attachment.raw or b''
+        vals = {
+            'fecha_procesamiento': fields.Datetime.now(),
+            'error_procesamiento': False,
+            'tam_archivo_original': self.tam_archivo_original or len(datos),
+        }
+
+        muestras = self._decodificar_pcm(datos, self.tipo_mime or attachment.mimetype)
+        if muestras is None:
+            vals['estado_procesamiento'] = 'sin_analisis'
+        else:
+            vals.update(self._analizar_pcm(muestras, SAMPLE_RATE_ANALISIS))
+            vals['estado_procesamiento'] = 'procesado'
+
+        if self._debe_transcodificar():
+            vals.update(self._transcodificar(datos))
+
+        self.write(vals)
+
+    @api.model
+    def _decodificar_pcm(self, datos, tipo_mime):
+        """
+        Devuelve las muestras mono de 16 bits a SAMPLE_RATE_ANALISIS como
+        array('h'), o None si no hay forma de decodificar el formato.
+        """
+        if not datos:
+            return None
+
+        ffmpeg = _ffmpeg()
+        if ffmpeg:
+            with tempfile.NamedTemporaryFile(suffix='.audio') as entrada:
+                entrada.write(datos)
+                entrada.flush()
+                proc = subprocess.run(
+                    [ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', entrada.name,
+                     '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE_ANALISIS), 'pipe:1'],
+                    capture_output=True, timeout=TIMEOUT_FFMPEG, check=True,
+                )
+            pcm = proc.stdout[:len(proc.stdout) - len(proc.stdout) % 2]
+            muestras = array('h', pcm)
+            if sys.byteorder == 'big':
+                muestras.byteswap()
+            return muestras
+
+        if (tipo_mime or '').lower() in ('audio/wav', 'audio/x-wav', 'audio/wave'):
+            return self._decodificar_wav(datos)
+        return None
+
+    @api.model
+    def _decodificar_wav(self, datos):
+        """Lee un WAV PCM de 16 bits sin dependencias externas (mezcla a mono y remuestrea)."""
+        with wave.open(io.BytesIO(datos), 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                return None
+            canales = wav.getnchannels()
+            frecuencia = wav.getframerate()
+            frames = array('h', wav.readframes(wav.getnframes()))
+        if sys.byteorder == 'big':
+            frames.byteswap()
+        if canales > 1:
+            frames = array('h', (
+                sum(frames[i:i + canales]) // canales
+                for i in range(0, len(frames), canales)
+            ))
+        paso = max(frecuencia // SAMPLE_RATE_ANALISIS, 1)
+        return frames[::paso] if paso > 1 else frames
+
+    @api.model
+    def _analizar_pcm(self, muestras, frecuencia):
+        """Duración, pico, RMS, proporción de silencio y forma de onda en una pasada."""
+        total = len(muestras)
+        if not total:
+            return {
+                'duracion_seg': 0.0, 'pico_dbfs': -120.0, 'rms_dbfs': -120.0,
+                'ratio_silencio': 1.0, 'forma_onda': [],
+            }
+
+        ventana = max(int(frecuencia * VENTANA_SILENCIO_SEG), 1)
+        umbral = 32768.0 * (10 ** (UMBRAL_SILENCIO_DBFS / 20.0))
+        tramo = max(total // PUNTOS_FORMA_ONDA, 1)
+
+        pico = 0
+        suma_cuadrados = 0
+        ventanas = ventanas_silencio = 0
+        picos_tramo = [0] * min(PUNTOS_FORMA_ONDA, total)
+
+        for inicio in range(0, total, ventana):
+            bloque = muestras[inicio:inicio + ventana]
+            cuadrados = sum(x * x for x in bloque)
+            pico_bloque = max(max(bloque), -min(bloque))
+            suma_cuadrados += cuadrados
+            pico = max(pico, pico_bloque)
+            ventanas += 1
+            if math.sqrt(cuadrados / len(bloque)) < umbral:
+                ventanas_silencio += 1
+            idx = min(inicio // tramo, len(picos_tramo) - 1)
+            picos_tramo[idx] = max(picos_tramo[idx], pico_bloque)
+
+        escala = (100.0 / pico) if pico else 0.0
+        return {
+            'duracion_seg': round(total / float(frecuencia), 2),
+            'pico_dbfs': _a_dbfs(pico),
+            'rms_dbfs': _a_dbfs(math.sqrt(suma_cuadrados / total)),
+            'ratio_silencio': round(ventanas_silencio / float(ventanas), 3),
+            'forma_onda': [int(round(p * escala)) for p in picos_tramo],
+        }
+
+    def _debe_transcodificar(self):
+        param = self.env['ir.config_parameter'].sudo().get_param(PARAM_TRANSCODIFICAR)
+        return param in ('1', 'True', 'true') and bool(_ffmpeg())
+
+    def _transcodificar(self, datos):
+        """
+        Transcodifica a Opus/OGG mono. Solo reemplaza el adjunto si el
+        resultado es más pequeño. Retorna los valores a escribir.
+        """
+        self.ensure_one()
+        if not datos or (self.tipo_mime or '').startswith('audio/ogg'):
+            return {}
+
+        bitrate = self.env['ir.config_parameter'].sudo().get_param(PARAM_BITRATE, '24k')
+        with tempfile.TemporaryDirectory() as tmp:
+            ruta_in = os.path.join(tmp, 'entrada')
+            ruta_out = os.path.join(tmp, 'salida.ogg')
+            with open(ruta_in, 'wb') as f:
+                f.write(datos)
+            subprocess.run(
+                [_ffmpeg(), '-hide_banner', '-loglevel', 'error', '-y', '-i', ruta_in,
+                 '-ac', '1', '-c:a', 'libopus', '-b:a', bitrate, ruta_out],
+                capture_output=True, timeout=TIMEOUT_FFMPEG, check=True,
+            )
+            with open(ruta_out, 'rb') as f:
+                nuevos = f.read()
+
+        if not nuevos or len(nuevos) >= len(datos):
+            return {}
+
+        anterior = self.id_adjunto.sudo()
+        nombre = os.path.splitext(self.nom_archivo or anterior.name or 'audio')[0] + '.ogg'
+        nuevo = self.env['ir.attachment'].sudo().create({
+            'name': nombre,
+            'type': 'binary',
+            'datas': base64.b64encode(nuevos),
+            'mimetype': 'audio/ogg',
+            'res_model': anterior.res_model,
+            'res_id': anterior.res_id,
+            'description': anterior.description,
+        })
+        self.id_adjunto = nuevo
+        anterior.unlink()
+        return {
+            'nom_archivo': nombre,
+            'tipo_mime': 'audio/ogg',
+            'tam_archivo': len(nuevos),
+        }
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
 from markupsafe import Markup, escape
 
 
@@ -26,6 +26,7 @@ class SurveyResponseLine(models.Model):
         comodel_name='survey.question',
         string='Pregunta',
         required=True,
+        index=True,
         help='Pregunta específica que se está respondiendo'
     )
 
@@ -124,6 +125,40 @@ class SurveyResponseLine(models.Model):
         store=False
     )
 
+    def init(self):
+        # Búsqueda por (aplicación, pregunta): save_response, guardado de
+        # grids, audio automático e índice de respuestas.
+        tools.create_index(
+            self._cr,
+            'survey_response_line_header_question_idx',
+            self._table,
+            ['id_response_header', 'id_question'],
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env['survey.user_input']._invalidate_answer_index(
+            records.mapped('id_response_header').ids
+        )
+        return records
+
+    def write(self, vals):
+        if not {'id_response_header', 'id_question'} & set(vals):
+            return super().write(vals)
+        header_ids = self.mapped('id_response_header').ids
+        res = super().write(vals)
+        self.env['survey.user_input']._invalidate_answer_index(
+            header_ids + self.mapped('id_response_header').ids
+        )
+        return res
+
+    def unlink(self):
+        header_ids = self.mapped('id_response_header').ids
+        res = super().unlink()
+        self.env['survey.user_input']._invalidate_answer_index(header_ids)
+        return res
+
     @api.depends(
         'typ_response',
         'val_text',
@@ -203,46 +238,76 @@ class SurveyResponseLine(models.Model):
         'id_question.math_grid_rows', 'id_question.math_grid_cols',
     )
     def _compute_review_fields(self):
+        opciones_correctas = self._get_opciones_correctas_por_pregunta(
+            self.mapped('id_question')
+        )
         for record in self:
+            status, is_correct = record._evaluar_correccion(
+                opciones_correctas.get(record.id_question.id)
+            )
+            record.flg_is_correct_response = is_correct
+            record.nam_review_status = status
+            record.des_review_html = record._build_review_html(status, is_correct)
+
+    @api.model
+    def _get_opciones_correctas_por_pregunta(self, questions):
+        """
+        Opciones marcadas como correctas agrupadas por pregunta, en una sola
+        lectura: {question_id: survey.question.answer}.
+        """
+        correctas = self.env['survey.question.answer'].sudo().search_fetch(
+            [('question_id', 'in', questions.ids), ('flg_is_correct', '=', True)],
+            ['question_id', 'value'],
+        )
+        resultado = {}
+        for opcion in correctas:
+            qid = opcion.question_id.id
+            resultado[qid] = resultado.get(qid, opcion.browse()) | opcion
+        return resultado
+
+    def _evaluar_correccion(self, opciones_correctas=None):
+        """
+        Devuelve (estado, es_correcta) de la línea. ``opciones_correctas`` son
+        las opciones correctas de su pregunta; si no se pasan se leen de la
+        pregunta (uso puntual).
+        """
+        self.ensure_one()
+        question = self.id_question
+        if opciones_correctas is None:
+            opciones_correctas = question.suggested_answer_ids.filtered('flg_is_correct')
+        elif not opciones_correctas:
+            opciones_correctas = self.env['survey.question.answer']
+
+        if self.flg_omitted:
+            return 'Omitida', False
+
+        if question and question.question_type == 'simple_choice':
             is_correct = False
-            status = 'Respondida'
-
-            if record.flg_omitted:
-                status = 'Omitida'
-
-            elif record.id_question and record.id_question.question_type == 'simple_choice':
-                if record.id_question_option:
-                    is_correct = bool(record.id_question_option.flg_is_correct)
-                elif record.val_text:
-                    selected_text = (record.val_text or '').strip()
-                    correct_option = record.id_question.suggested_answer_ids.filtered(
-                        lambda opt: opt.flg_is_correct
-                        and (opt.value or opt.display_name or '').strip() == selected_text
-                    )[:1]
-                    is_correct = bool(correct_option)
-                status = 'Correcta' if is_correct else 'Incorrecta'
-
-            elif record.id_question and record.id_question.question_type == 'multiple_choice':
-                selected_ids, selected_values = record._get_selected_multiple_choice_data()
-                correct_options = record.id_question.suggested_answer_ids.filtered('flg_is_correct')
-                correct_ids = set(correct_options.ids)
-                correct_values = set(
-                    (opt.value or opt.display_name or '').strip()
-                    for opt in correct_options
-                    if (opt.value or opt.display_name or '').strip()
+            if self.id_question_option:
+                is_correct = bool(self.id_question_option.flg_is_correct)
+            elif self.val_text:
+                selected_text = (self.val_text or '').strip()
+                is_correct = any(
+                    (opt.value or opt.display_name or '').strip() == selected_text
+                    for opt in opciones_correctas
                 )
-                selected_values = set(v.strip() for v in selected_values if v and v.strip())
-                matched_by_id = bool(selected_ids) and (selected_ids == correct_ids)
-                matched_by_value = bool(selected_values) and (selected_values == correct_values)
-                is_correct = bool(matched_by_id or matched_by_value)
-                status = 'Correcta' if is_correct else 'Incorrecta'
+            return ('Correcta' if is_correct else 'Incorrecta'), is_correct
 
-            else:
-                status = 'Respondida'
+        if question and question.question_type == 'multiple_choice':
+            selected_ids, selected_values = self._get_selected_multiple_choice_data()
+            correct_ids = set(opciones_correctas.ids)
+            correct_values = set(
+                (opt.value or opt.display_name or '').strip()
+                for opt in opciones_correctas
+                if (opt.value or opt.display_name or '').strip()
+            )
+            selected_values = set(v.strip() for v in selected_values if v and v.strip())
+            matched_by_id = bool(selected_ids) and (selected_ids == correct_ids)
+            matched_by_value = bool(selected_values) and (selected_values == correct_values)
+            is_correct = bool(matched_by_id or matched_by_value)
+            return ('Correcta' if is_correct else 'Incorrecta'), is_correct
 
-            record.flg_is_correct_response = is_correct
-            record.nam_review_status = status
-            record.des_review_html = record._build_review_html(status, is_correct)
+        return 'Respondida', False
 
     def _get_selected_multiple_choice_data(self):
         self.ensure_one()
@@ -440,9 +505,11 @@ class SurveyResponseLine(models.Model):
                 f'</div>'
             )
 
-        audio_record = self.env['survey.response.audio'].search([
-            ('id_response_line', '=', self.id),
-        ], limit=1)
+        audio_record = self.env['survey.response.audio']
+        if self.id_response_header and isinstance(self.id, int):
+            audio_record = self.id_response_header._get_indexed_audios(
+                response_line=self
+            )[:1]
 
         if audio_record and audio_record.id_adjunto:
             att = audio_record.id_adjunto
@@ -451,6 +518,7 @@ class SurveyResponseLine(models.Model):
                 f'border:1px solid #bae6fd;border-radius:10px;">'
                 f'<div style="font-size:13px;color:#0369a1;font-weight:600;margin-bottom:8px;">'
                 f'🎙 Grabación de voz</div>'
+                f'{self._build_audio_triage_html(audio_record)}'
                 f'<audio controls preload="none" style="width:100%;max-width:400px;" '
                 f'src="/web/content/{att.id}?download=false">'
                 f'Tu navegador no soporta reproducción de audio.'
@@ -467,6 +535,37 @@ class SurveyResponseLine(models.Model):
 
         return Markup(''.join(html_parts))
 
+    def _build_audio_triage_html(self, audio_record):
+        """
+        Métricas y forma de onda calculadas por el post-procesamiento del
+        audio, para revisar sin descargar la grabación.
+        """
+        if audio_record.estado_procesamiento != 'procesado':
+            return ''
+
+        silencio_pct = round((audio_record.ratio_silencio or 0.0) * 100)
+        html = (
+            f'<div style="display:flex;gap:16px;flex-wrap:wrap;font-size:12px;color:#075985;margin-bottom:8px;">'
+            f'<span>Duración: <b>{audio_record.duracion_seg:.1f} s</b></span>'
+            f'<span>Pico: <b>{audio_record.pico_dbfs:.1f} dBFS</b></span>'
+            f'<span>RMS: <b>{audio_record.rms_dbfs:.1f} dBFS</b></span>'
+            f'<span>Silencio: <b>{silencio_pct}%</b></span>'
+            f'</div>'
+        )
+
+        puntos = audio_record.forma_onda or []
+        if puntos:
+            barras = ''.join(
+                f'<rect x="{i * 3}" y="{(100 - p) / 2:.1f}" width="2" height="{max(p, 1)}" fill="#0284c7"/>'
+                for i, p in enumerate(puntos)
+            )
+            html += (
+                f'<svg viewBox="0 0 {len(puntos) * 3} 100" preserveAspectRatio="none" '
+                f'style="width:100%;max-width:400px;height:40px;display:block;margin-bottom:8px;">'
+                f'{barras}</svg>'
+            )
+        return html
+
     def _build_reading_grid_html(self, rows, cols, cells):
         total_cells = rows * cols
         selected = sum(
@@ -593,10 +692,7 @@ class SurveyResponseLine(models.Model):
         if not question.exists():
             raise ValueError('No existe una pregunta con ID: %s' % id_question)
 
-        existing_lines = self.search([
-            ('id_response_header', '=', id_response_header),
-            ('id_question', '=', id_question),
-        ])
+        existing_lines = response_header._get_indexed_response_lines(question)
         if existing_lines:
             existing_lines.unlink()
 
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# Índice de respuestas por pregunta para un survey.user_input.
+#
+# Varias rutas (condiciones de finalización, guardado de grids, audio
+# automático y vista de revisión) necesitan, para una misma aplicación,
+# las líneas nativas, las líneas extensibles y los audios de una pregunta.
+# En lugar de buscar/filtrar cada vez, se construye un índice con tres
+# lecturas masivas y se reutiliza mientras dure el cursor. El índice solo
+# guarda ids (los valores siguen viniendo de la caché del ORM); cualquier
+# create/unlink, o write que mueva una línea, lo invalida. Un rollback
+# (completo o a un savepoint) o un borrado en cascada en la base no pasan
+# por el ORM: por eso los ids se comprueban con exists() al usarlos y el
+# índice se descarta si alguno ya no está, y un rollback completo lo vacía.
+
+from collections import defaultdict
+
+from odoo import api, models
+
+ANSWER_INDEX_CACHE_KEY = 'ailmx_answer_index'
+
+
+class SurveyUserInputAnswerIndex(models.Model):
+    _inherit = 'survey.user_input'
+
+    # =========================================================
+    # CONSTRUCCIÓN / INVALIDACIÓN
+    # =========================================================
+
+    def _get_answer_index(self):
+        """
+        Devuelve el índice de respuestas de esta aplicación:
+            {
+                'native': {question_id: [survey.user_input.line ids]},
+                'custom': {question_id: [survey.response.line ids]},
+                'audio': {question_id: [survey.response.audio ids]},
+                'audio_by_line': {response_line_id: [survey.response.audio ids]},
+            }
+        Se guarda en la caché del cursor, así que se construye una sola vez
+        por petición salvo que se invalide.
+        """
+        self.ensure_one()
+        cr = self.env.cr
+        cache = cr.cache.get(ANSWER_INDEX_CACHE_KEY)
+        if cache is None:
+            cache = cr.cache[ANSWER_INDEX_CACHE_KEY] = {}
+            cr.postrollback.add(cache.clear)
+        index = cache.get(self.id)
+        if index is None:
+            index = self._build_answer_index()
+            cache[self.id] = index
+        return index
+
+    def _build_answer_index(self):
+        self.ensure_one()
+
+        native = defaultdict(list)
+        custom = defaultdict(list)
+        audio = defaultdict(list)
+        audio_by_line = defaultdict(list)
+
+        # Lectura 1: líneas nativas (se precargan los campos de valor que
+        # usan _get_question_answer_value y el guardado de grids).
+        native_lines = self.env['survey.user_input.line'].sudo().search_fetch(
+            [('user_input_id', '=', self.id)],
+            [
+                'question_id', 'suggested_answer_id', 'value_char_box',
+                'value_text_box', 'value_numerical_box', 'value_date',
+                'value_datetime',
+            ],
+        )
+        for line in native_lines:
+            native[line.question_id.id].append(line.id)
+
+        # Lectura 2: líneas extensibles survey.response.line
+        custom_lines = self.env['survey.response.line'].sudo().search_fetch(
+            [('id_response_header', '=', self.id)],
+            ['id_question'],
+        )
+        for line in custom_lines:
+            custom[line.id_question.id].append(line.id)
+
+        # Lectura 3: audios asociados
+        audios = self.env['survey.response.audio'].sudo().search_fetch(
+            [('id_response_header', '=', self.id)],
+            ['id_question', 'id_response_line', 'id_adjunto'],
+        )
+        for rec in audios:
+            audio[rec.id_question.id].append(rec.id)
+            audio_by_line[rec.id_response_line.id].append(rec.id)
+
+        return {
+            'native': dict(native),
+            'custom': dict(custom),
+            'audio': dict(audio),
+            'audio_by_line': dict(audio_by_line),
+        }
+
+    def _invalidate_answer_index(self, user_input_ids=None):
+        """Descarta el índice de las aplicaciones indicadas (o de self)."""
+        cache = self.env.cr.cache.get(ANSWER_INDEX_CACHE_KEY)
+        if not cache:
+            return
+        ids = user_input_ids if user_input_ids is not None else self.ids
+        for user_input_id in ids:
+            cache.pop(user_input_id, None)
+
+    # =========================================================
+    # CONSULTAS
+    # =========================================================
+
+    def _browse_indexed(self, model_name, ids):
+        """
+        Registros vigentes de ``ids``. Si alguno desapareció sin pasar por
+        el ORM (rollback a un savepoint, cascada en la base), el índice de
+        esta aplicación se descarta para reconstruirlo en la próxima consulta.
+        """
+        records = self.env[model_name].browse(ids)
+        if not ids:
+            return records
+        existing = records.exists()
+        if len(existing) != len(records):
+            self._invalidate_answer_index()
+        return existing
+
+    def _get_indexed_native_lines(self, question):
+        ids = self._get_answer_index()['native'].get(question.id, [])
+        return self._browse_indexed('survey.user_input.line', ids)
+
+    def _get_indexed_response_lines(self, question):
+        ids = self._get_answer_index()['custom'].get(question.id, [])
+        return self._browse_indexed('survey.response.line', ids)
+
+    def _get_indexed_audios(self, question=None, response_line=None):
+        index = self._get_answer_index()
+        if response_line is not None:
+            ids = index['audio_by_line'].get(response_line.id, [])
+        else:
+            ids = index['audio'].get(question.id, [])
+        return self._browse_indexed('survey.response.audio', ids)
+
+
+class SurveyUserInputLineAnswerIndex(models.Model):
+    _inherit = 'survey.user_input.line'
+
+    def _invalidate_parent_answer_index(self, user_input_ids=None):
+        if user_input_ids is None:
+            user_input_ids = self.mapped('user_input_id').ids
+        self.env['survey.user_input']._invalidate_answer_index(user_input_ids)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._invalidate_parent_answer_index()
+        return records
+
+    def write(self, vals):
+        # El índice solo guarda ids: únicamente cambia si se mueve la línea
+        # de aplicación o de pregunta.
+        if not {'user_input_id', 'question_id'} & set(vals):
+            return super().write(vals)
+        user_input_ids = self.mapped('user_input_id').ids
+        res = super().write(vals)
+        self._invalidate_parent_answer_index(
+            user_input_ids + self.mapped('user_input_id').ids
+        )
+        return res
+
+    def unlink(self):
+        user_input_ids = self.mapped('user_input_id').ids
+        res = super().unlink()
+        self._invalidate_parent_answer_index(user_input_ids)
+        return res
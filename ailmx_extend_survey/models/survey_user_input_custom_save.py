@@ -39,10 +39,7 @@ class SurveyUserInputCustomSave(models.Model):
             )
             answer_val = answer if isinstance(answer, str) else str(answer) if answer else ''
             # Eliminar respuesta previa para evitar duplicados
-            self.env['survey.user_input.line'].search([
-                ('user_input_id', '=', self.id),
-                ('question_id', '=', question.id),
-            ]).unlink()
+            self._get_indexed_native_lines(question).unlink()
             native_line = self.env['survey.user_input.line'].create({
                 'user_input_id': self.id,
                 'question_id':   question.id,
@@ -153,10 +150,7 @@ class SurveyUserInputCustomSave(models.Model):
             )
             return False
 
-        response_line = self.env['survey.response.line'].search([
-            ('id_response_header', '=', self.id),
-            ('id_question', '=', question.id),
-        ], limit=1)
+        response_line = self._get_indexed_response_lines(question)[:1]
 
         if not response_line:
             _logger.info(
@@ -176,9 +170,7 @@ class SurveyUserInputCustomSave(models.Model):
             )
             return False
 
-        existing_audio = self.env['survey.response.audio'].sudo().search([
-            ('id_response_line', '=', response_line.id),
-        ])
+        existing_audio = self._get_indexed_audios(response_line=response_line).sudo()
         if existing_audio:
             existing_audio.unlink()
 
@@ -256,16 +248,11 @@ class SurveyUserInputCustomSave(models.Model):
             normalized_answer = str(answer)
             parsed_answer = normalized_answer
 
-        existing_native = self.user_input_line_ids.filtered(
-            lambda line: line.question_id == question
-        )
+        existing_native = self._get_indexed_native_lines(question)
         if existing_native:
             existing_native.unlink()
 
-        existing_custom = self.env['survey.response.line'].search([
-            ('id_response_header', '=', self.id),
-            ('id_question', '=', question.id),
-        ])
+        existing_custom = self._get_indexed_response_lines(question)
         if existing_custom:
             existing_custom.unlink()
 
@@ -343,23 +330,15 @@ class SurveyUserInputCustomSave(models.Model):
             normalized_answer = str(answer)
             parsed_cells = normalized_answer
 
-        existing_native = self.user_input_line_ids.filtered(
-            lambda line: line.question_id == question
-        )
+        existing_native = self._get_indexed_native_lines(question)
         if existing_native:
             existing_native.unlink()
 
-        existing_custom = self.env['survey.response.line'].search([
-            ('id_response_header', '=', self.id),
-            ('id_question', '=', question.id),
-        ])
+        existing_custom = self._get_indexed_response_lines(question)
         if existing_custom:
             existing_custom.unlink()
 
-        existing_audio = self.env['survey.response.audio'].sudo().search([
-            ('id_response_header', '=', self.id),
-            ('id_question', '=', question.id),
-        ])
+        existing_audio = self._get_indexed_audios(question=question).sudo()
         if existing_audio:
             existing_audio.unlink()
 
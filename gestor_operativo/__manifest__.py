@@ -38,6 +38,9 @@
         'data/attribute_definition_data.xml',
         'data/organization_sequence.xml',
         'data/dms_luker_data.xml',
+        'data/import_cron_data.xml',
+        'data/counters_data.xml',
+        'data/participant_cron_data.xml',
 
         # Views
         'views/participant_type_views.xml',
@@ -58,6 +61,7 @@
 
         # Wizard
         'views/participant_import_wizard_views.xml',
+        'views/participant_duplicate_views.xml',
 
         # Programa y Línea de Intervención
         'views/luker_programa_views.xml',
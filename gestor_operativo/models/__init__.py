@@ -9,6 +9,8 @@ from . import participant_identity       # PAR_Identidad
 from . import participant_assignment     # PAR_Asignacion_Contexto
 from . import attribute_definition       # ATR_Definicion + ATR_Opcion
 from . import participant_attribute_value  # PAR_Valor_Dinamico
+from . import participant_context_history  # Contexto a una fecha (vigencias)
+from . import participant_matching       # Conciliación aproximada y duplicados
 from . import application_result         # APP_Sesion
 from . import res_partner_extend         # Integración res.partner ↔ Gestor Operativo
 from . import participant_dms_extend     # Integración luker.participant ↔ DMS
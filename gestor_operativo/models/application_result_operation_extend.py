@@ -100,31 +100,38 @@ class LukerApplicationResultOperationExtend(models.Model):
                 vals['uuid_local'] = str(_uuid.uuid4())
         records = super().create(vals_list)
         # Crear snapshot de contexto automáticamente
-        for rec in records:
-            if rec.participante_id and not rec.snapshot_id:
-                rec._crear_snapshot()
+        records.filtered(
+            lambda r: r.participante_id and not r.snapshot_id
+        )._crear_snapshot()
         return records
 
     # ── Crear snapshot de contexto ────────────────────────────────────────────
     def _crear_snapshot(self):
-        """Congela el contexto del participante en el momento de la sesión."""
-        self.ensure_one()
+        """Congela el contexto del participante en el momento de cada sesión."""
         Snapshot = self.env.get('luker.participant.snapshot')
-        if Snapshot is None or not self.participante_id:
+        sesiones = self.filtered('participante_id')
+        if Snapshot is None or not sesiones:
             return
 
         try:
-            snap = Snapshot.sudo().create({
-                'participante_id': self.participante_id.id,
-                'sesion_id':       self.id,
-                'campana_id':      self.campana_id.id if self.campana_id else False,
-            })
-            self.sudo().write({
-                'snapshot_id':   snap.id,
-                'snapshot_json': snap.contexto_json,
-            })
+            with self.env.cr.savepoint():
+                snaps = Snapshot.sudo().create([{
+                    'participante_id': sesion.participante_id.id,
+                    'sesion_id':       sesion.id,
+                    'campana_id':      sesion.campana_id.id if sesion.campana_id else False,
+                } for sesion in sesiones])
+                for sesion, snap in zip(sesiones, snaps):
+                    sesion.sudo().write({
+                        'snapshot_id':   snap.id,
+                        'snapshot_json': snap.contexto_json,
+                    })
         except Exception as exc:
-            _logger.error('No se pudo crear snapshot para sesión %s: %s', self.id, exc)
+            if len(sesiones) > 1:
+                # Aislar la sesión que falla sin perder el resto
+                for sesion in sesiones:
+                    sesion._crear_snapshot()
+                return
+            _logger.error('No se pudo crear snapshot para sesión %s: %s', sesiones.id, exc)
 
     # ── Acciones de estado ────────────────────────────────────────────────────
     def action_pausar(self):
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Normalización de nombres y documentos para conciliar participantes.
+# Funciones puras (sin modelos): las usan participant_matching y el motor de
+# importación.
+import re
+import unicodedata
+
+
+def normalizar_nombre(texto):
+    """'  José  PÉREZ-Díaz ' → 'jose perez diaz'."""
+    if not texto:
+        return ''
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', texto).split())
+
+
+def normalizar_documento(numero):
+    """'1.023.456-7' / '1023456.0' → '10234567' / '1023456' (mayúsculas, sin separadores)."""
+    if numero is None or numero is False:
+        return ''
+    numero = str(numero).strip()
+    if re.fullmatch(r'\d+\.0+', numero):
+        numero = numero.split('.')[0]
+    return re.sub(r'[^0-9A-Za-z]', '', numero).upper()
@@ -1,6 +1,51 @@
 # -*- coding: utf-8 -*-
 # Entidades: CTX_Unidad_Organizacional (Institución, Sede, Unidad)
+from collections import defaultdict
+
 from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+
+
+def _aplicar_deltas_contador(env, model_name, deltas):
+    """
+    Suma ``deltas`` ({id: delta}) a participante_count con un UPDATE por
+    valor de delta: es atómico frente a cargas concurrentes y no pasa por
+    write() (ni tracking ni recomputes).
+    """
+    por_delta = defaultdict(list)
+    for rec_id, delta in deltas.items():
+        if rec_id and delta:
+            por_delta[delta].append(rec_id)
+    if not por_delta:
+        return
+    Model = env[model_name]
+    for delta, ids in por_delta.items():
+        env.cr.execute(
+            f'UPDATE "{Model._table}" '
+            f'SET participante_count = COALESCE(participante_count, 0) + %s '
+            f'WHERE id = ANY(%s)',
+            (delta, ids),
+        )
+    Model.invalidate_model(['participante_count'])
+
+
+def _recalcular_contador(env, model_name, campo_asignacion):
+    """Recalcula participante_count de todo el modelo con un _read_group."""
+    conteos = dict(env['luker.participant.assignment']._read_group(
+        [('vigencia_hasta', '=', False), (campo_asignacion, '!=', False)],
+        [campo_asignacion], ['__count'],
+    ))
+    Model = env[model_name]
+    env.cr.execute(f'UPDATE "{Model._table}" SET participante_count = 0 '
+                   f'WHERE participante_count IS DISTINCT FROM 0')
+    Model.invalidate_model(['participante_count'])
+    _aplicar_deltas_contador(env, model_name, {rec.id: n for rec, n in conteos.items()})
+
+
+def _check_coordenadas(registros):
+    for rec in registros:
+        if not -90 <= (rec.latitud or 0) <= 90 or not -180 <= (rec.longitud or 0) <= 180:
+            raise ValidationError('Coordenadas fuera de rango.')
 
 
 class LukerOrganization(models.Model):
@@ -42,6 +87,11 @@ class LukerOrganization(models.Model):
         domain="[('state_id', '=', state_id)]",
         help='Municipio (DANE Colombia).',
     )
+    latitud  = fields.Float(
+        string='Latitud', digits=(10, 7),
+        help='Opcional. Con latitud y longitud, las agendas ordenan las visitas '
+             'por recorrido; si falta, se toman las de la primera sede que las tenga.')
+    longitud = fields.Float(string='Longitud', digits=(10, 7))
     telefono = fields.Char(related='partner_id.phone', readonly=True)
     email    = fields.Char(related='partner_id.email',  readonly=True)
     image_128 = fields.Image(related='partner_id.image_128', readonly=True)
@@ -69,8 +119,11 @@ class LukerOrganization(models.Model):
 
     # ── Relaciones ────────────────────────────────────────────
     sede_ids           = fields.One2many('luker.organization.branch', 'institucion_id', string='Sedes')
-    sede_count         = fields.Integer(compute='_compute_counts', string='Sedes')
-    participante_count = fields.Integer(compute='_compute_counts', string='Participantes activos')
+    sede_count         = fields.Integer(compute='_compute_counts', string='Sedes', store=True)
+    participante_count = fields.Integer(
+        string='Participantes activos', readonly=True, copy=False, default=0,
+        help='Asignaciones vigentes. Se mantiene al crear, modificar o '
+             'eliminar asignaciones; "Recalcular contadores" lo repara.')
 
     _sql_constraints = [
         ('partner_unique', 'UNIQUE(partner_id)', 'Esta empresa ya está registrada como institución.'),
@@ -86,12 +139,62 @@ class LukerOrganization(models.Model):
         return super().create(vals_list)
 
 
+    @api.constrains('latitud', 'longitud')
+    def _check_latitud_longitud(self):
+        _check_coordenadas(self)
+
     @api.depends('sede_ids')
     def _compute_counts(self):
         for org in self:
             org.sede_count = len(org.sede_ids)
-            org.participante_count = self.env['luker.participant.assignment'].search_count([
-                ('institucion_id', '=', org.id), ('vigencia_hasta', '=', False)])
+
+    @api.model
+    def action_recalcular_contadores(self):
+        """
+        Reconstruye los contadores de participantes (instituciones, unidades
+        y participantes) por lotes agrupados, para reparar desajustes.
+        """
+        self._recalcular_contadores_contexto()
+        self.env['luker.participant']._recalcular_contadores()
+        return {'type': 'ir.actions.client', 'tag': 'reload'}
+
+    @api.model
+    def _recalcular_contadores_contexto(self):
+        _recalcular_contador(self.env, 'luker.organization', 'institucion_id')
+        _recalcular_contador(self.env, 'luker.organization.unit', 'unidad_id')
+
+    @api.model
+    def _coordenadas(self, ids):
+        """
+        {institución: (lat, lon)} de las instituciones ``ids`` que tienen
+        ubicación, propia o de su primera sede activa con coordenadas.
+        """
+        if not ids:
+            return {}
+        self.flush_model(['latitud', 'longitud'])
+        self.env['luker.organization.branch'].flush_model(
+            ['institucion_id', 'latitud', 'longitud', 'activo'])
+        self.env.cr.execute(
+            '''
+            SELECT o.id,
+                   CASE WHEN o.latitud != 0 OR o.longitud != 0 THEN o.latitud ELSE s.latitud END,
+                   CASE WHEN o.latitud != 0 OR o.longitud != 0 THEN o.longitud ELSE s.longitud END
+              FROM luker_organization o
+              LEFT JOIN LATERAL (
+                   SELECT b.latitud, b.longitud
+                     FROM luker_organization_branch b
+                    WHERE b.institucion_id = o.id AND b.activo
+                      AND (b.latitud != 0 OR b.longitud != 0)
+                    ORDER BY b.id
+                    LIMIT 1) s ON true
+             WHERE o.id = ANY(%s)
+            ''',
+            [list(ids)],
+        )
+        return {
+            org_id: (lat, lon) for org_id, lat, lon in self.env.cr.fetchall()
+            if lat is not None and lon is not None
+        }
 
     def action_abrir_empresa(self):
         return {'type': 'ir.actions.act_window', 'name': 'Empresa — %s' % self.nom_unidad,
@@ -110,8 +213,14 @@ class LukerOrganizationBranch(models.Model):
     nom_sede = fields.Char(string='Nombre de la Sede', required=True, help='Nom_Unidad')
     cod_sede = fields.Char(string='Código', size=20, help='Cod_Unidad')
     activo   = fields.Boolean(string='Activo', default=True)
+    latitud  = fields.Float(string='Latitud', digits=(10, 7))
+    longitud = fields.Float(string='Longitud', digits=(10, 7))
     unidad_ids = fields.One2many('luker.organization.unit', 'sede_id', string='Unidades')
 
+    @api.constrains('latitud', 'longitud')
+    def _check_latitud_longitud(self):
+        _check_coordenadas(self)
+
 
 class LukerOrganizationUnit(models.Model):
     """
@@ -144,12 +253,9 @@ class LukerOrganizationUnit(models.Model):
     cargo    = fields.Char(string='Cargo / Rol')
 
     activo            = fields.Boolean(string='Activo', default=True)
-    participante_count = fields.Integer(compute='_compute_participante_count')
-
-    def _compute_participante_count(self):
-        for u in self:
-            u.participante_count = self.env['luker.participant.assignment'].search_count([
-                ('unidad_id', '=', u.id), ('vigencia_hasta', '=', False)])
+    participante_count = fields.Integer(
+        string='Participantes activos', readonly=True, copy=False, default=0,
+        help='Asignaciones vigentes en la unidad (contador incremental).')
 
     def name_get(self):
         jornadas = dict(self._fields['jornada'].selection)
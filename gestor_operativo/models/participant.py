@@ -112,9 +112,9 @@ class LukerParticipant(models.Model):
 
     # ── Contadores ────────────────────────────────────────────
     sesion_count = fields.Integer(
-        string='Aplicaciones', compute='_compute_sesion_count')
+        string='Aplicaciones', compute='_compute_sesion_count', store=True)
     identidad_count = fields.Integer(
-        string='Identidades', compute='_compute_identidad_count')
+        string='Identidades', compute='_compute_identidad_count', store=True)
 
     notas = fields.Html(string='Notas')
 
@@ -164,13 +164,45 @@ class LukerParticipant(models.Model):
             p.institucion_actual_id = actual.institucion_id if actual else False
             p.unidad_actual_id      = actual.unidad_id      if actual else False
 
+    def _contar_por_participante(self, model_name):
+        """{participante_id: cantidad} en una consulta agrupada."""
+        ids = [pid for pid in self.ids if pid]
+        if not ids:
+            return {}
+        return {
+            participante.id: cantidad
+            for participante, cantidad in self.env[model_name]._read_group(
+                [('participante_id', 'in', ids)], ['participante_id'], ['__count'])
+        }
+
+    @api.depends('sesion_ids')
     def _compute_sesion_count(self):
+        conteos = self._contar_por_participante('luker.application.result')
         for p in self:
-            p.sesion_count = len(p.sesion_ids)
+            p.sesion_count = conteos.get(p.id, 0)
 
+    @api.depends('identidad_ids')
     def _compute_identidad_count(self):
+        conteos = self._contar_por_participante('luker.participant.identity')
         for p in self:
-            p.identidad_count = len(p.identidad_ids)
+            p.identidad_count = conteos.get(p.id, 0)
+
+    @api.model
+    def _recalcular_contadores(self, lote=5000):
+        """Recalcula sesion_count e identidad_count de todos, por lotes."""
+        ids = self.search([]).ids
+        for i in range(0, len(ids), lote):
+            participantes = self.browse(ids[i:i + lote])
+            for fname in ('sesion_count', 'identidad_count'):
+                self.env.add_to_compute(self._fields[fname], participantes)
+            participantes.flush_recordset(['sesion_count', 'identidad_count'])
+            self.env.invalidate_all()
+
+    def unlink(self):
+        # Las asignaciones se borran en cascada desde la base de datos, sin
+        # pasar por su unlink(): se descuentan aquí de los contadores.
+        self.asignacion_contexto_ids._ajustar_contadores_contexto(-1)
+        return super().unlink()
 
     # ── Actions ───────────────────────────────────────────────
     def action_set_activo(self):
@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 # Entidad: PAR_Asignacion_Contexto
+from collections import Counter
+
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
 
+from .organization import _aplicar_deltas_contador
+
+# Campos que cambian a qué contador aporta una asignación
+CAMPOS_CONTADOR = ('institucion_id', 'unidad_id', 'vigencia_hasta')
+
 
 class LukerParticipantAssignment(models.Model):
     _name        = 'luker.participant.assignment'
@@ -12,7 +19,7 @@ class LukerParticipantAssignment(models.Model):
     # ── PAR_Asignacion_Contexto ───────────────────────────────
     participante_id = fields.Many2one(
         'luker.participant', string='Participante',
-        required=True, ondelete='cascade', help='Id_PAR_Participante')
+        required=True, ondelete='cascade', index=True, help='Id_PAR_Participante')
     institucion_id = fields.Many2one(
         'luker.organization', string='Institución',
         required=True, ondelete='restrict', help='Id_CTX_Institucion')
@@ -45,6 +52,39 @@ class LukerParticipantAssignment(models.Model):
         for rec in self:
             rec.es_actual = not rec.vigencia_hasta
 
+    # ── Contadores incrementales de instituciones y unidades ──
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._ajustar_contadores_contexto(+1)
+        return records
+
+    def write(self, vals):
+        if not any(f in vals for f in CAMPOS_CONTADOR):
+            return super().write(vals)
+        self._ajustar_contadores_contexto(-1)
+        res = super().write(vals)
+        self._ajustar_contadores_contexto(+1)
+        return res
+
+    def unlink(self):
+        self._ajustar_contadores_contexto(-1)
+        return super().unlink()
+
+    def _ajustar_contadores_contexto(self, signo):
+        """Suma (o resta) las asignaciones vigentes de self a sus contadores."""
+        vigentes = self.filtered(lambda a: not a.vigencia_hasta)
+        if not vigentes:
+            return
+        por_institucion = Counter(a.institucion_id.id for a in vigentes)
+        por_unidad = Counter(a.unidad_id.id for a in vigentes if a.unidad_id)
+        _aplicar_deltas_contador(
+            self.env, 'luker.organization',
+            {k: signo * v for k, v in por_institucion.items()})
+        _aplicar_deltas_contador(
+            self.env, 'luker.organization.unit',
+            {k: signo * v for k, v in por_unidad.items()})
+
     @api.constrains('vigencia_desde', 'vigencia_hasta')
     def _check_fechas(self):
         for rec in self:
@@ -12,7 +12,7 @@ class LukerParticipantAttributeValue(models.Model):
     # ── PAR_Valor_Dinamico ────────────────────────────────────
     participante_id = fields.Many2one(
         'luker.participant', string='Participante',
-        required=True, ondelete='cascade', help='Id_PAR_Participante')
+        required=True, ondelete='cascade', index=True, help='Id_PAR_Participante')
     definicion_id = fields.Many2one(
         'luker.attribute.definition', string='Atributo',
         required=True, ondelete='restrict', help='Id_ATR_Definicion')
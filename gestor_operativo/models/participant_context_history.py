@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Historial de contexto del participante — consultas a una fecha.
+#
+# Asignaciones (PAR_Asignacion_Contexto) y valores dinámicos (PAR_Valor_Dinamico)
+# guardan su vigencia como [vigencia_desde, vigencia_hasta] (hasta vacío =
+# abierta). Aquí se indexa ese intervalo como daterange (GiST) y se expone
+# _get_contexto_en_fecha() para resolver, en dos consultas, el contexto de
+# muchos participantes a una fecha dada.
+import logging
+
+from odoo import models, fields, api, tools
+
+_logger = logging.getLogger(__name__)
+
+# Intervalo de vigencia como rango cerrado; vigencia_hasta NULL = sin fin.
+# Un hasta anterior al desde (filas heredadas o aún sin validar) haría fallar
+# daterange() en el índice y en las consultas: se acota al desde, así la fila
+# cubre solo ese día. GREATEST no sirve aquí porque ignora el NULL de "sin fin".
+VIGENCIA_RANGO = (
+    "daterange(vigencia_desde, "
+    "CASE WHEN vigencia_hasta < vigencia_desde THEN vigencia_desde "
+    "ELSE vigencia_hasta END, '[]')"
+)
+
+
+def _crear_indice_vigencia(cr, tabla, nombre, nombre_anterior):
+    # El índice con la expresión sin acotar se reemplaza: create_index no
+    # recrea un índice que ya existe con el mismo nombre.
+    cr.execute(f'DROP INDEX IF EXISTS "{nombre_anterior}"')
+    tools.create_index(cr, nombre, tabla, [VIGENCIA_RANGO], method='gist')
+
+
+class LukerParticipantAssignmentHistory(models.Model):
+    _inherit = 'luker.participant.assignment'
+
+    def init(self):
+        _crear_indice_vigencia(
+            self._cr,
+            self._table,
+            'luker_participant_assignment_vigencia_rango_gist',
+            'luker_participant_assignment_vigencia_gist',
+        )
+
+
+class LukerParticipantAttributeValueHistory(models.Model):
+    _inherit = 'luker.participant.attribute.value'
+
+    def init(self):
+        _crear_indice_vigencia(
+            self._cr,
+            self._table,
+            'luker_participant_attribute_value_vigencia_rango_gist',
+            'luker_participant_attribute_value_vigencia_gist',
+        )
+
+    @api.model
+    def _cron_recalcular_vigencia(self):
+        """
+        es_vigente depende de la fecha del día: se recalcula en bloque cada
+        noche con un UPDATE que solo toca las filas que cambian.
+        """
+        self.flush_model(['vigencia_hasta', 'es_vigente'])
+        self.env.cr.execute(
+            f'''
+            UPDATE "{self._table}"
+               SET es_vigente = (vigencia_hasta IS NULL OR vigencia_hasta >= %(hoy)s)
+             WHERE es_vigente IS DISTINCT FROM
+                   (vigencia_hasta IS NULL OR vigencia_hasta >= %(hoy)s)
+            ''',
+            {'hoy': fields.Date.today()},
+        )
+        cambiados = self.env.cr.rowcount
+        self.invalidate_model(['es_vigente'])
+        _logger.info('Vigencia de valores dinámicos: %s registros actualizados.', cambiados)
+        return cambiados
+
+
+class LukerParticipantContextHistory(models.Model):
+    _inherit = 'luker.participant'
+
+    def _get_contexto_en_fecha(self, fecha=None):
+        """
+        Contexto de cada participante de ``self`` vigente en ``fecha`` (hoy
+        por defecto):
+
+            {participante_id: {
+                'asignacion': luker.participant.assignment (0 o 1 registro),
+                'atributos':  luker.participant.attribute.value (uno por atributo),
+            }}
+
+        Si hay varias asignaciones (o valores del mismo atributo) que cubren la
+        fecha, gana la de vigencia_desde más reciente.
+        """
+        fecha = fields.Date.to_date(fecha) or fields.Date.today()
+        ids = [pid for pid in self.ids if pid]
+        resultado = {
+            pid: {
+                'asignacion': self.env['luker.participant.assignment'],
+                'atributos': self.env['luker.participant.attribute.value'],
+            }
+            for pid in ids
+        }
+        if not ids:
+            return resultado
+
+        Assignment = self.env['luker.participant.assignment']
+        Assignment.flush_model(['participante_id', 'vigencia_desde', 'vigencia_hasta'])
+        self.env.cr.execute(
+            f'''
+            SELECT DISTINCT ON (participante_id) participante_id, id
+              FROM "{Assignment._table}"
+             WHERE participante_id = ANY(%(ids)s)
+               AND {VIGENCIA_RANGO} @> %(fecha)s::date
+             ORDER BY participante_id, vigencia_desde DESC, id DESC
+            ''',
+            {'ids': ids, 'fecha': fecha},
+        )
+        filas = self.env.cr.fetchall()
+        asignaciones = Assignment.browse([aid for _pid, aid in filas])
+        for (pid, _aid), asignacion in zip(filas, asignaciones):
+            resultado[pid]['asignacion'] = asignacion
+
+        Value = self.env['luker.participant.attribute.value']
+        Value.flush_model(['participante_id', 'definicion_id', 'activo',
+                           'vigencia_desde', 'vigencia_hasta'])
+        self.env.cr.execute(
+            f'''
+            SELECT DISTINCT ON (participante_id, definicion_id) participante_id, id
+              FROM "{Value._table}"
+             WHERE participante_id = ANY(%(ids)s)
+               AND activo
+               AND {VIGENCIA_RANGO} @> %(fecha)s::date
+             ORDER BY participante_id, definicion_id, vigencia_desde DESC, id DESC
+            ''',
+            {'ids': ids, 'fecha': fecha},
+        )
+        filas = self.env.cr.fetchall()
+        todos = [vid for _pid, vid in filas]
+        por_participante = {}
+        for pid, vid in filas:
+            por_participante.setdefault(pid, []).append(vid)
+        for pid, vids in por_participante.items():
+            resultado[pid]['atributos'] = Value.browse(vids).with_prefetch(todos)
+        return resultado
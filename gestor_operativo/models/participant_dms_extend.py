@@ -2,12 +2,22 @@
 # Integración DMS para luker.participant
 # Solo agrega campos DMS y el método de creación de directorio automático.
 # No modifica ninguna lógica existente de participant.py.
+#
+# Las cargas masivas crean participantes con el contexto ``luker_diferir_dms``:
+# los directorios no se crean en la misma transacción sino en bloque desde el
+# cron cron_crear_directorios_dms (o al abrir los documentos por primera vez).
 import logging
 from odoo import models, fields, api, _
 
 _logger = logging.getLogger(__name__)
 
 _DMS_XMLID_DIRECTORIO = 'gestor_operativo.dms_directory_participantes'
+_CRON_XMLID_DIRECTORIOS = 'gestor_operativo.cron_crear_directorios_dms'
+
+# Participantes por corrida del cron de directorios diferidos
+LOTE_DIRECTORIOS = 2000
+# Intentos fallidos tras los que el cron deja de reintentar un participante
+MAX_INTENTOS_DMS = 3
 
 
 class LukerParticipantDms(models.Model):
@@ -20,7 +30,18 @@ class LukerParticipantDms(models.Model):
         ondelete='set null',
         copy=False,
         help='Directorio DMS personal del participante. '
-             'Se crea automáticamente al guardar el registro.',
+             'Se crea automáticamente al guardar el registro '
+             '(en cargas masivas, en segundo plano).',
+    )
+
+    dms_intentos_fallidos = fields.Integer(
+        string='Intentos fallidos de carpeta',
+        default=0,
+        copy=False,
+        readonly=True,
+        help='Veces que falló la creación del directorio DMS. A partir de '
+             f'{MAX_INTENTOS_DMS} el cron deja de reintentar; se vuelve a '
+             'intentar al abrir los documentos del participante.',
     )
 
     dms_file_count = fields.Integer(
@@ -45,9 +66,38 @@ class LukerParticipantDms(models.Model):
     @api.model_create_multi
     def create(self, vals_list):
         records = super().create(vals_list)
+        if self.env.context.get('luker_diferir_dms'):
+            cron = self.env.ref(_CRON_XMLID_DIRECTORIOS, raise_if_not_found=False)
+            if cron:
+                cron._trigger()
+                return records
         records._ensure_dms_directory()
         return records
 
+    # ── Cron: directorios diferidos ─────────────────────────────────────────
+    @api.model
+    def _cron_crear_directorios_dms(self, limite=LOTE_DIRECTORIOS):
+        """
+        Crea en bloque los directorios pendientes; se re-dispara si quedan.
+        Los participantes que ya fallaron MAX_INTENTOS_DMS veces se excluyen
+        para que no ocupen el lote indefinidamente.
+        """
+        if self.env.get('dms.directory') is None:
+            return 0
+        pendientes = self.search(
+            [('dms_directory_id', '=', False),
+             ('dms_intentos_fallidos', '<', MAX_INTENTOS_DMS)],
+            limit=limite, order='id')
+        intentos_previos = sum(pendientes.mapped('dms_intentos_fallidos'))
+        pendientes._ensure_dms_directory()
+        creados = len(pendientes.filtered('dms_directory_id'))
+        fallidos = sum(pendientes.mapped('dms_intentos_fallidos')) - intentos_previos
+        # Si el lote estaba lleno y avanzó (creó o registró fallos), quedan
+        # más: otra corrida
+        if len(pendientes) >= limite and (creados or fallidos):
+            self.env.ref(_CRON_XMLID_DIRECTORIOS)._trigger()
+        return creados
+
     # ── Método auxiliar: crea directorio si no existe ──────────────────────
     def _ensure_dms_directory(self):
         """
@@ -74,33 +124,69 @@ class LukerParticipantDms(models.Model):
             )
             return
 
-        for participante in self:
-            if participante.dms_directory_id:
-                continue  # ya tiene directorio, no duplicar
+        pendientes = self.filtered(lambda p: not p.dms_directory_id)
+        if not pendientes:
+            return
 
-            nombre = (
-                f'{participante.cod_participante} — '
-                f'{participante.nom_completo or "Sin nombre"}'
+        # Un solo create multi-fila: el ORM resuelve parent_path, nombre
+        # completo y grupos heredados del directorio raíz en bloque.
+        vals_list = [
+            participante._dms_directory_vals(directorio_raiz)
+            for participante in pendientes
+        ]
+        try:
+            with self.env.cr.savepoint():
+                directorios = DmsDirectory.sudo().create(vals_list)
+        except Exception as exc:
+            _logger.warning(
+                'Creación en bloque de %s directorios DMS falló (%s); '
+                'se intenta uno por uno.', len(pendientes), exc,
             )
+            pendientes._ensure_dms_directory_uno_a_uno(directorio_raiz)
+            return
+
+        for participante, directorio in zip(pendientes, directorios):
+            participante.sudo().dms_directory_id = directorio.id
+        _logger.info(
+            'Directorios DMS creados para %s participantes', len(pendientes),
+        )
+
+    def _dms_directory_vals(self, directorio_raiz):
+        self.ensure_one()
+        return {
+            'name': (
+                f'{self.cod_participante} — '
+                f'{self.nom_completo or "Sin nombre"}'
+            ),
+            'parent_id': directorio_raiz.id,
+            'storage_id': directorio_raiz.storage_id.id,
+            'res_model': 'luker.participant',
+            'res_id': self.id,
+            'inherit_group_ids': True,
+        }
+
+    def _ensure_dms_directory_uno_a_uno(self, directorio_raiz):
+        """Respaldo del create en bloque: aísla los participantes que fallan."""
+        DmsDirectory = self.env['dms.directory']
+        for participante in self:
             try:
-                directorio = DmsDirectory.sudo().create({
-                    'name': nombre,
-                    'parent_id': directorio_raiz.id,
-                    'storage_id': directorio_raiz.storage_id.id,
-                    'res_model': 'luker.participant',
-                    'res_id': participante.id,
-                    'inherit_group_ids': True,
-                })
-                participante.sudo().dms_directory_id = directorio.id
+                with self.env.cr.savepoint():
+                    directorio = DmsDirectory.sudo().create(
+                        participante._dms_directory_vals(directorio_raiz)
+                    )
+                    participante.sudo().dms_directory_id = directorio.id
                 _logger.info(
                     'Directorio DMS creado para participante %s (id=%s)',
                     participante.cod_participante,
                     participante.id,
                 )
             except Exception as exc:
+                participante.sudo().dms_intentos_fallidos += 1
                 _logger.error(
-                    'No se pudo crear el directorio DMS para %s: %s',
+                    'No se pudo crear el directorio DMS para %s '
+                    '(intento %s): %s',
                     participante.cod_participante,
+                    participante.dms_intentos_fallidos,
                     exc,
                 )
 
@@ -1,6 +1,36 @@
 # -*- coding: utf-8 -*-
 # Entidades: OPE_Carga_Poblacion + OPE_Carga_Poblacion_Detalle
-from odoo import models, fields
+import base64
+import json
+import logging
+import time
+from itertools import islice
+
+from odoo import models, fields, api
+from odoo.tools import config
+
+from ..tools.participant_import_engine import ParticipantImportEngine, new_counters
+from ..tools.participant_import_reader import iter_file_rows
+
+_logger = logging.getLogger(__name__)
+
+# Ejecución en segundo plano: filas por lote confirmado y tiempo máximo por
+# corrida del cron antes de re-dispararse. La corrida usa como máximo esta
+# fracción del límite real del worker de cron, con LIMITE_SEGUNDOS_CRON de
+# tope cuando el servidor no tiene límite.
+TAMANO_LOTE_DEFECTO = 1000
+LIMITE_SEGUNDOS_CRON = 240
+FRACCION_LIMITE_WORKER = 0.5
+
+
+def _limite_segundos_cron():
+    """Segundos que puede durar una corrida sin que el worker la mate."""
+    limite = config.get('limit_time_real_cron')
+    if limite is None or limite < 0:
+        limite = config.get('limit_time_real')
+    if not limite or limite <= 0:
+        return LIMITE_SEGUNDOS_CRON
+    return min(LIMITE_SEGUNDOS_CRON, limite * FRACCION_LIMITE_WORKER)
 
 
 class LukerParticipantImportLog(models.Model):
@@ -20,6 +50,10 @@ class LukerParticipantImportLog(models.Model):
     archivo_data = fields.Binary(
         string='Archivo cargado', readonly=True, attachment=True,
         help='Archivo Excel original — conservado para auditoría')
+    archivo_normalizado = fields.Binary(
+        string='Archivo normalizado', readonly=True, attachment=True,
+        help='Copia TSV comprimida (gzip) generada al analizar el archivo; '
+             'es la que leen la importación y los lotes en segundo plano.')
     fuente_formato = fields.Selection([
         ('simat',  'SIMAT — Anexo 6A'),
         ('manual', 'Plantilla manual Luker'),
@@ -31,6 +65,8 @@ class LukerParticipantImportLog(models.Model):
     # ── Estado y contadores ───────────────────────────────────
     estado_carga = fields.Selection([
         ('borrador',  'Borrador'),
+        ('en_cola',   'En cola'),
+        ('en_proceso', 'En proceso'),
         ('completo',  'Completo'),
         ('parcial',   'Parcial (con errores)'),
         ('fallido',   'Fallido'),
@@ -44,6 +80,24 @@ class LukerParticipantImportLog(models.Model):
     filas_omitidas  = fields.Integer(string='Filas omitidas', readonly=True)
     alertas_vacios  = fields.Integer(string='Alertas de datos vacíos', readonly=True)
 
+    # ── Ejecución por lotes (segundo plano) ───────────────────
+    modo_ejecucion = fields.Selection([
+        ('sincrono',      'Inmediata'),
+        ('segundo_plano', 'En segundo plano por lotes'),
+    ], string='Modo de ejecución', default='sincrono', readonly=True)
+    tamano_lote = fields.Integer(
+        string='Filas por lote', default=TAMANO_LOTE_DEFECTO, readonly=True,
+        help='Cada lote se confirma en la base de datos al terminar.')
+    filas_procesadas = fields.Integer(
+        string='Filas procesadas', readonly=True,
+        help='Filas de datos ya confirmadas. La carga se reanuda desde aquí '
+             'si el proceso se interrumpe.')
+    progreso_pct = fields.Float(
+        string='Progreso %', compute='_compute_progreso_pct', digits=(5, 1))
+    fecha_inicio_proceso = fields.Datetime(string='Inicio del proceso', readonly=True)
+    fecha_fin_proceso    = fields.Datetime(string='Fin del proceso', readonly=True)
+    error_proceso = fields.Text(string='Error del proceso', readonly=True)
+
     # ── Trazabilidad ──────────────────────────────────────────
     usuario_cargue_id = fields.Many2one(
         'res.users', string='Cargado por',
@@ -69,12 +123,179 @@ class LukerParticipantImportLog(models.Model):
         help='JSON {columna_excel: campo_destino} usado en esta carga')
     columnas_omitidas_json = fields.Text(
         string='Columnas omitidas (JSON)', readonly=True)
+    columnas_json = fields.Text(
+        string='Columnas del archivo (JSON)', readonly=True,
+        help='Encabezados en el orden del archivo, para releer las filas.')
+    mapeo_destinos_json = fields.Text(
+        string='Mapeo por campo destino (JSON)', readonly=True,
+        help='JSON {campo_destino: [columnas]} que usa el motor de importación')
+    tipo_participante_id = fields.Many2one(
+        'luker.participant.type', string='Tipo de participante', readonly=True)
+    crear_contactos = fields.Boolean(string='Crear contactos faltantes', readonly=True)
+    crear_organizaciones = fields.Boolean(string='Crear organizaciones faltantes', readonly=True)
 
     # ── Detalle ───────────────────────────────────────────────
     detalle_ids = fields.One2many(
         'luker.participant.import.log.line', 'carga_id', string='Detalle por fila')
     notas = fields.Text(string='Notas del importador')
 
+    @api.depends('filas_procesadas', 'total_filas', 'estado_carga')
+    def _compute_progreso_pct(self):
+        for log in self:
+            if log.estado_carga in ('completo', 'parcial', 'fallido') and not log.error_proceso:
+                log.progreso_pct = 100.0
+            elif log.total_filas:
+                log.progreso_pct = min(100.0, log.filas_procesadas * 100.0 / log.total_filas)
+            else:
+                log.progreso_pct = 0.0
+
+    # ── Ejecución ─────────────────────────────────────────────
+    def _acumular_resultado(self, counters, filas):
+        """Suma al registro los contadores de un lote procesado."""
+        self.ensure_one()
+        self.write({
+            'filas_procesadas': self.filas_procesadas + filas,
+            'filas_validas':    self.filas_validas + counters['creado'] + counters['actualizado'],
+            'filas_omitidas':   self.filas_omitidas + counters['omitido'],
+            'filas_invalidas':  self.filas_invalidas + counters['error'],
+            'alertas_vacios':   self.alertas_vacios + counters['advertencia'],
+        })
+
+    def _finalizar_carga(self):
+        self.ensure_one()
+        if not self.filas_invalidas:
+            estado = 'completo'
+        elif self.filas_validas > 0:
+            estado = 'parcial'
+        else:
+            estado = 'fallido'
+        self.write({'estado_carga': estado, 'fecha_fin_proceso': fields.Datetime.now()})
+
+    def _leer_filas(self, desde=0):
+        self.ensure_one()
+        # Cargas anteriores a la copia normalizada leen el archivo original
+        return iter_file_rows(
+            base64.b64decode(self.archivo_normalizado or self.archivo_data),
+            json.loads(self.columnas_json or '[]'),
+            start=desde,
+        )
+
+    def _ejecutar_sincrono(self):
+        """Procesa todo el archivo en la transacción actual."""
+        self.ensure_one()
+        self.fecha_inicio_proceso = fields.Datetime.now()
+        engine = ParticipantImportEngine(self)
+        filas = list(self._leer_filas())
+        counters = engine.process(filas)
+        self.total_filas = len(filas)
+        self._acumular_resultado(counters, len(filas))
+        self._finalizar_carga()
+        return counters
+
+    def _encolar(self):
+        """Deja la carga lista para el cron de procesamiento por lotes."""
+        self.write({'estado_carga': 'en_cola', 'modo_ejecucion': 'segundo_plano'})
+        self.env.ref('gestor_operativo.cron_procesar_cargas_participantes')._trigger()
+
+    def _procesar_por_lotes(self, limite_segundos=None):
+        """
+        Procesa lotes de ``tamano_lote`` filas desde ``filas_procesadas`` y
+        confirma cada uno. Devuelve True si la carga terminó, False si se
+        agotó el tiempo de esta corrida.
+        """
+        self.ensure_one()
+        inicio = time.monotonic()
+        if limite_segundos is None:
+            limite_segundos = _limite_segundos_cron()
+        if self.estado_carga == 'en_cola':
+            self.write({'estado_carga': 'en_proceso',
+                        'fecha_inicio_proceso': fields.Datetime.now()})
+            self.env.cr.commit()
+
+        engine = ParticipantImportEngine(self)
+        filas = self._leer_filas(desde=self.filas_procesadas)
+        tamano = self.tamano_lote or TAMANO_LOTE_DEFECTO
+        while True:
+            lote = list(islice(filas, tamano))
+            if not lote:
+                self._finalizar_carga()
+                self.env.cr.commit()
+                return True
+            counters = engine.process(lote)
+            self._acumular_resultado(counters, len(lote))
+            self.env.cr.commit()
+            _logger.info('Carga %s: %s/%s filas procesadas.',
+                         self.id, self.filas_procesadas, self.total_filas)
+            # Lo ya confirmado no hace falta en caché; acota la memoria
+            self.env.invalidate_all()
+            if time.monotonic() - inicio > limite_segundos:
+                return False
+
+    @api.model
+    def _cron_procesar_cargas(self):
+        """
+        Avanza las cargas en cola o en proceso. Una carga interrumpida (p. ej.
+        por reinicio del worker) se reanuda desde su último lote confirmado.
+        """
+        inicio = time.monotonic()
+        limite = _limite_segundos_cron()
+        cargas = self.search(
+            [('estado_carga', 'in', ('en_cola', 'en_proceso'))],
+            order='fecha_cargue, id')
+        for carga in cargas:
+            restante = limite - (time.monotonic() - inicio)
+            if restante <= 0:
+                break
+            try:
+                terminada = carga._procesar_por_lotes(restante)
+            except Exception as e:
+                self.env.cr.rollback()
+                _logger.exception('Carga %s: error en procesamiento por lotes', carga.id)
+                carga.write({
+                    'estado_carga': 'fallido',
+                    'error_proceso': str(e)[:2000],
+                    'fecha_fin_proceso': fields.Datetime.now(),
+                })
+                self.env.cr.commit()
+                continue
+            if not terminada:
+                break
+        if self.search_count([('estado_carga', 'in', ('en_cola', 'en_proceso'))]):
+            self.env.ref('gestor_operativo.cron_procesar_cargas_participantes')._trigger()
+
+    def action_reanudar(self):
+        """Vuelve a encolar una carga fallida en segundo plano desde su última fila confirmada."""
+        for log in self.filtered(lambda l: l.modo_ejecucion == 'segundo_plano'
+                                 and l.estado_carga == 'fallido'):
+            log.write({'estado_carga': 'en_proceso', 'error_proceso': False,
+                       'fecha_fin_proceso': False})
+        self.env.ref('gestor_operativo.cron_procesar_cargas_participantes')._trigger()
+
+    def _contadores_por_estado(self):
+        """Filas del detalle por estado_registro, en una sola consulta."""
+        self.ensure_one()
+        counters = new_counters()
+        for estado, cantidad in self.env['luker.participant.import.log.line']._read_group(
+                [('carga_id', '=', self.id)], ['estado_registro'], ['__count']):
+            if estado:
+                counters[estado] = cantidad
+        return counters
+
+    def get_progreso(self):
+        """Estado resumido para que la interfaz consulte el avance."""
+        self.ensure_one()
+        return {
+            'estado': self.estado_carga,
+            'total': self.total_filas,
+            'procesadas': self.filas_procesadas,
+            'progreso': self.progreso_pct,
+            'validas': self.filas_validas,
+            'omitidas': self.filas_omitidas,
+            'invalidas': self.filas_invalidas,
+            'advertencias': self.alertas_vacios,
+            'error': self.error_proceso or '',
+        }
+
     def action_ver_creados(self):
         return {
             'type': 'ir.actions.act_window',
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+# Conciliación aproximada de participantes.
+#
+# Nombres y documentos se guardan normalizados (sin tildes, minúsculas, sin
+# separadores) en columnas indexadas. Si la base tiene pg_trgm, el nombre
+# normalizado lleva además un índice GIN de trigramas y la similitud se
+# calcula en SQL; si no, se usa difflib sobre un conjunto acotado de
+# candidatos. Sobre esto trabaja la detección periódica de duplicados
+# (luker.participant.duplicate).
+import difflib
+import logging
+from collections import defaultdict
+
+from odoo import models, fields, api, tools, _
+
+from .normalizacion import normalizar_documento, normalizar_nombre
+
+_logger = logging.getLogger(__name__)
+
+# Similitud mínima (0-1) para proponer dos nombres como el mismo participante
+UMBRAL_SIMILITUD = 0.75
+# Tamaño máximo de un bloque en la comparación por pares sin pg_trgm
+MAX_BLOQUE_PYTHON = 300
+
+
+def pg_trgm_disponible(cr):
+    """True si la extensión pg_trgm está instalada en la base de datos."""
+    cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    return bool(cr.fetchone())
+
+
+def _similitud_python(a, b):
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+class LukerParticipantMatching(models.Model):
+    _inherit = 'luker.participant'
+
+    nombre_normalizado = fields.Char(
+        string='Nombre normalizado', compute='_compute_nombre_normalizado',
+        store=True, index=True,
+        help='Nombre sin tildes ni signos, en minúsculas; base de la '
+             'conciliación aproximada y la detección de duplicados.')
+
+    @api.depends('nom_completo')
+    def _compute_nombre_normalizado(self):
+        for p in self:
+            p.nombre_normalizado = normalizar_nombre(p.nom_completo)
+
+    def init(self):
+        cr = self._cr
+        if not pg_trgm_disponible(cr):
+            try:
+                with cr.savepoint():
+                    cr.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            except Exception as exc:
+                _logger.info(
+                    'pg_trgm no disponible (%s); la similitud de nombres usa '
+                    'el respaldo en Python.', exc)
+                return
+        tools.create_index(
+            cr,
+            'luker_participant_nombre_normalizado_trgm',
+            self._table,
+            ['nombre_normalizado gin_trgm_ops'],
+            method='gin',
+        )
+
+    @api.model
+    def _buscar_similares(self, nombre, limite=5, umbral=UMBRAL_SIMILITUD):
+        """[(participante, similitud)] con nombre parecido a ``nombre``."""
+        clave = normalizar_nombre(nombre)
+        if not clave:
+            return []
+        self.flush_model(['nombre_normalizado'])
+        cr = self.env.cr
+        if pg_trgm_disponible(cr):
+            cr.execute('SET LOCAL pg_trgm.similarity_threshold = %s', (umbral,))
+            cr.execute(
+                f'''
+                SELECT id, similarity(nombre_normalizado, %(clave)s) AS sim
+                  FROM "{self._table}"
+                 WHERE nombre_normalizado %% %(clave)s
+                 ORDER BY sim DESC, id
+                 LIMIT %(limite)s
+                ''',
+                {'clave': clave, 'limite': limite},
+            )
+            filas = cr.fetchall()
+        else:
+            # Candidatos que comparten alguna palabra del nombre
+            dominio = ['|'] * (len(clave.split()) - 1) + [
+                ('nombre_normalizado', 'like', palabra) for palabra in clave.split()
+            ]
+            candidatos = self.search_fetch(dominio, ['nombre_normalizado'], limit=2000)
+            filas = sorted(
+                ((c.id, _similitud_python(clave, c.nombre_normalizado)) for c in candidatos),
+                key=lambda fila: (-fila[1], fila[0]),
+            )
+            filas = [fila for fila in filas if fila[1] >= umbral][:limite]
+        return [(self.browse(pid), sim) for pid, sim in filas]
+
+
+class LukerParticipantIdentityMatching(models.Model):
+    _inherit = 'luker.participant.identity'
+
+    num_normalizado = fields.Char(
+        string='Número normalizado', compute='_compute_num_normalizado',
+        store=True, index=True,
+        help='Número sin puntos, guiones ni espacios, para conciliar '
+             'documentos escritos con formatos distintos.')
+
+    @api.depends('num_identidad')
+    def _compute_num_normalizado(self):
+        for rec in self:
+            rec.num_normalizado = normalizar_documento(rec.num_identidad)
+
+    @api.model
+    def _buscar_por_documento(self, numero, domain=None):
+        """Identidad por número exacto y, si no hay, por número normalizado."""
+        domain = list(domain or [])
+        identidad = self.search([('num_identidad', '=', numero)] + domain, limit=1)
+        if not identidad and normalizar_documento(numero):
+            identidad = self.search(
+                [('num_normalizado', '=', normalizar_documento(numero))] + domain,
+                order='es_principal desc, id', limit=1)
+        return identidad
+
+
+class ResPartnerMatching(models.Model):
+    _inherit = 'res.partner'
+
+    def init(self):
+        # La carga masiva concilia contactos por lower(trim(name))
+        tools.create_index(
+            self._cr,
+            'res_partner_lower_trim_name_idx',
+            self._table,
+            ['lower(trim(name))'],
+        )
+
+
+class LukerParticipantDuplicate(models.Model):
+    _name        = 'luker.participant.duplicate'
+    _description = 'Posible participante duplicado'
+    _order       = 'estado, similitud desc, id desc'
+    _rec_name    = 'participante_a_id'
+
+    participante_a_id = fields.Many2one(
+        'luker.participant', string='Participante A',
+        required=True, readonly=True, ondelete='cascade', index=True)
+    participante_b_id = fields.Many2one(
+        'luker.participant', string='Participante B',
+        required=True, readonly=True, ondelete='cascade', index=True)
+    motivo = fields.Selection([
+        ('documento', 'Mismo documento'),
+        ('nombre',    'Nombre similar'),
+    ], string='Motivo', required=True, readonly=True)
+    similitud = fields.Float(string='Similitud', digits=(3, 2), readonly=True)
+    detalle = fields.Char(string='Detalle', readonly=True)
+    fecha_deteccion = fields.Datetime(
+        string='Detectado', default=fields.Datetime.now, readonly=True)
+    estado = fields.Selection([
+        ('pendiente',  'Pendiente'),
+        ('confirmado', 'Duplicado confirmado'),
+        ('descartado', 'Descartado'),
+    ], string='Estado', default='pendiente', required=True)
+
+    _sql_constraints = [
+        ('par_unico', 'UNIQUE(participante_a_id, participante_b_id)',
+         'Este par de participantes ya está registrado.'),
+        ('par_ordenado', 'CHECK(participante_a_id < participante_b_id)',
+         'El par debe registrarse con A < B.'),
+    ]
+
+    def action_confirmar(self):
+        self.write({'estado': 'confirmado'})
+
+    def action_descartar(self):
+        self.write({'estado': 'descartado'})
+
+    # ── Detección ────────────────────────────────────────────
+    @api.model
+    def action_detectar(self):
+        nuevos = self._detectar_duplicados()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Detección de duplicados'),
+                'message': _('%s pares candidatos nuevos.', nuevos),
+                'type': 'success',
+                'next': {'type': 'ir.actions.client', 'tag': 'reload'},
+            },
+        }
+
+    @api.model
+    def _detectar_duplicados(self, umbral=UMBRAL_SIMILITUD):
+        """Recorre toda la población y registra los pares candidatos nuevos."""
+        self.env['luker.participant'].flush_model(
+            ['nombre_normalizado', 'fecha_nacimiento', 'estado'])
+        self.env['luker.participant.identity'].flush_model(
+            ['num_normalizado', 'participante_id'])
+
+        candidatos = {}
+        for a, b, sim, detalle in self._pares_por_documento():
+            candidatos[(a, b)] = ('documento', sim, detalle)
+        if pg_trgm_disponible(self.env.cr):
+            pares = self._pares_por_nombre_sql(umbral)
+        else:
+            pares = self._pares_por_nombre_python(umbral)
+        for a, b, sim, detalle in pares:
+            candidatos.setdefault((a, b), ('nombre', sim, detalle))
+
+        if not candidatos:
+            return 0
+        self.env.cr.execute(
+            f'SELECT participante_a_id, participante_b_id FROM "{self._table}"')
+        existentes = set(self.env.cr.fetchall())
+        vals_list = [
+            {
+                'participante_a_id': a, 'participante_b_id': b,
+                'motivo': motivo, 'similitud': sim, 'detalle': detalle,
+            }
+            for (a, b), (motivo, sim, detalle) in candidatos.items()
+            if (a, b) not in existentes
+        ]
+        self.create(vals_list)
+        _logger.info('Duplicados: %s pares candidatos nuevos (%s evaluados).',
+                     len(vals_list), len(candidatos))
+        return len(vals_list)
+
+    def _pares_por_documento(self):
+        """Participantes distintos con el mismo documento normalizado."""
+        self.env.cr.execute('''
+            SELECT DISTINCT a.participante_id, b.participante_id, a.num_normalizado
+              FROM luker_participant_identity a
+              JOIN luker_participant_identity b
+                ON b.num_normalizado = a.num_normalizado
+               AND a.participante_id < b.participante_id
+             WHERE a.num_normalizado IS NOT NULL AND a.num_normalizado != ''
+        ''')
+        for a, b, numero in self.env.cr.fetchall():
+            yield a, b, 1.0, _('Documento %s', numero)
+
+    def _pares_por_nombre_sql(self, umbral):
+        """
+        Nombres similares por trigramas (índice GIN). Si ambos tienen fecha
+        de nacimiento, debe coincidir.
+        """
+        cr = self.env.cr
+        cr.execute('SET LOCAL pg_trgm.similarity_threshold = %s', (umbral,))
+        cr.execute('''
+            SELECT a.id, b.id,
+                   similarity(a.nombre_normalizado, b.nombre_normalizado),
+                   a.nombre_normalizado, b.nombre_normalizado
+              FROM luker_participant a
+              JOIN luker_participant b
+                ON a.id < b.id
+               AND a.nombre_normalizado %% b.nombre_normalizado
+             WHERE a.estado != 'archivado' AND b.estado != 'archivado'
+               AND similarity(a.nombre_normalizado, b.nombre_normalizado) >= %s
+               AND (a.fecha_nacimiento IS NULL OR b.fecha_nacimiento IS NULL
+                    OR a.fecha_nacimiento = b.fecha_nacimiento)
+        ''', (umbral,))
+        for a, b, sim, nombre_a, nombre_b in cr.fetchall():
+            yield a, b, sim, f'{nombre_a} ~ {nombre_b}'
+
+    def _pares_por_nombre_python(self, umbral):
+        """
+        Respaldo sin pg_trgm: compara por pares dentro de bloques (misma
+        fecha de nacimiento, o mismo primer apellido si no la hay).
+        """
+        participantes = self.env['luker.participant'].search_read(
+            [('estado', '!=', 'archivado'), ('nombre_normalizado', '!=', False)],
+            ['nombre_normalizado', 'fecha_nacimiento'], order='id')
+        bloques = defaultdict(list)
+        for p in participantes:
+            palabras = p['nombre_normalizado'].split()
+            clave = p['fecha_nacimiento'] or (palabras[-2] if len(palabras) > 1 else palabras[0])
+            bloques[clave].append((p['id'], p['nombre_normalizado']))
+
+        for bloque in bloques.values():
+            if len(bloque) > MAX_BLOQUE_PYTHON:
+                _logger.info('Duplicados: bloque de %s participantes recortado a %s.',
+                             len(bloque), MAX_BLOQUE_PYTHON)
+                bloque = bloque[:MAX_BLOQUE_PYTHON]
+            for i, (id_a, nombre_a) in enumerate(bloque):
+                for id_b, nombre_b in bloque[i + 1:]:
+                    sim = _similitud_python(nombre_a, nombre_b)
+                    if sim >= umbral:
+                        yield id_a, id_b, sim, f'{nombre_a} ~ {nombre_b}'
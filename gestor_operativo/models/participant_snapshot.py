@@ -2,12 +2,21 @@
 # Snapshot de contexto del participante — IMMUTABLE
 # Se crea automáticamente al iniciar una sesión de aplicación.
 # Nunca se modifica. Es la fotografía del participante en ese momento.
+#
+# generar_snapshots() captura en bloque el contexto de una población completa
+# (campaña, institución): pocas lecturas agrupadas y un create multi-fila por
+# lote. El JSON se guarda compacto y con un hash de contenido, de modo que si
+# el contexto no cambió desde el último snapshot del participante se reutiliza.
+import hashlib
 import json
 from odoo import models, fields, api
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Participantes por lote en la generación masiva
+LOTE_SNAPSHOTS = 5000
+
 
 class LukerParticipantSnapshot(models.Model):
     _name        = 'luker.participant.snapshot'
@@ -54,6 +63,11 @@ class LukerParticipantSnapshot(models.Model):
         help='Serialización completa del contexto del participante. '
              'Este campo nunca se modifica después de creado.',
     )
+    hash_contexto = fields.Char(
+        string='Hash del contexto', readonly=True, index=True, copy=False,
+        help='SHA-1 de contexto_json; permite reutilizar el último snapshot '
+             'si el contexto no cambió.',
+    )
 
     display_name = fields.Char(
         compute='_compute_display_name', store=False,
@@ -69,45 +83,143 @@ class LukerParticipantSnapshot(models.Model):
     # ── ORM: congelar contexto al crear ───────────────────────────────────────
     @api.model_create_multi
     def create(self, vals_list):
-        for vals in vals_list:
-            participante_id = vals.get('participante_id')
-            if participante_id:
-                participante = self.env['luker.participant'].browse(participante_id)
-                if participante.exists():
-                    vals.update(self._extraer_contexto(participante))
+        pendientes = [
+            vals for vals in vals_list
+            if vals.get('participante_id') and 'contexto_json' not in vals
+        ]
+        if pendientes:
+            participantes = self.env['luker.participant'].browse(
+                list({vals['participante_id'] for vals in pendientes})
+            ).exists()
+            contextos = self._extraer_contexto_lote(participantes)
+            for vals in pendientes:
+                vals.update(contextos.get(vals['participante_id'], {}))
         return super().create(vals_list)
 
     def _extraer_contexto(self, participante):
         """Extrae y serializa el contexto completo del participante."""
-        try:
-            # Atributos dinámicos vigentes
-            atributos = {}
-            for attr in participante.attribute_value_ids.filtered(
-                lambda a: a.es_vigente
-            ):
-                atributos[attr.attribute_id.name] = str(attr.val_value or '')
+        return self._extraer_contexto_lote(participante).get(
+            participante.id, {'contexto_json': '{}'})
 
+    @api.model
+    def _extraer_contexto_lote(self, participantes, fecha=None):
+        """
+        Valores de snapshot ({participante_id: vals}) para todos los
+        participantes, con lecturas agrupadas: contexto a la fecha (asignación
+        y atributos vigentes) y un fetch por modelo.
+        """
+        if not participantes:
+            return {}
+        participantes.fetch([
+            'cod_participante', 'nom_completo', 'tipo_participante_id',
+            'institucion_actual_id', 'estado', 'email',
+        ])
+        contexto_fecha = participantes._get_contexto_en_fecha(fecha)
+        valores = self.env['luker.participant.attribute.value'].union(
+            *(c['atributos'] for c in contexto_fecha.values()))
+        valores.fetch(['definicion_id', 'valor_display'])
+        valores.definicion_id.fetch(['nom_atributo'])
+        asignaciones = self.env['luker.participant.assignment'].union(
+            *(c['asignacion'] for c in contexto_fecha.values()))
+        asignaciones.institucion_id.fetch(['nom_unidad'])
+
+        resultado = {}
+        for participante in participantes:
+            contexto_p = contexto_fecha[participante.id]
+            institucion = (contexto_p['asignacion'].institucion_id
+                           or participante.institucion_actual_id)
             contexto = {
                 'cod_participante':  participante.cod_participante or '',
                 'nom_completo':      participante.nom_completo or '',
                 'tipo':              participante.tipo_participante_id.nom_tipo_participante
                                      if participante.tipo_participante_id else '',
-                'institucion':       participante.institucion_actual_id.nom_unidad
-                                     if participante.institucion_actual_id else '',
+                'institucion':       institucion.nom_unidad or '',
                 'estado':            participante.estado or '',
                 'email':             participante.email or '',
-                'atributos_dinamicos': atributos,
-                'fecha_snapshot':    str(fields.Datetime.now()),
+                'atributos_dinamicos': {
+                    valor.definicion_id.nom_atributo: valor.valor_display or ''
+                    for valor in contexto_p['atributos']
+                },
             }
-            return {
+            contexto_json = json.dumps(
+                contexto, ensure_ascii=False, default=str,
+                separators=(',', ':'), sort_keys=True,
+            )
+            resultado[participante.id] = {
                 'nom_completo':        contexto['nom_completo'],
                 'cod_participante':    contexto['cod_participante'],
                 'tipo_participante':   contexto['tipo'],
                 'institucion':         contexto['institucion'],
                 'estado_participante': contexto['estado'],
-                'contexto_json':       json.dumps(contexto, ensure_ascii=False, default=str),
+                'contexto_json':       contexto_json,
+                'hash_contexto':       hashlib.sha1(contexto_json.encode()).hexdigest(),
             }
-        except Exception as exc:
-            _logger.error('Error extrayendo contexto del participante %s: %s',
-                          participante.id, exc)
-            return {'contexto_json': '{}'}
+        return resultado
+
+    # ── Generación masiva ─────────────────────────────────────────────────────
+    @api.model
+    def generar_snapshots(self, participantes, campana_id=False, deduplicar=True):
+        """
+        Congela el contexto de ``participantes`` por lotes. Con
+        ``deduplicar``, el participante cuyo contexto coincide (mismo hash)
+        con su último snapshot de la misma campaña (o sin campaña) no genera
+        uno nuevo: se devuelve el existente. Devuelve los snapshots creados
+        más los reutilizados.
+        """
+        Snapshot = self.sudo()
+        ids = participantes.ids
+        resultado_ids = []
+        for i in range(0, len(ids), LOTE_SNAPSHOTS):
+            lote = participantes.browse(ids[i:i + LOTE_SNAPSHOTS])
+            contextos = Snapshot._extraer_contexto_lote(lote)
+            previos = (
+                Snapshot._ultimo_hash_por_participante(lote.ids, campana_id)
+                if deduplicar else {}
+            )
+
+            vals_list = []
+            for participante in lote:
+                vals = contextos[participante.id]
+                previo = previos.get(participante.id)
+                if previo and previo[1] == vals.get('hash_contexto'):
+                    resultado_ids.append(previo[0])
+                    continue
+                vals_list.append(dict(
+                    vals, participante_id=participante.id, campana_id=campana_id))
+            resultado_ids.extend(Snapshot.create(vals_list).ids)
+            _logger.info(
+                'Snapshots: %s creados, %s reutilizados (lote de %s participantes).',
+                len(vals_list), len(lote) - len(vals_list), len(lote),
+            )
+        return self.browse(resultado_ids)
+
+    @api.model
+    def generar_snapshots_institucion(self, institucion_ids, deduplicar=True):
+        """Snapshots de los participantes activos de las instituciones."""
+        participantes = self.env['luker.participant'].search([
+            ('institucion_actual_id', 'in', institucion_ids),
+            ('estado', '=', 'activo'),
+        ])
+        return self.generar_snapshots(participantes, deduplicar=deduplicar)
+
+    @api.model
+    def _ultimo_hash_por_participante(self, participante_ids, campana_id=False):
+        """
+        {participante_id: (snapshot_id, hash)} del snapshot más reciente de
+        ``campana_id`` (sin campaña si es False): un snapshot de otra campaña
+        no congela el contexto de esta.
+        """
+        if not participante_ids:
+            return {}
+        self.flush_model(['participante_id', 'campana_id', 'fecha_snapshot', 'hash_contexto'])
+        self.env.cr.execute(
+            f'''
+            SELECT DISTINCT ON (participante_id) participante_id, id, hash_contexto
+              FROM "{self._table}"
+             WHERE participante_id = ANY(%s)
+               AND campana_id IS NOT DISTINCT FROM %s
+             ORDER BY participante_id, fecha_snapshot DESC, id DESC
+            ''',
+            (list(participante_ids), campana_id or None),
+        )
+        return {pid: (sid, h) for pid, sid, h in self.env.cr.fetchall()}
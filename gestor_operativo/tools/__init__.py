@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+# Lectura y procesamiento de cargas de participantes, sin modelos propios:
+# los usan el wizard de importación y el cron de cargas por lotes.
+from . import participant_import_engine
+from . import participant_import_reader
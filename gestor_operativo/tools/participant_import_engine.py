@@ -0,0 +1,970 @@
+# -*- coding: utf-8 -*-
+# Motor de importación de participantes (SIMAT / Excel / CSV).
+#
+# Contiene la conciliación y escritura fila a fila, separada del wizard para
+# que la misma lógica sirva a la importación inmediata (una sola petición) y
+# a la ejecución en segundo plano por lotes confirmados desde
+# luker.participant.import.log.
+#
+# Cada lote se procesa en dos fases: se planifica cada fila contra los
+# índices precargados (sin escribir) y luego se escribe el lote con un
+# create(vals_list) por modelo. Si la escritura del lote falla, se divide en
+# mitades hasta aislar las filas que realmente fallan.
+import json
+import logging
+from datetime import date, datetime
+
+from odoo import fields
+
+from ..models.normalizacion import normalizar_documento
+
+_logger = logging.getLogger(__name__)
+
+# Código SIMAT → nombre tipo identificación en l10n_latam
+SIMAT_DOC_TYPE_NAMES = {
+    1: 'Registro Civil',         '1': 'Registro Civil',
+    2: 'Tarjeta de Identidad',   '2': 'Tarjeta de Identidad',
+    3: 'Cédula de Ciudadanía',   '3': 'Cédula de Ciudadanía',
+    4: 'Tarjeta de Extranjería', '4': 'Tarjeta de Extranjería',
+    5: 'Cédula de Extranjería',  '5': 'Cédula de Extranjería',
+    6: 'NIT',                    '6': 'NIT',
+    7: 'Pasaporte',              '7': 'Pasaporte',
+    11: 'NUIP',                  '11': 'NUIP',
+    12: 'NIT',                   '12': 'NIT',
+    13: 'Cédula de Ciudadanía',  '13': 'Cédula de Ciudadanía',
+}
+
+GENDER_MAP = {
+    'M': 'masculino', 'H': 'masculino', 'MASCULINO': 'masculino', '1': 'masculino',
+    'F': 'femenino',  'FEMENINO': 'femenino', '2': 'femenino',
+}
+JORNADA_MAP = {
+    '1': 'manana', '2': 'manana', '3': 'tarde', '4': 'noche', '5': 'unica', '6': 'unica',
+    1: 'manana', 2: 'manana', 3: 'tarde', 4: 'noche', 5: 'unica', 6: 'unica',
+    'MAÑANA': 'manana', 'MANANA': 'manana', 'TARDE': 'tarde',
+    'NOCHE': 'noche', 'ÚNICA': 'unica', 'UNICA': 'unica',
+}
+ZONE_MAP = {'1': 'urbana', '2': 'rural', 1: 'urbana', 2: 'rural',
+            'URBANA': 'urbana', 'RURAL': 'rural'}
+
+# ─────────────────────────────────────────────────────────────────
+# Candidatos de campos en res.partner — se prueban en orden
+# ─────────────────────────────────────────────────────────────────
+PARTNER_FIELD_CANDIDATES = {
+    'first_name':     ['first_name', 'firstname', 'l10n_latam_first_name', 'x_first_name',
+                       'primer_nombre', 'x_primer_nombre'],
+    'second_name':    ['other_name', 'second_name', 'middlename', 'l10n_latam_second_name',
+                       'x_other_name', 'otros_nombres', 'x_otros_nombres', 'segundo_nombre'],
+    'first_surname':  ['first_lastname', 'lastname', 'l10n_latam_first_lastname',
+                       'x_first_lastname', 'primer_apellido', 'x_primer_apellido'],
+    'second_surname': ['second_lastname', 'l10n_latam_second_lastname',
+                       'x_second_lastname', 'segundo_apellido', 'x_segundo_apellido'],
+    'birthdate':      ['birthdate', 'birth_date', 'x_birthdate', 'fecha_nacimiento',
+                       'x_fecha_nacimiento'],
+    'gender_bio':     ['biological_sex', 'x_biological_sex', 'gender', 'sex',
+                       'sexo_biologico', 'x_sexo_biologico', 'x_gender'],
+    'gender_id':      ['gender_id', 'x_gender_id', 'sex_id', 'identification_gender',
+                       'sexo_identificacion', 'x_sexo_identificacion'],
+    'civil_state':    ['marital', 'civil_state', 'estado_civil', 'x_civil_state',
+                       'x_estado_civil'],
+    'street':         ['street'],
+    'zone':           ['zone', 'zona', 'x_zone', 'x_zona'],
+    'sisben_bool':    ['sisben', 'x_sisben', 'has_sisben', 'x_has_sisben'],
+    'sisben_class':   ['sisben_classification', 'x_sisben_classification', 'sisben_iv',
+                       'x_sisben_iv', 'clasificacion_sisben', 'x_clasificacion_sisben'],
+    'disability':     ['disability', 'x_disability', 'discapacidad', 'x_discapacidad',
+                       'has_disability', 'x_has_disability'],
+    'disability_type':['disability_type', 'x_disability_type', 'tipo_discapacidad',
+                       'x_tipo_discapacidad'],
+    'victim':         ['victim_conflict', 'x_victim_conflict', 'victima_conflicto',
+                       'x_victima_conflicto', 'pob_vict_conf_ruv', 'x_pob_vict_conf_ruv'],
+    'estrato':        ['stratum', 'x_stratum', 'estrato', 'x_estrato',
+                       'socioeconomic_stratum', 'x_socioeconomic_stratum',
+                       'estrato_socioeconomico', 'x_estrato_socioeconomico'],
+    'exp_place':      ['expedition_place', 'x_expedition_place', 'lugar_expedicion',
+                       'x_lugar_expedicion'],
+    'id_type':        ['l10n_latam_identification_type_id'],
+    'doc_number':     ['l10n_latam_document_number', 'vat'],
+    'phone':          ['phone'],
+    'mobile':         ['mobile'],
+}
+
+# Patrones en etiquetas de campo (field.string) para detección por label
+LABEL_PATTERNS = {
+    'first_name':     ['primer nombre', 'first name', 'nombre 1', 'nombre1'],
+    'second_name':    ['otros nombres', 'second name', 'nombre 2', 'nombre2', 'otro nombre'],
+    'first_surname':  ['primer apellido', 'first lastname', 'apellido 1', 'apellido1'],
+    'second_surname': ['segundo apellido', 'second lastname', 'apellido 2', 'apellido2'],
+    'estrato':        ['estrato', 'stratum', 'estrato socioeconómico'],
+    'sisben_bool':    ['sisben'],
+    'sisben_class':   ['clasificación sisben', 'sisben iv', 'clasificacion sisben'],
+    'disability':     ['discapacidad'],
+    'disability_type':['tipo de discapacidad'],
+    'victim':         ['víctima', 'victima', 'conflicto'],
+    'zone':           ['zona'],
+    'gender_bio':     ['sexo biológico', 'sexo biologico', 'biological sex'],
+}
+
+# Valores que el archivo usa como "sin dato"
+EMPTY_VALUES = ('', 'None', 'NO APLICA', '99', '0')
+
+# Contadores de resultado por fila (coinciden con estado_registro del detalle)
+RESULT_STATES = ('creado', 'actualizado', 'omitido', 'error', 'advertencia')
+
+
+def _resolve_partner_fields(partner_obj):
+    """
+    Descubre campos de res.partner en dos pasos:
+    1. Por nombre técnico (PARTNER_FIELD_CANDIDATES)
+    2. Por etiqueta visible (LABEL_PATTERNS) — captura campos x_studio_*
+    """
+    available = partner_obj._fields
+    resolved = {}
+
+    # Paso 1: por nombre técnico
+    for key, candidates in PARTNER_FIELD_CANDIDATES.items():
+        for c in candidates:
+            if c in available:
+                resolved[key] = c
+                break
+
+    # Paso 2: por etiqueta visible (cubre campos creados con Odoo Studio)
+    for fname, fobj in available.items():
+        label = (getattr(fobj, 'string', '') or '').lower()
+        for key, patterns in LABEL_PATTERNS.items():
+            if key not in resolved:
+                if any(p in label for p in patterns):
+                    # Verificar que sea un campo editable (no computed sin inverse)
+                    if not getattr(fobj, 'compute', None) or getattr(fobj, 'inverse', None):
+                        resolved[key] = fname
+                        break
+
+    return resolved
+
+
+def _norm(value):
+    """Clave de conciliación por nombre: equivalente a ``=ilike`` exacto."""
+    return str(value or '').strip().lower()
+
+
+def new_counters():
+    return dict.fromkeys(RESULT_STATES, 0)
+
+
+class ParticipantImportEngine:
+    """
+    Procesa filas ya leídas del archivo contra la configuración guardada en
+    una carga (luker.participant.import.log). No confirma la transacción:
+    quien lo invoca decide si confirma por lote o al final.
+    """
+
+    def __init__(self, log):
+        self.log = log
+        # Los directorios DMS de los participantes nuevos se crean después,
+        # en bloque, desde su propio cron
+        self.env = log.env(context=dict(log.env.context, luker_diferir_dms=True))
+        self.dest_to_cols = json.loads(log.mapeo_destinos_json or '{}')
+        self.action_on_existing = log.accion_existente
+        self.participant_type = log.tipo_participante_id
+        self.create_missing_contacts = log.crear_contactos
+        self.create_missing_orgs = log.crear_organizaciones
+
+        # Precargar tipos de identificación
+        self.all_id_types = self.env['l10n_latam.identification.type'].search([])
+        self.id_type_by_name = {t.name.lower(): t for t in self.all_id_types}
+
+        self._init_indexes()
+
+        # Resolver campos disponibles en res.partner
+        self.pf = _resolve_partner_fields(self.env['res.partner'])
+        _logger.info('Luker Import — campos detectados en res.partner: %s', self.pf)
+        _logger.info(
+            'Luker Import — campos NO encontrados: %s',
+            [k for k in ['first_name', 'second_name', 'first_surname', 'second_surname',
+                         'estrato', 'sisben_bool', 'sisben_class', 'doc_number']
+             if k not in self.pf]
+        )
+
+    # ─────────────────────────────────────────────────────────
+    # API
+    # ─────────────────────────────────────────────────────────
+    def process(self, rows):
+        """
+        Procesa ``rows`` (iterable de (num_fila, dict)). Crea el detalle por
+        fila y devuelve los contadores.
+        """
+        parsed = [(row_num, row, self._parse_row(row)) for row_num, row in rows]
+        self._preload([data for _num, _row, data in parsed])
+
+        log_lines = []
+        plans = []
+        planned_docs = set()
+        for row_num, row, data in parsed:
+            try:
+                plan = self._plan_row(row, data, planned_docs)
+            except Exception as e:
+                _logger.exception('Error fila %s: %s', row_num, e)
+                plan = {'line': {'estado_registro': 'error', 'mensaje_validacion': str(e)[:200]}}
+            plan['row_num'] = row_num
+            if 'line' in plan:
+                log_lines.append(dict(plan['line'], num_fila=row_num))
+            else:
+                plans.append(plan)
+
+        for plan, line in self._execute(plans):
+            log_lines.append(dict(line, num_fila=plan['row_num']))
+
+        log_lines.sort(key=lambda line: line['num_fila'])
+        counters = new_counters()
+        for line in log_lines:
+            line['carga_id'] = self.log.id
+            counters[line['estado_registro']] += 1
+        if log_lines:
+            self.env['luker.participant.import.log.line'].create(log_lines)
+        return counters
+
+    def validate(self, rows):
+        """
+        Simulacro de ``process``: concilia ``rows`` con los mismos índices y
+        la misma planificación, sin escribir. Devuelve, por fila,
+        (num_fila, fila, resultado previsto, observaciones, info). Se puede
+        llamar por tramos: los documentos ya vistos se recuerdan entre
+        llamadas, igual que entre lotes de la importación real.
+        """
+        parsed = [(row_num, row, self._parse_row(row)) for row_num, row in rows]
+        self._preload([data for _num, _row, data in parsed])
+
+        results = []
+        for row_num, row, data in parsed:
+            doc_str = data['doc_str']
+            observaciones = self._check_types(data)
+            info = {'en_bd': bool(doc_str) and doc_str in self.identity_by_doc,
+                    'repetido': False, 'documento': doc_str}
+            if doc_str:
+                primera = self._dry_first_row.setdefault(doc_str, row_num)
+                if primera != row_num:
+                    info['repetido'] = True
+                    observaciones.append(f'Documento repetido en el archivo (fila {primera})')
+            try:
+                plan = self._plan_row(row, data, self._dry_planned)
+            except Exception as e:
+                plan = {'line': {'estado_registro': 'error', 'mensaje_validacion': str(e)[:200]}}
+            if 'line' in plan:
+                resultado = plan['line']['estado_registro']
+                observaciones.insert(0, plan['line']['mensaje_validacion'])
+            else:
+                resultado = 'actualizado' if info['en_bd'] or info['repetido'] else 'creado'
+                if plan['empty_fields']:
+                    observaciones.append('Vacíos: ' + ', '.join(plan['empty_fields']))
+                if (plan['context'] and not self.create_missing_orgs
+                        and data['inst_key'] not in self.org_by_name):
+                    observaciones.append(
+                        f'Institución no encontrada, sin asignación: {data["inst_name"]}')
+            results.append((row_num, row, resultado, observaciones, info))
+        return results
+
+    def _check_types(self, data):
+        """Observaciones de tipo sobre los valores mapeados de la fila."""
+        problemas = []
+        if data['birthdate_raw'] and not self._parse_date(data['birthdate_raw']):
+            problemas.append(f'Fecha de nacimiento no válida: {data["birthdate_raw"]}')
+        code = data['doc_type_code']
+        if code is not None and str(code).strip() not in SIMAT_DOC_TYPE_NAMES:
+            problemas.append(f'Tipo de documento SIMAT desconocido: {code}')
+        jornada_code = data['jornada_code']
+        if jornada_code is not None and str(jornada_code).strip() not in JORNADA_MAP:
+            problemas.append(f'Código de jornada desconocido: {jornada_code}')
+        if data['jornada_name'] and data['jornada_name'] not in JORNADA_MAP:
+            problemas.append(f'Jornada desconocida: {data["jornada_name"]}')
+        if data['gender_raw'] and data['gender_raw'] not in GENDER_MAP:
+            problemas.append(f'Género no reconocido: {data["gender_raw"]}')
+        if data['estrato'] is not None:
+            try:
+                int(str(data['estrato']).strip())
+            except (ValueError, TypeError):
+                problemas.append(f'Estrato no numérico: {data["estrato"]}')
+        return problemas
+
+    def _execute(self, plans):
+        """
+        Escribe ``plans`` en bloque dentro de un savepoint. Si falla, lo
+        reintenta por mitades: solo las filas que fallan por sí solas quedan
+        como error. Devuelve [(plan, detalle)].
+        """
+        if not plans:
+            return []
+        self._journal = []
+        try:
+            with self.env.cr.savepoint():
+                return self._write_batch(plans)
+        except Exception as e:
+            self._undo_journal()
+            if len(plans) == 1:
+                _logger.exception('Error fila %s: %s', plans[0]['row_num'], e)
+                return [(plans[0], {'estado_registro': 'error',
+                                    'cod_persona_externa': plans[0]['doc_str'],
+                                    'mensaje_validacion': str(e)[:200]})]
+            mid = len(plans) // 2
+            return self._execute(plans[:mid]) + self._execute(plans[mid:])
+
+    # ─────────────────────────────────────────────────────────
+    # ÍNDICES DE CONCILIACIÓN
+    # ─────────────────────────────────────────────────────────
+    def _init_indexes(self):
+        """
+        Diccionarios en memoria para conciliar sin consultar por fila.
+        Se completan por lote en _preload y se mantienen al crear registros.
+        """
+        self.identity_by_doc = {}       # num_identidad → participant id
+        self.partner_by_name = {}       # nombre normalizado → res.partner id (persona)
+        self.company_by_name = {}       # nombre normalizado → res.partner id (empresa)
+        self.org_by_name = {}           # nombre normalizado → luker.organization id
+        self.branch_by_key = {}         # (org id, nombre sede) → branch id
+        self.unit_by_key = {}           # (branch id, grado, grupo) → unit id
+        self.with_assignment = set()    # participantes con asignación vigente
+        self.attr_value_keys = set()    # (participante, definición) con valor vigente
+        self._loaded_docs = set()
+        self._loaded_names = set()
+        self._loaded_orgs = set()
+        self._loaded_participants = set()
+        self._journal = []
+        self._warned_fields = set()
+        self._selection_cache = {}
+        self._dry_first_row = {}        # simulacro: documento → primera fila
+        self._dry_planned = set()       # simulacro: documentos ya planificados
+        self.attr_defs = {
+            a['cod_atributo']: a['id']
+            for a in self.env['luker.attribute.definition'].search_read([], ['cod_atributo'])
+        }
+
+    def _remember(self, index, key, value):
+        """Agrega al índice y lo anota para deshacerlo si la fila falla."""
+        if isinstance(index, set):
+            if key not in index:
+                index.add(key)
+                self._journal.append((index, key))
+        elif key not in index:
+            index[key] = value
+            self._journal.append((index, key))
+
+    def _undo_journal(self):
+        # El savepoint revirtió los registros; se quitan también de los índices
+        for index, key in reversed(self._journal):
+            if isinstance(index, set):
+                index.discard(key)
+            else:
+                index.pop(key, None)
+        self._journal = []
+
+    def _preload(self, rows_data):
+        """Carga en bloque lo que necesitan las filas del lote (O(entidades))."""
+        cr = self.env.cr
+
+        docs = {d['doc_str'] for d in rows_data if d['doc_str']} - self._loaded_docs
+        if docs:
+            for ident in self.env['luker.participant.identity'].search_read(
+                    [('num_identidad', 'in', list(docs)), ('es_principal', '=', True)],
+                    ['num_identidad', 'participante_id'], order='id'):
+                self.identity_by_doc.setdefault(
+                    ident['num_identidad'], ident['participante_id'][0])
+            # Mismo documento escrito con otro formato (puntos, guiones, '.0')
+            by_norm = {}
+            for doc in docs - set(self.identity_by_doc):
+                if normalizar_documento(doc):
+                    by_norm.setdefault(normalizar_documento(doc), []).append(doc)
+            if by_norm:
+                for ident in self.env['luker.participant.identity'].search_read(
+                        [('num_normalizado', 'in', list(by_norm)), ('es_principal', '=', True)],
+                        ['num_normalizado', 'participante_id'], order='id'):
+                    for doc in by_norm[ident['num_normalizado']]:
+                        self.identity_by_doc.setdefault(doc, ident['participante_id'][0])
+            self._loaded_docs |= docs
+
+        names = {d['full_name_key'] for d in rows_data} | {d['inst_key'] for d in rows_data}
+        names = {n for n in names if n} - self._loaded_names
+        if names:
+            cr.execute("""
+                SELECT lower(trim(name)), id, is_company
+                  FROM res_partner
+                 WHERE active AND lower(trim(name)) = ANY(%s)
+              ORDER BY id
+            """, [list(names)])
+            for name_key, partner_id, is_company in cr.fetchall():
+                target = self.company_by_name if is_company else self.partner_by_name
+                target.setdefault(name_key, partner_id)
+            self._loaded_names |= names
+
+        inst_keys = {d['inst_key'] for d in rows_data if d['inst_key']} - self._loaded_orgs
+        if inst_keys:
+            cr.execute("""
+                SELECT lower(trim(nom_unidad)), id
+                  FROM luker_organization
+                 WHERE lower(trim(nom_unidad)) = ANY(%s)
+              ORDER BY nom_unidad, id
+            """, [list(inst_keys)])
+            new_org_ids = []
+            for name_key, org_id in cr.fetchall():
+                if name_key not in self.org_by_name:
+                    self.org_by_name[name_key] = org_id
+                    new_org_ids.append(org_id)
+            self._loaded_orgs |= inst_keys
+            self._load_org_hierarchy(new_org_ids)
+
+        participant_ids = {self.identity_by_doc[d['doc_str']] for d in rows_data
+                           if d['doc_str'] in self.identity_by_doc} - self._loaded_participants
+        if participant_ids:
+            ids = list(participant_ids)
+            for a in self.env['luker.participant.assignment'].search_read(
+                    [('participante_id', 'in', ids), ('vigencia_hasta', '=', False)],
+                    ['participante_id']):
+                self.with_assignment.add(a['participante_id'][0])
+            for v in self.env['luker.participant.attribute.value'].search_read(
+                    [('participante_id', 'in', ids), ('vigencia_hasta', '=', False)],
+                    ['participante_id', 'definicion_id']):
+                self.attr_value_keys.add((v['participante_id'][0], v['definicion_id'][0]))
+            self._loaded_participants |= participant_ids
+
+    def _load_org_hierarchy(self, org_ids):
+        if not org_ids:
+            return
+        branches = self.env['luker.organization.branch'].search_read(
+            [('institucion_id', 'in', org_ids)], ['institucion_id', 'nom_sede'], order='id')
+        for b in branches:
+            self.branch_by_key.setdefault(
+                (b['institucion_id'][0], _norm(b['nom_sede'])), b['id'])
+        if branches:
+            for u in self.env['luker.organization.unit'].search_read(
+                    [('sede_id', 'in', [b['id'] for b in branches])],
+                    ['sede_id', 'nom_grado', 'nom_grupo'], order='id'):
+                self.unit_by_key.setdefault(
+                    (u['sede_id'][0], u['nom_grado'] or False, u['nom_grupo'] or False), u['id'])
+
+    # ─────────────────────────────────────────────────────────
+    # AUXILIARES
+    # ─────────────────────────────────────────────────────────
+    def _get(self, row, field):
+        for c in self.dest_to_cols.get(field, []):
+            v = row.get(c)
+            if v is not None and str(v).strip() not in EMPTY_VALUES:
+                return v
+        return None
+
+    def _find_id_type(self, code, name_raw):
+        search = SIMAT_DOC_TYPE_NAMES.get(code)
+        if not search and name_raw:
+            search = str(name_raw).strip()
+        if search:
+            t = self.id_type_by_name.get(search.lower())
+            if t:
+                return t
+            for k, t in self.id_type_by_name.items():
+                if search.lower() in k or k in search.lower():
+                    return t
+        return self.all_id_types[:1] and self.all_id_types[0] or False
+
+    @staticmethod
+    def _parse_date(raw):
+        if not raw:
+            return None
+        if isinstance(raw, datetime):
+            return raw.date()
+        if hasattr(raw, 'date'):
+            return raw.date()
+        if isinstance(raw, str):
+            # Las celdas fecha-hora de xlsx llegan del TSV normalizado como
+            # 'YYYY-MM-DD HH:MM:SS[.ffffff]'
+            for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y',
+                        '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f'):
+                try:
+                    return datetime.strptime(raw.strip(), fmt).date()
+                except ValueError:
+                    pass
+        return None
+
+    def _build_partner_vals(self, row, full_name, first_name, second_name,
+                            first_surname, second_surname,
+                            phone_raw, birthdate, gender_raw):
+        """Construye los valores del contacto mapeando todos los campos disponibles."""
+        pf = self.pf
+        _get = self._get
+        vals = {
+            'name': full_name,
+            'is_company': False,
+        }
+
+        # ── Nombre separado ──────────────────────────────
+        # También aseguramos que el campo 'name' tenga el nombre completo
+        for key, val in [('first_name', first_name), ('second_name', second_name),
+                         ('first_surname', first_surname), ('second_surname', second_surname)]:
+            f = pf.get(key)
+            if f and val:
+                vals[f] = val
+
+        # ── Teléfono ─────────────────────────────────────
+        if phone_raw:
+            phone_str = str(phone_raw).strip()
+            if pf.get('phone') and phone_str:
+                vals[pf['phone']] = phone_str
+
+        # ── Fecha de nacimiento ──────────────────────────
+        if birthdate and pf.get('birthdate'):
+            vals[pf['birthdate']] = birthdate
+
+        # ── Género ───────────────────────────────────────
+        gender_raw_up = str(gender_raw or '').strip().upper()
+        if gender_raw_up and pf.get('gender_bio'):
+            vals[pf['gender_bio']] = GENDER_MAP.get(gender_raw_up, gender_raw_up.lower())
+        if gender_raw_up and pf.get('gender_id'):
+            vals[pf['gender_id']] = GENDER_MAP.get(gender_raw_up, gender_raw_up.lower())
+
+        # ── Dirección ─────────────────────────────────────
+        addr = _get(row, 'address')
+        if addr and pf.get('street'):
+            vals[pf['street']] = str(addr)
+
+        # ── Zona ─────────────────────────────────────────
+        zone_raw = _get(row, 'zone')
+        if zone_raw is not None:
+            zone_val = ZONE_MAP.get(zone_raw, ZONE_MAP.get(str(zone_raw).upper(), str(zone_raw)))
+            if pf.get('zone'):
+                vals[pf['zone']] = zone_val
+
+        # ── Estrato ──────────────────────────────────────
+        estrato = _get(row, 'estrato')
+        if estrato is not None and pf.get('estrato'):
+            try:
+                vals[pf['estrato']] = int(str(estrato).strip())
+            except (ValueError, TypeError):
+                pass
+
+        # ── SISBEN ───────────────────────────────────────
+        sisben = _get(row, 'sisben')
+        if sisben:
+            sisben_str = str(sisben).strip()
+            if pf.get('sisben_bool'):
+                vals[pf['sisben_bool']] = True
+            if pf.get('sisben_class'):
+                vals[pf['sisben_class']] = sisben_str
+
+        # ── Discapacidad ─────────────────────────────────
+        disc_code = _get(row, 'disability_code')
+        disc_name = _get(row, 'disability_name')
+        has_disability = disc_code is not None and str(disc_code).strip() not in ('99', '0', '9', '')
+        if has_disability:
+            if pf.get('disability'):
+                vals[pf['disability']] = True
+            if disc_name and pf.get('disability_type'):
+                vals[pf['disability_type']] = str(disc_name).strip()
+
+        # ── Víctima de conflicto ──────────────────────────
+        victim = str(_get(row, 'victim_conflict') or '').strip().upper()
+        is_victim = victim in ('SI', 'S', '1', 'YES', 'Y')
+        if is_victim and pf.get('victim'):
+            vals[pf['victim']] = True
+
+        # ── Lugar de expedición ───────────────────────────
+        exp_depto = _get(row, 'exp_depto')
+        if exp_depto and pf.get('exp_place'):
+            vals[pf['exp_place']] = str(exp_depto)
+
+        return vals
+
+    # ─────────────────────────────────────────────────────────
+    # VALIDACIÓN CONTRA METADATOS
+    # ─────────────────────────────────────────────────────────
+    def _clean_vals(self, model_name, vals):
+        """
+        Ajusta los valores al tipo de cada campo antes de escribir. Lo que
+        no encaja (campo inexistente, opción fuera de la selección, tipo
+        incompatible) se descarta con un aviso, en lugar de intentar la
+        escritura campo por campo.
+        """
+        model = self.env[model_name]
+        clean = {}
+        for fname, value in vals.items():
+            field = model._fields.get(fname)
+            ok, coerced = self._coerce(model, field, value) if field else (False, value)
+            if ok:
+                clean[fname] = coerced
+            elif (model_name, fname) not in self._warned_fields:
+                self._warned_fields.add((model_name, fname))
+                _logger.warning('Luker Import — %s.%s: valor %r descartado (no es válido para el campo).',
+                                model_name, fname, value)
+        return clean
+
+    def _selection_keys(self, model, field):
+        """{valor o etiqueta en minúsculas: valor} de un campo selection."""
+        key = (model._name, field.name)
+        if key not in self._selection_cache:
+            options = {}
+            for value, label in field._description_selection(self.env):
+                options[str(value).lower()] = value
+                options.setdefault(str(label).lower(), value)
+            self._selection_cache[key] = options
+        return self._selection_cache[key]
+
+    def _coerce(self, model, field, value):
+        if value is None or value is False:
+            return True, False
+        if field.compute and not field.inverse and not field.store:
+            return False, value
+        ftype = field.type
+        try:
+            if ftype == 'selection':
+                value = self._selection_keys(model, field).get(str(value).strip().lower())
+                return value is not None, value
+            if ftype == 'many2one':
+                return isinstance(value, int) and not isinstance(value, bool), value
+            if ftype == 'boolean':
+                return True, bool(value)
+            if ftype == 'integer':
+                return True, int(str(value).strip())
+            if ftype in ('float', 'monetary'):
+                return True, float(str(value).strip())
+            if ftype == 'date':
+                if isinstance(value, datetime):
+                    return True, value.date()
+                if isinstance(value, date):
+                    return True, value
+                return True, fields.Date.to_date(str(value).strip())
+            if ftype in ('char', 'text', 'html'):
+                return True, str(value)
+            if ftype in ('one2many', 'many2many'):
+                return False, value
+        except (ValueError, TypeError):
+            return False, value
+        return True, value
+
+    # ─────────────────────────────────────────────────────────
+    # FILA
+    # ─────────────────────────────────────────────────────────
+    def _parse_row(self, row):
+        """Extrae y normaliza una vez los valores que usan la precarga y la fila."""
+        _get = self._get
+        first_name      = str(_get(row, 'first_name')    or '').strip().title()
+        second_name     = str(_get(row, 'second_name')   or '').strip().title()
+        first_surname   = str(_get(row, 'first_surname') or '').strip().title()
+        second_surname  = str(_get(row, 'second_surname')or '').strip().title()
+        doc_number      = _get(row, 'doc_number')
+        inst_name       = str(_get(row, 'institution_name') or '').strip()
+        full_name = ' '.join(filter(None, [first_name, second_name, first_surname, second_surname]))
+        if not full_name.strip() and doc_number:
+            full_name = f'Participante {doc_number}'
+        return {
+            'doc_number':      doc_number,
+            'doc_str':         str(doc_number).strip() if doc_number else '',
+            'doc_type_code':   _get(row, 'doc_type_code'),
+            'doc_type_name':   _get(row, 'doc_type_name'),
+            'first_name':      first_name,
+            'second_name':     second_name,
+            'first_surname':   first_surname,
+            'second_surname':  second_surname,
+            'full_name':       full_name,
+            'full_name_key':   _norm(full_name),
+            'birthdate_raw':   _get(row, 'birthdate'),
+            'gender_raw':      str(_get(row, 'gender') or '').strip().upper(),
+            'phone_raw':       _get(row, 'phone'),
+            'grade_raw':       _get(row, 'grade'),
+            'group_raw':       _get(row, 'group_name'),
+            'jornada_code':    _get(row, 'jornada_code'),
+            'jornada_name':    str(_get(row, 'jornada_name') or '').strip().upper(),
+            'inst_name':       inst_name,
+            'inst_key':        _norm(inst_name),
+            'sede_name':       str(_get(row, 'sede_name') or inst_name).strip(),
+            'estrato':         _get(row, 'estrato'),
+            'sisben':          _get(row, 'sisben'),
+            'victim':          str(_get(row, 'victim_conflict') or '').strip().upper(),
+            'repeating':       str(_get(row, 'repeating') or '').strip().upper(),
+            'disability_code': _get(row, 'disability_code'),
+        }
+
+    def _plan_row(self, row, data, planned_docs):
+        """
+        Decide qué hacer con la fila sin escribir nada. Devuelve {'line': …}
+        si la fila termina aquí (advertencia, omitida, error), o el plan que
+        ejecuta _write_batch.
+        """
+        empty_fields = []
+        doc_number = data['doc_number']
+        doc_str    = data['doc_str']
+
+        if not data['first_name']:    empty_fields.append('Primer nombre')
+        if not data['first_surname']: empty_fields.append('Primer apellido')
+        if not data['grade_raw']:     empty_fields.append('Grado')
+        if not data['inst_name']:     empty_fields.append('Institución')
+
+        if not doc_number:
+            return {'line': {'estado_registro': 'advertencia',
+                             'mensaje_validacion': 'Sin número de documento — omitida',
+                             'campos_vacios_json': ', '.join(['Nº documento'] + empty_fields)}}
+
+        # Conciliar (índice precargado + documentos ya planificados en el lote)
+        existing_pid = self.identity_by_doc.get(doc_str)
+        exists = bool(existing_pid) or doc_str in planned_docs
+
+        if exists and self.action_on_existing in ('omitir', 'skip'):
+            return {'line': {'estado_registro': 'omitido',
+                             'participante_id': existing_pid or False,
+                             'cod_persona_externa': doc_str,
+                             'mensaje_validacion': f'Ya existe — omitido (doc: {doc_number})',
+                             'campos_vacios_json': ', '.join(empty_fields)}}
+
+        if exists and self.action_on_existing == 'error':
+            return {'line': {'estado_registro': 'error',
+                             'participante_id': existing_pid or False,
+                             'cod_persona_externa': doc_str,
+                             'mensaje_validacion': f'Ya existe y acción es "error" (doc: {doc_number})'}}
+
+        if (not exists and not self.create_missing_contacts
+                and data['full_name_key'] not in self.partner_by_name):
+            return {'line': {'estado_registro': 'error',
+                             'cod_persona_externa': doc_str,
+                             'mensaje_validacion': f'Contacto no encontrado: {data["full_name"]}'}}
+
+        birthdate = self._parse_date(data['birthdate_raw'])
+        partner_vals = self._build_partner_vals(
+            row, data['full_name'], data['first_name'], data['second_name'],
+            data['first_surname'], data['second_surname'],
+            data['phone_raw'], birthdate, data['gender_raw'])
+
+        # Tipo de identificación y número en el contacto (solo en altas)
+        id_type = self._find_id_type(data['doc_type_code'], data['doc_type_name'])
+        partner_id_vals = {}
+        if id_type and self.pf.get('id_type'):
+            partner_id_vals[self.pf['id_type']] = id_type.id
+        # Intentar primero l10n_latam_document_number, luego vat
+        partner_id_vals[self.pf.get('doc_number', 'vat')] = doc_str
+
+        planned_docs.add(doc_str)
+        return {
+            'doc_str':          doc_str,
+            'data':             data,
+            'empty_fields':     empty_fields,
+            'partner_vals':     self._clean_vals('res.partner', partner_vals),
+            'partner_id_vals':  self._clean_vals('res.partner', partner_id_vals),
+            'participant_vals': self._clean_vals('luker.participant', {
+                'fecha_nacimiento': birthdate,
+                'sexo':             GENDER_MAP.get(data['gender_raw'], False),
+            }),
+            'id_type_id':       id_type.id if id_type else False,
+            'attrs':            self._plan_attrs(data),
+            'context':          bool(data['inst_name'] and data['grade_raw']),
+        }
+
+    def _plan_attrs(self, data):
+        """[(definicion_id, campo_valor, valor)] de los atributos dinámicos de la fila."""
+        estrato_int = None
+        if data['estrato'] is not None:
+            try:
+                estrato_int = int(str(data['estrato']).strip())
+            except (ValueError, TypeError):
+                pass
+        sisben    = data['sisben']
+        victim    = data['victim']
+        repeating = data['repeating']
+        disc_code_raw = data['disability_code']
+        has_disc = disc_code_raw is not None and str(disc_code_raw).strip() not in ('99', '0', '9', '')
+
+        candidates = [
+            ('attr_estrato',        'valor_numero',   estrato_int),
+            ('attr_sisben',         'valor_texto',    str(sisben).strip() if sisben else None),
+            ('attr_desplazamiento', 'valor_booleano', victim in ('SI', 'S', '1', 'YES', 'Y') if victim else None),
+            ('attr_repitente',      'valor_booleano', repeating in ('S', 'SI', '1', 'Y', 'YES')),
+            ('attr_discapacidad',   'valor_booleano', has_disc if has_disc else None),
+        ]
+        attrs = []
+        for code, val_field, raw_val in candidates:
+            if raw_val is None or (isinstance(raw_val, bool) and not raw_val):
+                continue
+            def_id = self.attr_defs.get(code)
+            if def_id:
+                attrs.append((def_id, val_field, raw_val))
+        return attrs
+
+    # ─────────────────────────────────────────────────────────
+    # ESCRITURA POR LOTE
+    # ─────────────────────────────────────────────────────────
+    def _write_batch(self, plans):
+        """Escribe los planes con un create(vals_list) por modelo."""
+        env = self.env
+        Partner = env['res.partner']
+        Participant = env['luker.participant']
+
+        self._ensure_context_entities([p for p in plans if p['context']])
+
+        # ── Altas y actualizaciones ─────────────────────────
+        creates = {}
+        updates = []
+        for p in plans:
+            if p['doc_str'] in self.identity_by_doc or p['doc_str'] in creates:
+                updates.append(p)
+            else:
+                creates[p['doc_str']] = p
+
+        # Contactos nuevos: uno por nombre normalizado
+        new_partners = {}
+        for p in creates.values():
+            key = p['data']['full_name_key']
+            if key not in self.partner_by_name and key not in new_partners:
+                new_partners[key] = dict(p['partner_vals'], **p['partner_id_vals'])
+        if new_partners:
+            for key, partner in zip(new_partners, Partner.create(list(new_partners.values()))):
+                self._remember(self.partner_by_name, key, partner.id)
+        # Contactos existentes reutilizados por una alta: se completan sus
+        # datos solo si la carga puede crear/editar contactos
+        for p in creates.values():
+            if p['data']['full_name_key'] not in new_partners:
+                vals = dict(p['partner_id_vals'])
+                if self.create_missing_contacts:
+                    vals.update({k: v for k, v in p['partner_vals'].items()
+                                 if k not in ('name', 'is_company')})
+                if vals:
+                    Partner.browse(self.partner_by_name[p['data']['full_name_key']]).write(vals)
+
+        participants = Participant.create([
+            dict(p['participant_vals'],
+                 partner_id=self.partner_by_name[p['data']['full_name_key']],
+                 tipo_participante_id=self.participant_type.id,
+                 estado='activo',
+                 carga_origen_id=self.log.id)
+            for p in creates.values()
+        ])
+        env['luker.participant.identity'].create([
+            {
+                'participante_id':   participant.id,
+                'tipo_identidad_id': p['id_type_id'],
+                'num_identidad':     doc_str,
+                'es_principal':      True,
+                'estado':            'activa',
+            }
+            for (doc_str, p), participant in zip(creates.items(), participants)
+        ])
+        # Un documento repetido más abajo en el archivo concilia con estos
+        for doc_str, participant in zip(creates, participants):
+            self._remember(self.identity_by_doc, doc_str, participant.id)
+
+        # Actualizaciones: valores distintos por fila
+        for p in updates:
+            participant = Participant.browse(self.identity_by_doc[p['doc_str']])
+            partner_vals = {k: v for k, v in p['partner_vals'].items()
+                            if k not in ('name', 'is_company')}
+            if partner_vals and participant.partner_id:
+                participant.partner_id.write(partner_vals)
+            p_write = {k: v for k, v in p['participant_vals'].items() if v}
+            if p_write:
+                participant.write(p_write)
+
+        # ── Asignaciones de contexto ────────────────────────
+        assignment_vals = []
+        for p in plans:
+            if not p['context']:
+                continue
+            participant_id = self.identity_by_doc[p['doc_str']]
+            org_id, branch_id, unit_id = self._context_ids(p['data'])
+            if org_id and participant_id not in self.with_assignment:
+                assignment_vals.append({
+                    'participante_id': participant_id, 'institucion_id': org_id,
+                    'sede_id': branch_id, 'unidad_id': unit_id,
+                    'carga_origen_id': self.log.id})
+                self._remember(self.with_assignment, participant_id, True)
+        if assignment_vals:
+            env['luker.participant.assignment'].create(assignment_vals)
+
+        # ── Atributos dinámicos ─────────────────────────────
+        attr_vals = []
+        for p in plans:
+            participant_id = self.identity_by_doc[p['doc_str']]
+            for def_id, val_field, raw_val in p['attrs']:
+                if (participant_id, def_id) in self.attr_value_keys:
+                    continue
+                attr_vals.append({
+                    'participante_id': participant_id, 'definicion_id': def_id,
+                    val_field: raw_val, 'fuente': 'carga_masiva'})
+                self._remember(self.attr_value_keys, (participant_id, def_id), True)
+        if attr_vals:
+            env['luker.participant.attribute.value'].create(attr_vals)
+
+        created_docs = set(creates)
+        results = []
+        for p in plans:
+            result = 'creado' if p['doc_str'] in created_docs and creates[p['doc_str']] is p else 'actualizado'
+            results.append((p, {
+                'estado_registro': result,
+                'participante_id': self.identity_by_doc[p['doc_str']],
+                'cod_persona_externa': p['doc_str'],
+                'mensaje_validacion': f'{"Creado" if result == "creado" else "Actualizado"}: {p["data"]["full_name"]}',
+                'campos_vacios_json': ', '.join(p['empty_fields']) if p['empty_fields'] else '',
+            }))
+        return results
+
+    def _ensure_context_entities(self, plans):
+        """Crea en bloque las instituciones, sedes y unidades que falten."""
+        env = self.env
+
+        if self.create_missing_orgs:
+            missing_orgs = {}
+            for p in plans:
+                key = p['data']['inst_key']
+                if key not in self.org_by_name:
+                    missing_orgs.setdefault(key, p['data']['inst_name'])
+            if missing_orgs:
+                missing_companies = [k for k in missing_orgs if k not in self.company_by_name]
+                if missing_companies:
+                    companies = env['res.partner'].create([
+                        {'name': missing_orgs[k], 'is_company': True} for k in missing_companies])
+                    for key, company in zip(missing_companies, companies):
+                        self._remember(self.company_by_name, key, company.id)
+                orgs = env['luker.organization'].create([
+                    {'partner_id': self.company_by_name[k], 'tipo_dominio': 'educacion_formal'}
+                    for k in missing_orgs])
+                for key, org in zip(missing_orgs, orgs):
+                    self._remember(self.org_by_name, key, org.id)
+
+        missing_branches = {}
+        for p in plans:
+            data = p['data']
+            org_id = self.org_by_name.get(data['inst_key'])
+            if not org_id:
+                continue
+            key = (org_id, _norm(data['sede_name'] or data['inst_name']))
+            if key not in self.branch_by_key:
+                missing_branches.setdefault(key, {
+                    'institucion_id': org_id, 'nom_sede': data['sede_name'] or 'Sede Principal'})
+        if missing_branches:
+            branches = env['luker.organization.branch'].create(list(missing_branches.values()))
+            for key, branch in zip(missing_branches, branches):
+                self._remember(self.branch_by_key, key, branch.id)
+
+        missing_units = {}
+        for p in plans:
+            data = p['data']
+            org_id = self.org_by_name.get(data['inst_key'])
+            if not org_id:
+                continue
+            branch_id = self.branch_by_key[(org_id, _norm(data['sede_name'] or data['inst_name']))]
+            key = self._unit_key(branch_id, data)
+            if key not in self.unit_by_key:
+                jornada_code = data['jornada_code']
+                missing_units.setdefault(key, {
+                    'sede_id': branch_id, 'nom_grado': key[1], 'nom_grupo': key[2],
+                    'jornada': (JORNADA_MAP.get(jornada_code)
+                                or JORNADA_MAP.get(str(jornada_code), False)
+                                or JORNADA_MAP.get(data['jornada_name'], False))})
+        if missing_units:
+            units = env['luker.organization.unit'].create(list(missing_units.values()))
+            for key, unit in zip(missing_units, units):
+                self._remember(self.unit_by_key, key, unit.id)
+
+    @staticmethod
+    def _unit_key(branch_id, data):
+        return (branch_id, str(data['grade_raw']),
+                str(data['group_raw']) if data['group_raw'] else False)
+
+    def _context_ids(self, data):
+        """(institución, sede, unidad) ya resueltos en los índices para la fila."""
+        org_id = self.org_by_name.get(data['inst_key'])
+        if not org_id:
+            return False, False, False
+        branch_id = self.branch_by_key.get((org_id, _norm(data['sede_name'] or data['inst_name'])))
+        unit_id = self.unit_by_key.get(self._unit_key(branch_id, data))
+        return org_id, branch_id, unit_id
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# Lectura de archivos de población (xlsx / csv / tsv).
+#
+# El archivo subido se recorre una sola vez (al analizarlo) y se convierte a
+# una representación normalizada: TSV en UTF-8 comprimido con gzip, con el
+# encabezado en la primera línea y una línea por fila de datos. Validación,
+# importación inmediata y ejecución por lotes leen esa copia en streaming,
+# sin volver a abrir el libro con openpyxl ni materializar las filas.
+import csv
+import gzip
+import io
+from datetime import date, datetime
+from itertools import islice
+
+# Formatos reconocidos para el archivo de origen
+FORMAT_XLSX = 'xlsx'
+FORMAT_CSV = 'csv'
+FORMAT_NORMALIZED = 'normalizado'
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZIP_MAGIC = b'PK'
+CSV_DELIMITERS = (',', ';', '\t', '|')
+TEXT_ENCODINGS = ('utf-8-sig', 'cp1252')
+
+
+def detect_format(raw, file_name=None):
+    """Formato del contenido; la extensión solo desempata archivos de texto."""
+    if raw[:2] == GZIP_MAGIC:
+        return FORMAT_NORMALIZED
+    if raw[:2] == ZIP_MAGIC or (file_name or '').lower().endswith(('.xlsx', '.xlsm')):
+        return FORMAT_XLSX
+    return FORMAT_CSV
+
+
+def _iter_xlsx(raw):
+    import openpyxl
+    wb = openpyxl.load_workbook(io.BytesIO(raw), read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            yield row
+    finally:
+        wb.close()
+
+
+def _decode(raw):
+    for encoding in TEXT_ENCODINGS:
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode('latin-1')
+
+
+def _iter_csv(raw, file_name=None):
+    text = _decode(raw)
+    first_line = text.split('\n', 1)[0]
+    if (file_name or '').lower().endswith('.tsv'):
+        delimiter = '\t'
+    else:
+        delimiter = max(CSV_DELIMITERS, key=first_line.count)
+    for row in csv.reader(io.StringIO(text, newline=''), delimiter=delimiter):
+        yield tuple(v if v != '' else None for v in row)
+
+
+def _iter_normalized(raw):
+    with gzip.open(io.BytesIO(raw), mode='rt', encoding='utf-8', newline='') as fh:
+        for row in csv.reader(fh, delimiter='\t'):
+            yield tuple(v if v != '' else None for v in row)
+
+
+def iter_table(raw, file_name=None):
+    """Tuplas de valores de la hoja (o del texto), encabezado incluido."""
+    fmt = detect_format(raw, file_name)
+    if fmt == FORMAT_NORMALIZED:
+        return _iter_normalized(raw)
+    if fmt == FORMAT_XLSX:
+        return _iter_xlsx(raw)
+    return _iter_csv(raw, file_name)
+
+
+def _as_text(value):
+    """Texto con el que se guarda cada celda (el motor trabaja con str())."""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        if value.time() == datetime.min.time():
+            return value.date().isoformat()
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    # Tabuladores y saltos de línea dentro de la celda no aportan y
+    # complicarían el TSV
+    return ' '.join(str(value).split()) if isinstance(value, str) else str(value)
+
+
+def normalize_file(raw, file_name=None, samples=3):
+    """
+    Recorre el archivo una vez y devuelve (normalizado, encabezados,
+    filas_ejemplo, total_filas). Se conserva una línea por fila de la hoja
+    para que los números de fila del detalle sigan coincidiendo.
+    """
+    rows = iter_table(raw, file_name)
+    headers = next(rows, None)
+    if headers is None:
+        return None, [], [], 0
+
+    buffer = io.BytesIO()
+    sample_rows = []
+    total = 0
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6) as gz:
+        text = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+        writer = csv.writer(text, delimiter='\t', lineterminator='\n')
+        writer.writerow([_as_text(h) for h in headers])
+        for row in rows:
+            writer.writerow([_as_text(v) for v in row])
+            if len(sample_rows) < samples:
+                sample_rows.append(row)
+            total += 1
+        text.flush()
+        text.detach()
+    return buffer.getvalue(), list(headers), sample_rows, total
+
+
+def iter_file_rows(raw, columns, start=0):
+    """
+    Recorre el archivo (normalizado o de origen) y devuelve
+    (num_fila, {columna: valor}) a partir de la fila de datos ``start``
+    (0 = primera fila tras el encabezado). ``num_fila`` es el número de fila
+    en la hoja original (encabezado = 1).
+    """
+    rows = islice(iter_table(raw), 1 + start, None)
+    for i, row in enumerate(rows, start=start):
+        yield i + 2, dict(zip(columns, row))
@@ -11,6 +11,7 @@
         - Descarga del perfil del participante
         - Sincronización de respuestas capturadas offline
         - Cola de reintento para sincronizaciones fallidas
+        - Feed de cambios paginado por token (sincronización delta)
     """,
     'category': 'Gestor Operativo',
     'author': 'AiLumex / Fundación Luker',
@@ -4,18 +4,39 @@
 import json
 import logging
 from odoo import http
+from odoo.exceptions import ValidationError
 from odoo.http import request, Response
+from odoo.tools.lru import LRU
 
 _logger = logging.getLogger(__name__)
 
+# Payloads de instrumentos por (survey_id, huella del contenido actual).
+# La huella cambia con cualquier edición del instrumento, sus preguntas u
+# opciones, así que nunca se sirve uno viejo.
+_INSTRUMENT_PAYLOAD_CACHE = LRU(128)
+
+# Máximo de cambios de estado por llamado a /tasks/status/batch
+MAX_LOTE_TRANSICIONES = 1000
+# Estado HTTP de /tasks/<id>/status según el código de aplicar_transiciones_lote
+HTTP_POR_CODIGO_TRANSICION = {
+    'NOT_FOUND':          404,
+    'INVALID_STATE':      400,
+    'INVALID_VALUE':      400,
+    'INVALID_TRANSITION': 409,
+}
+# Máximo de novedades por llamado a /incidents/batch
+MAX_LOTE_INCIDENTES = 500
+# Cambios por página de /changes (por defecto)
+LIMITE_CAMBIOS = 500
+
 # ── Helpers ──────────────────────────────────────────────────────────────────
 
-def _json_ok(data, status=200):
+def _json_ok(data, status=200, headers=None):
     return Response(
         json.dumps({'status': 'ok', 'data': data}, ensure_ascii=False, default=str),
         status=status,
         mimetype='application/json',
-        headers=_cors_headers(),
+        headers={**_cors_headers(), **(headers or {})},
     )
 
 
@@ -32,7 +53,8 @@ def _cors_headers():
     return {
         'Access-Control-Allow-Origin':  '*',
         'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match',
+        'Access-Control-Expose-Headers': 'ETag',
         'Access-Control-Max-Age':       '86400',
     }
 
@@ -70,6 +92,56 @@ def _serializar_participante(p):
     }
 
 
+def _serializar_tarea(t):
+    return {
+        'id':              t.id,
+        'cod_tarea':       t.cod_tarea,
+        'uuid_local':      t.uuid_local,
+        'estado':          t.estado,
+        'estado_sync':     t.estado_sync,
+        'fecha_programada': str(t.fecha_programada) if t.fecha_programada else None,
+        'campana_id':      t.campana_id.id if t.campana_id else None,
+        'survey_id':       t.survey_id.id if t.survey_id else None,
+        'participante':    _serializar_participante(t.participante_id)
+                           if t.participante_id else None,
+    }
+
+
+def _serializar_novedad(n):
+    return {
+        'id':              n.id,
+        'uuid_local':      n.uuid_local,
+        'codigo':          n.cod_incidente,
+        'tipo_cod':        n.tipo_id.cod_tipo,
+        'descripcion':     n.descripcion or '',
+        'estado':          n.estado,
+        'task_id':         n.task_id.id if n.task_id else None,
+        'campana_id':      n.campana_id.id,
+        'fecha_incidente': str(n.fecha_incidente) if n.fecha_incidente else None,
+    }
+
+
+def _serializar_item_agenda(i):
+    return {
+        'id':          i.id,
+        'agenda_id':   i.agenda_id.id,
+        'fecha':       str(i.agenda_id.fecha),
+        'sede_id':     i.agenda_id.sede_id.id if i.agenda_id.sede_id else None,
+        'task_id':     i.task_id.id if i.task_id else None,
+        'hora_inicio': i.hora_inicio,
+        'hora_fin':    i.hora_fin,
+        'estado':      i.estado,
+    }
+
+
+# Modelo y serializador de cada tipo de registro del feed de cambios
+_FUENTES_CAMBIOS = {
+    'tarea':       ('luker.operation.task',        _serializar_tarea),
+    'novedad':     ('luker.operation.incident',    _serializar_novedad),
+    'agenda_item': ('luker.operation.agenda.item', _serializar_item_agenda),
+}
+
+
 def _serializar_pregunta(q):
     """
     Serializa una pregunta con TODOS los campos extendidos de ailmx_extend_survey.
@@ -180,6 +252,22 @@ def _serializar_encuesta(survey):
     }
 
 
+def _serializar_encuesta_cacheada(survey):
+    """
+    Igual que _serializar_encuesta, pero reutiliza el payload mientras no
+    cambie el contenido del instrumento (ver
+    survey.survey._get_hash_contenido_servido). Retorna (payload, hash).
+    """
+    hash_version = survey._get_hash_contenido_servido()
+    key = (survey.id, hash_version)
+    payload = _INSTRUMENT_PAYLOAD_CACHE.get(key)
+    if payload is None:
+        payload = _serializar_encuesta(survey)
+        payload['hash_version'] = hash_version
+        _INSTRUMENT_PAYLOAD_CACHE[key] = payload
+    return payload, hash_version
+
+
 # ── Controlador principal ─────────────────────────────────────────────────────
 
 class LukerApiController(http.Controller):
@@ -192,7 +280,7 @@ class LukerApiController(http.Controller):
         """
         Descarga todo lo que la PWA necesita en UN solo llamado:
         - Perfil del participante/ejecutor
-        - Tareas del día asignadas
+        - Tareas del día asignadas y su orden de visita (plan_dia)
         - Instrumentos completos de las tareas
         - Catálogos (tipos de pregunta, tipos de incidente)
         Diseñado para conexión lenta — payload mínimo.
@@ -240,7 +328,23 @@ class LukerApiController(http.Controller):
         for sid in survey_ids:
             survey = request.env['survey.survey'].sudo().browse(sid)
             if survey.exists():
-                instrumentos[sid] = _serializar_encuesta(survey)
+                instrumentos[sid] = _serializar_encuesta_cacheada(survey)[0]
+
+        # Plan del día en orden de visita, con la ubicación de cada sede
+        plan_dia, sedes = [], {}
+        if executor:
+            plan_dia = executor.plan_del_dia()
+            sede_ids = list({p['sede_id'] for p in plan_dia if p['sede_id']})
+            Organization = request.env['luker.organization'].sudo()
+            coordenadas = Organization._coordenadas(sede_ids)
+            sedes = {
+                org.id: {
+                    'nombre':   org.nom_unidad,
+                    'latitud':  coordenadas.get(org.id, (None, None))[0],
+                    'longitud': coordenadas.get(org.id, (None, None))[1],
+                }
+                for org in Organization.browse(sede_ids)
+            }
 
         # Catálogos
         tipos_incidente = [
@@ -261,6 +365,8 @@ class LukerApiController(http.Controller):
             'participante': _serializar_participante(token_rec.participante_id)
                             if token_rec.participante_id else None,
             'tareas':       tareas,
+            'plan_dia':     plan_dia,
+            'sedes':        sedes,
             'instrumentos': instrumentos,
             'catalogos': {
                 'tipos_incidente': tipos_incidente,
@@ -290,52 +396,151 @@ class LukerApiController(http.Controller):
             ('executor_id', '=', executor.id),
         ], order='fecha_programada asc')
 
-        tareas = [{
-            'id':              t.id,
-            'cod_tarea':       t.cod_tarea,
-            'uuid_local':      t.uuid_local,
-            'estado':          t.estado,
-            'estado_sync':     t.estado_sync,
-            'fecha_programada': str(t.fecha_programada) if t.fecha_programada else None,
-            'campana_id':      t.campana_id.id if t.campana_id else None,
-            'survey_id':       t.survey_id.id if t.survey_id else None,
-            'participante':    _serializar_participante(t.participante_id)
-                               if t.participante_id else None,
-        } for t in tasks]
+        tareas = [_serializar_tarea(t) for t in tasks]
 
         return _json_ok({'tareas': tareas, 'total': len(tareas)})
 
+    # ── Feed de cambios (sincronización delta) ────────────────────────────────
+
+    @http.route('/luker/api/v1/changes',
+                auth='none', methods=['GET'], csrf=False, type='http')
+    def changes(self, token=None, limite=None, **kwargs):
+        """
+        Cambios de tareas, novedades e ítems de agenda del ejecutor desde
+        ``token`` (sin token: sincronización inicial), paginados.
+        Respuesta: {cambios: [{tipo, id, op: 'upsert'|'baja', datos?}],
+        token, hay_mas}. Se repite con el token recibido mientras hay_mas;
+        el último token se guarda para la próxima sincronización. Con 410
+        el dispositivo debe descartar su copia y empezar sin token.
+        """
+        token_rec, err = _require_auth()
+        if err:
+            return err
+
+        executor = request.env['luker.operation.executor'].sudo().search([
+            ('user_id', '=', token_rec.participante_id.user_id.id
+                            if token_rec.participante_id else 0)
+        ], limit=1)
+        if not executor:
+            return _json_error('El usuario no es un ejecutor.', 403, 'NOT_EXECUTOR')
+
+        try:
+            limite = int(limite or LIMITE_CAMBIOS)
+            pagina = executor.leer_cambios(token=token or None, limite=limite)
+        except (ValueError, ValidationError):
+            return _json_error('Token de sincronización inválido.', 400, 'INVALID_SYNC_TOKEN')
+        if pagina.get('reiniciar'):
+            return _json_error(
+                'El token de sincronización venció; sincroniza desde cero.',
+                410, 'SYNC_TOKEN_EXPIRED')
+
+        # Los registros vigentes de cada tipo se leen en bloque
+        vigentes = {}
+        for tipo, (modelo, serializar) in _FUENTES_CAMBIOS.items():
+            ids = [rid for t, rid, baja in pagina['cambios'] if t == tipo and not baja]
+            vigentes[tipo] = {
+                rec.id: serializar(rec)
+                for rec in request.env[modelo].sudo().browse(ids).exists()
+            }
+        cambios = []
+        for tipo, rid, baja in pagina['cambios']:
+            datos = None if baja else vigentes[tipo].get(rid)
+            if datos is None:
+                cambios.append({'tipo': tipo, 'id': rid, 'op': 'baja'})
+            else:
+                cambios.append({'tipo': tipo, 'id': rid, 'op': 'upsert', 'datos': datos})
+
+        return _json_ok({
+            'cambios': cambios,
+            'token':   pagina['token'],
+            'hay_mas': pagina['hay_mas'],
+        })
+
     # ── Actualizar estado de tarea ────────────────────────────────────────────
 
     @http.route('/luker/api/v1/tasks/<int:task_id>/status',
                 auth='none', methods=['POST'], csrf=False, type='http')
     def task_update_status(self, task_id, **kwargs):
-        """Actualiza el estado de una tarea desde la PWA."""
+        """
+        Actualiza el estado de una tarea del ejecutor desde la PWA.
+        Body: {estado, fecha_programada?, motivo?}
+        Aplica las mismas transiciones que el lote y los botones del
+        formulario; una tarea de otro ejecutor se responde como no encontrada.
+        """
         token_rec, err = _require_auth()
         if err:
             return err
 
         try:
-            body = __import__('json').loads(
-                request.httprequest.data or b'{}'
-            )
+            body = json.loads(request.httprequest.data or b'{}')
         except Exception:
             return _json_error('Body JSON inválido.', 400)
 
-        nuevo_estado = body.get('estado')
-        estados_validos = ('pendiente','programado','en_progreso',
-                          'completado','fallido','reprogramado','cancelado')
-        if nuevo_estado not in estados_validos:
+        executor = request.env['luker.operation.executor'].sudo().search([
+            ('user_id', '=', token_rec.participante_id.user_id.id
+                            if token_rec.participante_id else 0)
+        ], limit=1)
+        if not executor:
+            return _json_error('El usuario no es un ejecutor.', 403, 'NOT_EXECUTOR')
+
+        cambio = {'id': task_id, 'estado': body.get('estado')}
+        if body.get('fecha_programada'):
+            cambio['fecha_programada'] = body['fecha_programada']
+        [resultado] = request.env['luker.operation.task'].sudo().aplicar_transiciones_lote(
+            [cambio], motivo=body.get('motivo'), vals_comunes={'estado_sync': 'synced'},
+            executor_id=executor.id)
+        if not resultado['ok']:
             return _json_error(
-                f'Estado inválido. Válidos: {estados_validos}', 400
+                resultado['mensaje'],
+                HTTP_POR_CODIGO_TRANSICION.get(resultado['codigo'], 400),
+                resultado['codigo'],
             )
+        return _json_ok({'id': task_id, 'estado': cambio['estado'],
+                         'sin_cambio': bool(resultado.get('sin_cambio'))})
 
-        task = request.env['luker.operation.task'].sudo().browse(task_id)
-        if not task.exists():
-            return _json_error('Tarea no encontrada.', 404)
+    # ── Cambio de estado por lote ─────────────────────────────────────────────
 
-        task.write({'estado': nuevo_estado, 'estado_sync': 'synced'})
-        return _json_ok({'id': task_id, 'estado': nuevo_estado})
+    @http.route('/luker/api/v1/tasks/status/batch',
+                auth='none', methods=['POST'], csrf=False, type='http')
+    def task_update_status_batch(self, **kwargs):
+        """
+        Cambia el estado de varias tareas del ejecutor en un llamado.
+        Body: {cambios: [{id, estado, fecha_programada?}], motivo?}
+        Se hace un write por estado destino y un solo mensaje de seguimiento
+        por campaña; cada cambio recibe su propio resultado. Las tareas de
+        otros ejecutores se informan como NOT_FOUND.
+        """
+        token_rec, err = _require_auth()
+        if err:
+            return err
+
+        executor = request.env['luker.operation.executor'].sudo().search([
+            ('user_id', '=', token_rec.participante_id.user_id.id
+                            if token_rec.participante_id else 0)
+        ], limit=1)
+        if not executor:
+            return _json_error('El usuario no es un ejecutor.', 403, 'NOT_EXECUTOR')
+
+        try:
+            body = json.loads(request.httprequest.data or b'{}')
+        except Exception:
+            return _json_error('Body JSON inválido.', 400)
+
+        cambios = body.get('cambios')
+        if not isinstance(cambios, list) or not all(isinstance(c, dict) for c in cambios):
+            return _json_error('cambios debe ser una lista de objetos.', 400)
+        if len(cambios) > MAX_LOTE_TRANSICIONES:
+            return _json_error(
+                f'Máximo {MAX_LOTE_TRANSICIONES} cambios por lote.', 413, 'BATCH_TOO_LARGE')
+
+        resultados = request.env['luker.operation.task'].sudo().aplicar_transiciones_lote(
+            cambios, motivo=body.get('motivo'), vals_comunes={'estado_sync': 'synced'},
+            executor_id=executor.id)
+        return _json_ok({
+            'resultados': resultados,
+            'aplicados':  sum(1 for r in resultados if r['ok']),
+            'rechazados': sum(1 for r in resultados if not r['ok']),
+        })
 
     # ── Registrar incidente ───────────────────────────────────────────────────
 
@@ -403,6 +608,46 @@ class LukerApiController(http.Controller):
             'codigo': incident.cod_incidente,
         })
 
+    @http.route('/luker/api/v1/incidents/batch',
+                auth='none', methods=['POST'], csrf=False, type='http')
+    def create_incidents_batch(self, **kwargs):
+        """
+        Registra en un llamado las novedades acumuladas offline.
+        Body: {incidentes: [{uuid_local, tipo_cod, descripcion, task_id,
+        campana_id?, timestamp}]}
+        Los uuid_local ya registrados (o repetidos en el lote) se devuelven
+        como duplicados; cada ítem recibe su propio resultado.
+        """
+        token_rec, err = _require_auth()
+        if err:
+            return err
+
+        try:
+            body = json.loads(request.httprequest.data or b'{}')
+        except Exception:
+            return _json_error('Body JSON inválido.', 400)
+
+        items = body.get('incidentes')
+        if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+            return _json_error('incidentes debe ser una lista de objetos.', 400)
+        if len(items) > MAX_LOTE_INCIDENTES:
+            return _json_error(
+                f'Máximo {MAX_LOTE_INCIDENTES} incidentes por lote.', 413, 'BATCH_TOO_LARGE')
+
+        executor = request.env['luker.operation.executor'].sudo().search([
+            ('user_id', '=', token_rec.participante_id.user_id.id
+                            if token_rec.participante_id else 0)
+        ], limit=1)
+
+        resultados = request.env['luker.operation.incident'].sudo().registrar_lote(
+            items, executor_id=executor.id)
+        return _json_ok({
+            'resultados': resultados,
+            'creados':    sum(1 for r in resultados if r['ok'] and not r.get('duplicado')),
+            'duplicados': sum(1 for r in resultados if r.get('duplicado')),
+            'rechazados': sum(1 for r in resultados if not r['ok']),
+        })
+
     # ── CORS preflight ────────────────────────────────────────────────────────
 
     @http.route('/luker/api/v1/<path:subpath>',
@@ -439,11 +684,9 @@ class LukerApiController(http.Controller):
         if not num_doc or not dispositivo:
             return _json_error('num_documento y dispositivo_id son requeridos.', 400, 'MISSING_FIELDS')
 
-        # Buscar participante por identidad principal
-        identidad = request.env['luker.participant.identity'].sudo().search([
-            ('num_identidad', '=', num_doc),
-            ('estado', '=', 'activa'),
-        ], limit=1)
+        # Buscar participante por identidad (número exacto o normalizado)
+        identidad = request.env['luker.participant.identity'].sudo()._buscar_por_documento(
+            num_doc, [('estado', '=', 'activa')])
 
         if not identidad:
             return _json_error('Participante no encontrado.', 404, 'NOT_FOUND')
@@ -519,7 +762,13 @@ class LukerApiController(http.Controller):
         if not survey.exists():
             return _json_error(f'Encuesta {survey_id} no encontrada.', 404, 'NOT_FOUND')
 
-        return _json_ok(_serializar_encuesta(survey))
+        payload, hash_version = _serializar_encuesta_cacheada(survey)
+
+        # El dispositivo que ya tiene esta versión no la vuelve a descargar
+        etag = f'"{hash_version}"'
+        if request.httprequest.headers.get('If-None-Match') == etag:
+            return Response('', status=304, headers={**_cors_headers(), 'ETag': etag})
+        return _json_ok(payload, headers={'ETag': etag})
 
     # ── Sincronización ────────────────────────────────────────────────────────
 
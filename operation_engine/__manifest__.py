@@ -17,6 +17,8 @@
         'data/operation_task_sequence.xml',
         'data/rol_data.xml',
         'data/sprint2_data.xml',
+        'data/operation_cron_data.xml',
+        'data/counters_data.xml',
 
         'views/rol_views.xml',
         'views/executor_views.xml',
@@ -25,6 +27,8 @@
         'views/assignment_views.xml',
         'views/task_views.xml',
         'views/sprint2_views.xml',
+        'views/response_analytics_views.xml',
+        'views/executor_workload_views.xml',
         'views/survey_executor_inherit.xml',
         'views/menus.xml',
     ],
@@ -5,4 +5,9 @@ from . import campaign          # OPE_Campaña
 from . import assignment        # OPE_Asignacion
 from . import task              # OPE_Tarea
 from . import sprint2           # Sprint 2 — agenda, equipos, incidentes, progreso
+from . import task_planner      # Generación de tareas y reparto entre aplicadores
+from . import agenda_scheduler  # Programación de agendas por equipo y sede
 from . import survey_extend     # Campos readonly en survey.user_input
+from . import response_analytics  # Analítica materializada de respuestas
+from . import executor_workload   # Cubo de carga y productividad de aplicadores
+from . import sync_feed           # Feed de cambios para la sincronización delta
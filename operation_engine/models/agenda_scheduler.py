@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+# Programación de agendas — arma las agendas diarias de cada equipo.
+#
+# Toma las tareas abiertas de la campaña que aún no están en una agenda y las
+# ubica en el tiempo: cada equipo logístico (o cada aplicador sin equipo)
+# atiende una sede a la vez y no la deja hasta terminarla, lo que reduce las
+# visitas por institución. Dentro de la sede las sesiones se reparten por
+# lista (el aplicador que queda libre primero toma la siguiente, preferiendo
+# sus propias tareas), así nadie espera mientras otro tiene cola. Si la sede
+# termina antes del fin de jornada, el equipo sigue en la siguiente tras el
+# tiempo de traslado.
+#
+# La duración de cada sesión se estima con el promedio histórico de
+# duracion_minutos del instrumento: por aplicador si tiene suficientes
+# sesiones, del instrumento en general si no, o el valor por defecto de la
+# campaña.
+#
+# Las sedes con coordenadas se visitan en orden de recorrido (vecino más
+# cercano + 2-opt, ver rutas.py) y el traslado entre ellas se estima por
+# distancia; las que no tienen ubicación van al final, con el traslado fijo.
+import heapq
+import logging
+import math
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+
+from .rutas import distancia_km, longitud_recorrido, ordenar_recorrido
+from .task_planner import ESTADOS_SIN_CUPO
+
+_logger = logging.getLogger(__name__)
+
+# Sesiones completadas mínimas para usar el promedio propio del aplicador
+MIN_MUESTRAS_DURACION = 5
+# Las duraciones estimadas se redondean hacia arriba a este múltiplo (min)
+REDONDEO_DURACION = 5
+# Estados de tarea que se programan en agenda
+ESTADOS_PROGRAMABLES = ('pendiente', 'programado', 'reprogramado')
+
+
+class LukerOperationCampaignAgenda(models.Model):
+    _inherit = 'luker.operation.campaign'
+
+    hora_inicio_jornada = fields.Float(
+        string='Inicio de jornada', default=7.0, digits=(4, 2))
+    hora_fin_jornada = fields.Float(
+        string='Fin de jornada', default=12.0, digits=(4, 2))
+    minutos_traslado = fields.Integer(
+        string='Traslado entre sedes (min)', default=30,
+        help='Se usa cuando alguna de las dos sedes no tiene coordenadas.')
+    velocidad_traslado = fields.Integer(
+        string='Velocidad de traslado (km/h)', default=25,
+        help='Con coordenadas en ambas sedes, el traslado se estima con la '
+             'distancia por vía y esta velocidad.')
+    duracion_sesion_defecto = fields.Integer(
+        string='Duración de sesión por defecto (min)', default=40,
+        help='Se usa mientras no haya historial de sesiones completadas '
+             'del instrumento.')
+
+    @api.constrains('hora_inicio_jornada', 'hora_fin_jornada', 'velocidad_traslado')
+    def _check_jornada(self):
+        for c in self:
+            if c.hora_fin_jornada <= c.hora_inicio_jornada:
+                raise ValidationError('El fin de la jornada debe ser posterior a su inicio.')
+            if c.velocidad_traslado <= 0:
+                raise ValidationError('La velocidad de traslado debe ser positiva.')
+
+    # ── Acción ────────────────────────────────────────────────────────────────
+    def action_generar_agendas(self):
+        self.ensure_one()
+        resultado = self._generar_agendas()
+        mensaje = (f'{resultado["agendas"]} agendas con {resultado["items"]} sesiones '
+                   f'({resultado["segundos"]} s).')
+        if resultado['km_recorrido']:
+            mensaje += f' Recorrido estimado entre sedes: {resultado["km_recorrido"]} km.'
+        if resultado['sin_programar']:
+            mensaje += f' {resultado["sin_programar"]} tareas no caben en el periodo.'
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Programación de agendas',
+                'message': mensaje,
+                'type': 'warning' if resultado['sin_programar'] else 'success',
+                'next': {'type': 'ir.actions.client', 'tag': 'reload'},
+            }
+        }
+
+    # ── Motor ────────────────────────────────────────────────────────────────
+    def _generar_agendas(self, fecha_desde=None, fecha_hasta=None):
+        """
+        Programa las tareas abiertas sin agenda entre ``fecha_desde`` y
+        ``fecha_hasta`` (por defecto, lo que queda de la campaña).
+        Devuelve {'agendas', 'items', 'sin_programar', 'km_recorrido', 'segundos'}.
+        """
+        self.ensure_one()
+        inicio = time.monotonic()
+        dias = [d for d in self._dias_planificables()
+                if (not fecha_desde or d >= fields.Date.to_date(fecha_desde))
+                and (not fecha_hasta or d <= fields.Date.to_date(fecha_hasta))]
+
+        tareas = self._tareas_sin_agenda()
+        duraciones = self._duraciones_esperadas()
+        miembros = self._miembros_por_ejecutor()
+        cobertura = defaultdict(set)
+        for institucion_id, ejecutor_ids in self._ejecutores_por_institucion(
+                list({eid for _t, eid, _i in tareas} | set(miembros))).items():
+            for eid in ejecutor_ids:
+                cobertura[eid].add(institucion_id)
+
+        # Unidad de programación: el equipo del aplicador o el aplicador solo
+        unidad_de = {}
+        integrantes = defaultdict(dict)     # unidad → {ejecutor: [(desde, hasta)]}
+        for eid, membresias in miembros.items():
+            equipo = min(m[0].id for m in membresias)
+            unidad_de[eid] = ('equipo', equipo)
+            integrantes[('equipo', equipo)][eid] = [
+                (desde, hasta) for team, desde, hasta in membresias if team.id == equipo]
+        por_unidad = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+        for tarea_id, eid, institucion_id in tareas:
+            unidad = unidad_de.setdefault(eid, ('ejecutor', eid))
+            integrantes[unidad].setdefault(eid, [(None, None)])
+            por_unidad[unidad][institucion_id][eid].append(tarea_id)
+
+        ocupados = self._dias_con_agenda()
+        coordenadas = self.env['luker.organization']._coordenadas(
+            {i for _t, _e, i in tareas if i})
+        agendas = []        # [(vals agenda, [(tarea, ejecutor, hora_inicio, hora_fin)])]
+        km_recorrido = 0.0
+        for unidad, por_sede in por_unidad.items():
+            libres = [d for d in dias if (unidad, d) not in ocupados]
+            agendas_unidad = self._programar_unidad(
+                unidad, por_sede, integrantes[unidad], libres, duraciones, cobertura,
+                coordenadas)
+            km_recorrido += self._km_recorrido(agendas_unidad, coordenadas)
+            agendas.extend(agendas_unidad)
+
+        n_items = self._crear_agendas(agendas)
+        resultado = {
+            'agendas':       len(agendas),
+            'items':         n_items,
+            'sin_programar': len(tareas) - n_items,
+            'km_recorrido':  round(km_recorrido, 1),
+            'segundos':      round(time.monotonic() - inicio, 2),
+        }
+        _logger.info('Agendas campaña %s: %s', self.id, resultado)
+        return resultado
+
+    def _programar_unidad(self, unidad, por_sede, integrantes, dias, duraciones, cobertura,
+                          coordenadas):
+        """Agendas de una unidad: una sede a la vez, sesiones por lista."""
+        fin_jornada = self.hora_fin_jornada
+        team_id = unidad[1] if unidad[0] == 'equipo' else False
+        # Las sedes con más tareas primero: se visitan en días consecutivos.
+        # Con coordenadas, el resto sigue el recorrido desde la primera.
+        por_tamano = sorted(por_sede, key=lambda s: (-sum(map(len, por_sede[s].values())), s or 0))
+        ubicadas = [s for s in por_tamano if s in coordenadas]
+        cola = deque(
+            ordenar_recorrido({s: coordenadas[s] for s in ubicadas}, inicio=ubicadas[0])
+            if ubicadas else [])
+        cola.extend(s for s in por_tamano if s not in coordenadas)
+        agendas = []
+        for dia in dias:
+            if not cola:
+                break
+            presentes = [
+                eid for eid, rangos in integrantes.items()
+                if any((not desde or desde <= dia) and (not hasta or dia <= hasta)
+                       for desde, hasta in rangos)
+            ]
+            libre_desde = self.hora_inicio_jornada
+            anterior = None     # sede atendida antes en el día, (sede,) si la hay
+            intentos = 0
+            while cola and intentos < len(cola):
+                sede = cola[0]
+                pendientes = por_sede[sede]
+                aptos = [eid for eid in presentes
+                         if eid in pendientes or sede in cobertura.get(eid, ())]
+                if not aptos:
+                    # Nadie del equipo atiende esta sede hoy: se prueba la siguiente
+                    cola.rotate(-1)
+                    intentos += 1
+                    continue
+                hora = libre_desde
+                if anterior:
+                    hora += self._horas_traslado(anterior[0], sede, coordenadas)
+                if hora + duraciones[False] / 60.0 > fin_jornada:
+                    break
+                libres = [(hora, eid) for eid in aptos]
+                heapq.heapify(libres)
+                items = []
+                while libres and any(pendientes.values()):
+                    libre, eid = heapq.heappop(libres)
+                    duracion = duraciones.get(eid, duraciones[False]) / 60.0
+                    if libre + duracion > fin_jornada:
+                        continue
+                    propias = pendientes.get(eid)
+                    origen = propias if propias else max(pendientes.values(), key=len)
+                    items.append((origen.pop(0), eid, libre, libre + duracion))
+                    heapq.heappush(libres, (libre + duracion, eid))
+                if items:
+                    agendas.append(({
+                        'campana_id': self.id,
+                        'team_id':    team_id,
+                        'fecha':      dia,
+                        'sede_id':    sede or False,
+                        'estado':     'planeada',
+                    }, items))
+                    intentos = 0
+                if any(pendientes.values()):
+                    break           # la jornada se llenó; se sigue aquí mañana
+                cola.popleft()
+                if items:
+                    libre_desde = max(fin for _t, _e, _i, fin in items)
+                    anterior = (sede,)
+        return agendas
+
+    @api.model
+    def _km_recorrido(self, agendas, coordenadas):
+        """Km entre sedes ubicadas de las agendas de una unidad, día por día."""
+        por_dia = defaultdict(list)
+        for vals, _items in agendas:
+            if vals['sede_id'] in coordenadas:
+                por_dia[vals['fecha']].append(vals['sede_id'])
+        return sum(longitud_recorrido(sedes, coordenadas) for sedes in por_dia.values())
+
+    def _horas_traslado(self, origen, destino, coordenadas):
+        """Horas de traslado entre dos sedes: por distancia si ambas tienen ubicación."""
+        if origen in coordenadas and destino in coordenadas:
+            minutos = distancia_km(coordenadas[origen], coordenadas[destino]) \
+                / self.velocidad_traslado * 60
+            return math.ceil(minutos / REDONDEO_DURACION) * REDONDEO_DURACION / 60.0
+        return self.minutos_traslado / 60.0
+
+    def _tareas_sin_agenda(self):
+        """[(tarea, ejecutor, institución)] abiertas y sin ítem de agenda vigente."""
+        Task = self.env['luker.operation.task']
+        Item = self.env['luker.operation.agenda.item']
+        Agenda = self.env['luker.operation.agenda']
+        Task.flush_model(['campana_id', 'estado', 'executor_id', 'asignacion_id',
+                          'participante_id', 'fecha_programada'])
+        Item.flush_model(['task_id', 'estado', 'agenda_id'])
+        Agenda.flush_model(['estado'])
+        self.env['luker.operation.assignment'].flush_model(['institucion_id'])
+        self.env['luker.participant'].flush_model(['institucion_actual_id'])
+        self.env.cr.execute(
+            f'''
+            SELECT t.id, t.executor_id,
+                   COALESCE(a.institucion_id, p.institucion_actual_id) AS institucion
+              FROM "{Task._table}" t
+              JOIN luker_participant p ON p.id = t.participante_id
+              LEFT JOIN luker_operation_assignment a ON a.id = t.asignacion_id
+             WHERE t.campana_id = %(campana)s
+               AND t.estado IN %(estados)s
+               AND NOT EXISTS (
+                   SELECT 1
+                     FROM "{Item._table}" i
+                     JOIN "{Agenda._table}" g ON g.id = i.agenda_id
+                    WHERE i.task_id = t.id
+                      AND i.estado != 'cancelado' AND g.estado != 'cancelada')
+             ORDER BY institucion, t.fecha_programada, t.id
+            ''',
+            {'campana': self.id, 'estados': ESTADOS_PROGRAMABLES},
+        )
+        return self.env.cr.fetchall()
+
+    def _duraciones_esperadas(self):
+        """{ejecutor: minutos} estimados; la clave False es el valor general."""
+        Task = self.env['luker.operation.task']
+        dominio = [('survey_id', '=', self.survey_id.id), ('estado', '=', 'completado'),
+                   ('duracion_minutos', '>', 0)]
+
+        def redondear(minutos):
+            return math.ceil(minutos / REDONDEO_DURACION) * REDONDEO_DURACION
+
+        [(promedio,)] = Task._read_group(dominio, [], ['duracion_minutos:avg'])
+        duraciones = {False: redondear(promedio) if promedio else self.duracion_sesion_defecto}
+        for ejecutor, promedio_ejecutor, cantidad in Task._read_group(
+                dominio, ['executor_id'], ['duracion_minutos:avg', '__count']):
+            if cantidad >= MIN_MUESTRAS_DURACION:
+                duraciones[ejecutor.id] = redondear(promedio_ejecutor)
+        return duraciones
+
+    def _dias_con_agenda(self):
+        """{(unidad, fecha)} que ya tienen agenda vigente en la campaña."""
+        ocupados = set()
+        for agenda in self.env['luker.operation.agenda'].search_fetch(
+                [('campana_id', '=', self.id), ('estado', '!=', 'cancelada')],
+                ['team_id', 'fecha', 'item_ids']):
+            if agenda.team_id:
+                ocupados.add((('equipo', agenda.team_id.id), agenda.fecha))
+            else:
+                for eid in agenda.item_ids.executor_id.ids:
+                    ocupados.add((('ejecutor', eid), agenda.fecha))
+        return ocupados
+
+    def _crear_agendas(self, agendas):
+        """Crea agendas e ítems en bloque y ajusta aplicador y hora de las tareas."""
+        if not agendas:
+            return 0
+        Agenda = self.env['luker.operation.agenda'].with_context(
+            tracking_disable=True, mail_create_nolog=True, mail_create_nosubscribe=True)
+        Task = self.env['luker.operation.task'].with_context(tracking_disable=True)
+        registros = Agenda.create([vals for vals, _items in agendas])
+
+        item_vals = []
+        por_ejecutor = defaultdict(list)
+        por_hora = defaultdict(list)
+        inicio_dia = {}
+        for agenda, (vals, items) in zip(registros, agendas):
+            dia = vals['fecha']
+            if dia not in inicio_dia:
+                inicio_dia[dia] = self._rango_utc(dia)[0]
+            for tarea_id, eid, hora_inicio, hora_fin in items:
+                item_vals.append({
+                    'agenda_id':   agenda.id,
+                    'task_id':     tarea_id,
+                    'hora_inicio': hora_inicio,
+                    'hora_fin':    hora_fin,
+                })
+                por_ejecutor[eid].append(tarea_id)
+                por_hora[inicio_dia[dia] + timedelta(hours=hora_inicio)].append(tarea_id)
+
+        # Reasignaciones dentro del equipo: un write por aplicador, solo
+        # sobre las tareas que cambian
+        self.env.cr.execute(
+            'SELECT id, executor_id FROM luker_operation_task WHERE id = ANY(%s)',
+            [[v['task_id'] for v in item_vals]])
+        actual = dict(self.env.cr.fetchall())
+        for eid, tarea_ids in por_ejecutor.items():
+            cambian = [tid for tid in tarea_ids if actual.get(tid) != eid]
+            if cambian:
+                Task.browse(cambian).write({'executor_id': eid})
+        for fecha_hora, tarea_ids in por_hora.items():
+            Task.browse(tarea_ids).write({'fecha_programada': fecha_hora, 'estado': 'programado'})
+        self.env['luker.operation.agenda.item'].create(item_vals)
+        return len(item_vals)
+
+
+class LukerOperationExecutorRuta(models.Model):
+    _inherit = 'luker.operation.executor'
+
+    def plan_del_dia(self, fecha=None):
+        """
+        Plan ordenado del día del aplicador: los ítems de sus agendas
+        vigentes por hora o, si no tiene agenda ese día, sus tareas
+        programadas agrupadas por sede en orden de recorrido.
+        [{'orden', 'task_id', 'sede_id', 'hora_inicio', 'hora_fin'}]
+        """
+        self.ensure_one()
+        fecha = fecha or fields.Date.context_today(
+            self.with_context(tz=self.user_id.tz or 'America/Bogota'))
+        items = self.env['luker.operation.agenda.item'].search_fetch(
+            [('executor_id', '=', self.id), ('agenda_id.fecha', '=', fecha),
+             ('agenda_id.estado', '!=', 'cancelada'), ('estado', '!=', 'cancelado')],
+            ['agenda_id', 'task_id', 'hora_inicio', 'hora_fin'], order='hora_inicio, id')
+        if items:
+            filas = [(i.task_id.id, i.agenda_id.sede_id.id, i.hora_inicio, i.hora_fin)
+                     for i in items]
+        else:
+            desde, hasta = self.env['luker.operation.campaign']._rango_utc(fecha)
+            por_sede = defaultdict(list)
+            for t in self.env['luker.operation.task'].search_fetch(
+                    [('executor_id', '=', self.id),
+                     ('fecha_programada', '>=', desde), ('fecha_programada', '<', hasta),
+                     ('estado', 'not in', ESTADOS_SIN_CUPO)],
+                    ['asignacion_id', 'participante_id'], order='fecha_programada, id'):
+                sede = t.asignacion_id.institucion_id or t.participante_id.institucion_actual_id
+                por_sede[sede.id].append(t.id)
+            coordenadas = self.env['luker.organization']._coordenadas(
+                [s for s in por_sede if s])
+            ubicadas = [s for s in por_sede if s in coordenadas]
+            orden = ordenar_recorrido(
+                {s: coordenadas[s] for s in ubicadas}, inicio=ubicadas[0]) if ubicadas else []
+            orden += [s for s in por_sede if s not in coordenadas]
+            filas = [(tid, sede, False, False) for sede in orden for tid in por_sede[sede]]
+        return [
+            {'orden': n, 'task_id': tid, 'sede_id': sede or False,
+             'hora_inicio': hora_inicio, 'hora_fin': hora_fin}
+            for n, (tid, sede, hora_inicio, hora_fin) in enumerate(filas, 1)
+        ]
@@ -1,8 +1,22 @@
 # -*- coding: utf-8 -*-
 # OPE_Asignacion — Asignación de participante a campaña
+import logging
+import time
+
+from psycopg2 import IntegrityError
+
+from collections import Counter
+
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
 
+from .campaign import _registrar_deltas_contador
+
+_logger = logging.getLogger(__name__)
+
+# Asignaciones por create() en la asignación masiva
+LOTE_ASIGNACION = 1000
+
 
 class LukerOperationAssignment(models.Model):
     _name        = 'luker.operation.assignment'
@@ -70,7 +84,90 @@ class LukerOperationAssignment(models.Model):
          'Este participante ya está asignado a esta campaña.'),
     ]
 
+    # ── Contador de asignaciones de la campaña ────────────────────────────────
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._ajustar_contador_campana(+1)
+        return records
+
+    def write(self, vals):
+        if 'campana_id' not in vals:
+            return super().write(vals)
+        self._ajustar_contador_campana(-1)
+        res = super().write(vals)
+        self._ajustar_contador_campana(+1)
+        return res
+
+    def unlink(self):
+        self._ajustar_contador_campana(-1)
+        return super().unlink()
+
+    def _ajustar_contador_campana(self, signo):
+        por_campana = Counter(a.campana_id.id for a in self)
+        _registrar_deltas_contador(
+            self.env, 'luker.operation.campaign',
+            {cid: {'asignacion_count': signo * n} for cid, n in por_campana.items()})
+
     @api.onchange('executor_id')
     def _onchange_executor(self):
         if self.executor_id:
             self.estado = 'asignado'
+
+    # ── Asignación masiva ─────────────────────────────────────────────────────
+    @api.model
+    def _participantes_sin_asignar(self, campana_id, participante_ids):
+        """Anti-join: de ``participante_ids``, los que aún no están en la campaña."""
+        if not participante_ids:
+            return []
+        self.flush_model(['campana_id', 'participante_id'])
+        self.env.cr.execute(
+            f'''
+            SELECT p.id
+              FROM unnest(%(ids)s::int[]) AS p(id)
+             WHERE NOT EXISTS (
+                   SELECT 1 FROM "{self._table}" a
+                    WHERE a.campana_id = %(campana)s AND a.participante_id = p.id)
+             ORDER BY p.id
+            ''',
+            {'ids': list(participante_ids), 'campana': campana_id},
+        )
+        return [pid for pid, in self.env.cr.fetchall()]
+
+    @api.model
+    def _asignar_en_bloque(self, campana, participante_ids, lote=LOTE_ASIGNACION):
+        """
+        Asigna ``participante_ids`` a ``campana`` sin duplicar: calcula los
+        pares que faltan con una sola consulta y los crea en lotes. Si otro
+        proceso asigna a la vez, la restricción unique_campana_participante
+        hace fallar el lote; se vuelve a calcular lo que falta de ese lote y
+        se reintenta, de modo que los pares ya existentes se omiten.
+        Devuelve {'creados', 'omitidos', 'segundos'}.
+        """
+        inicio = time.monotonic()
+        participante_ids = list(dict.fromkeys(participante_ids))
+        faltantes = self._participantes_sin_asignar(campana.id, participante_ids)
+        creados = 0
+        for i in range(0, len(faltantes), lote):
+            bloque = faltantes[i:i + lote]
+            for _intento in range(2):
+                try:
+                    with self.env.cr.savepoint():
+                        self.create([
+                            {'campana_id': campana.id, 'participante_id': pid}
+                            for pid in bloque
+                        ])
+                    creados += len(bloque)
+                    break
+                except IntegrityError:
+                    self.invalidate_model()
+                    bloque = self._participantes_sin_asignar(campana.id, bloque)
+        resultado = {
+            'creados':  creados,
+            'omitidos': len(participante_ids) - creados,
+            'segundos': round(time.monotonic() - inicio, 2),
+        }
+        _logger.info('Asignación masiva campaña %s: %s creadas, %s omitidas en %ss.',
+                     campana.id, resultado['creados'], resultado['omitidos'],
+                     resultado['segundos'])
+        return resultado
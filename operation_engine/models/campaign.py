@@ -1,8 +1,135 @@
 # -*- coding: utf-8 -*-
 # OPE_Campaña — Campaña operativa SISPAR
+#
+# Contadores de tareas y asignaciones: las altas, bajas y cambios no tocan la
+# fila de la campaña (ni la del aplicador) en la misma transacción, porque
+# todas las tareas de una campaña competirían por su bloqueo. Se anotan en la
+# tabla de solo inserción luker.operation.counter.delta y un cron las suma a
+# los contadores cada minuto; hasta entonces los contadores van con ese
+# retraso.
+import logging
+from collections import defaultdict
+
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
 
+_logger = logging.getLogger(__name__)
+
+# Contador que suma cada estado de tarea (en campaña y en aplicador); las
+# canceladas solo cuentan en el total
+CONTADOR_POR_ESTADO = {
+    'pendiente':    'tarea_pendiente_count',
+    'programado':   'tarea_pendiente_count',
+    'reprogramado': 'tarea_pendiente_count',
+    'en_progreso':  'tarea_en_progreso_count',
+    'completado':   'tarea_completada_count',
+    'fallido':      'tarea_fallida_count',
+}
+CONTADORES_TAREA = ('tarea_count', 'tarea_pendiente_count', 'tarea_en_progreso_count',
+                    'tarea_completada_count', 'tarea_fallida_count')
+
+
+def _aplicar_deltas_contador(env, model_name, deltas):
+    """
+    Suma ``deltas`` ({id: {campo: delta}}) a los contadores con un UPDATE
+    por combinación distinta de deltas, sin pasar por write(). En la
+    campaña recalcula además pct_avance de los registros tocados.
+    """
+    por_combinacion = defaultdict(list)
+    for rec_id, campos in deltas.items():
+        combinacion = tuple(sorted((campo, d) for campo, d in campos.items() if d))
+        if rec_id and combinacion:
+            por_combinacion[combinacion].append(rec_id)
+    if not por_combinacion:
+        return
+    Model = env[model_name]
+    tocados = set()
+    for combinacion, ids in por_combinacion.items():
+        asignaciones = ', '.join(f'{campo} = COALESCE({campo}, 0) + %s' for campo, _d in combinacion)
+        env.cr.execute(
+            f'UPDATE "{Model._table}" SET {asignaciones} WHERE id = ANY(%s)',
+            [d for _campo, d in combinacion] + [ids],
+        )
+        tocados.update(ids)
+    campos = {campo for combinacion in por_combinacion for campo, _d in combinacion}
+    if 'pct_avance' in Model._fields:
+        env.cr.execute(
+            f'''
+            UPDATE "{Model._table}"
+               SET pct_avance = CASE WHEN tarea_count > 0
+                                     THEN round(100.0 * tarea_completada_count / tarea_count, 1)
+                                     ELSE 0 END
+             WHERE id = ANY(%s)
+            ''',
+            [list(tocados)],
+        )
+        campos.add('pct_avance')
+    Model.invalidate_model(list(campos))
+
+
+def _registrar_deltas_contador(env, model_name, deltas):
+    """
+    Anota ``deltas`` ({id: {campo: delta}}) para que el cron de consolidación
+    los aplique con _aplicar_deltas_contador. Un solo INSERT, sin bloquear
+    la fila del contador.
+    """
+    filas = [
+        (rec_id, campo, d)
+        for rec_id, campos in deltas.items() if rec_id
+        for campo, d in campos.items() if d
+    ]
+    if not filas:
+        return
+    Delta = env['luker.operation.counter.delta']
+    env.cr.execute(
+        f'''
+        INSERT INTO "{Delta._table}" (modelo, res_id, campo, delta)
+        SELECT %s, res_id, campo, delta
+          FROM unnest(%s::int[], %s::varchar[], %s::int[]) AS d(res_id, campo, delta)
+        ''',
+        [model_name, [f[0] for f in filas], [f[1] for f in filas], [f[2] for f in filas]],
+    )
+
+
+class LukerOperationCounterDelta(models.Model):
+    _name        = 'luker.operation.counter.delta'
+    _description = 'Delta pendiente de contadores de tareas'
+    _log_access  = False
+
+    modelo = fields.Char(string='Modelo', required=True, readonly=True)
+    res_id = fields.Integer(string='ID del registro', required=True, readonly=True)
+    campo  = fields.Char(string='Contador', required=True, readonly=True)
+    delta  = fields.Integer(string='Delta', required=True, readonly=True)
+
+    @api.model
+    def _cron_consolidar(self):
+        """
+        Suma los deltas anotados a los contadores y los elimina, en una
+        sola sentencia: cada fila de campaña o aplicador se actualiza una
+        vez por corrida, sin importar cuántas tareas cambiaron.
+        """
+        self.env.cr.execute(f'''
+            WITH consumidos AS (
+                DELETE FROM "{self._table}" RETURNING modelo, res_id, campo, delta
+            )
+            SELECT modelo, res_id, campo, SUM(delta), COUNT(*)
+              FROM consumidos
+             GROUP BY modelo, res_id, campo
+        ''')
+        por_modelo = defaultdict(lambda: defaultdict(dict))
+        anotados = 0
+        for modelo, res_id, campo, delta, n in self.env.cr.fetchall():
+            por_modelo[modelo][res_id][campo] = delta
+            anotados += n
+        for modelo, deltas in por_modelo.items():
+            _aplicar_deltas_contador(self.env, modelo, deltas)
+        if anotados:
+            _logger.info(
+                'Contadores: %s deltas consolidados en %s registros.',
+                anotados, sum(len(d) for d in por_modelo.values()),
+            )
+        return anotados
+
 
 class LukerOperationCampaign(models.Model):
     _name        = 'luker.operation.campaign'
@@ -78,9 +205,10 @@ class LukerOperationCampaign(models.Model):
     notas = fields.Text(string='Notas operativas')
 
     # ── Estadísticas ──────────────────────────────────────────────────────────
+    # Contadores guardados: se mantienen al crear, modificar o eliminar
+    # asignaciones y tareas; "Recalcular contadores" los repara.
     asignacion_count = fields.Integer(
-        string='Asignaciones',
-        compute='_compute_stats', store=False,
+        string='Asignaciones', readonly=True, copy=False, default=0,
     )
     asignacion_ids = fields.One2many(
         'luker.operation.assignment',
@@ -88,16 +216,22 @@ class LukerOperationCampaign(models.Model):
         string='Asignaciones',
     )
     tarea_count = fields.Integer(
-        string='Tareas',
-        compute='_compute_stats', store=False,
+        string='Tareas', readonly=True, copy=False, default=0,
+    )
+    tarea_pendiente_count = fields.Integer(
+        string='Pendientes', readonly=True, copy=False, default=0,
+    )
+    tarea_en_progreso_count = fields.Integer(
+        string='En progreso', readonly=True, copy=False, default=0,
     )
     tarea_completada_count = fields.Integer(
-        string='Completadas',
-        compute='_compute_stats', store=False,
+        string='Completadas', readonly=True, copy=False, default=0,
+    )
+    tarea_fallida_count = fields.Integer(
+        string='Fallidas', readonly=True, copy=False, default=0,
     )
     pct_avance = fields.Float(
-        string='Avance %',
-        compute='_compute_stats', store=False,
+        string='Avance %', readonly=True, copy=False, default=0.0,
         digits=(5, 1),
     )
 
@@ -113,21 +247,42 @@ class LukerOperationCampaign(models.Model):
         for c in self:
             c.anio = c.fecha_inicio.year if c.fecha_inicio else 0
 
-    @api.depends()
-    def _compute_stats(self):
-        Assignment = self.env['luker.operation.assignment']
+    @api.model
+    def action_recalcular_contadores(self):
+        """Reconstruye los contadores de campañas y aplicadores con consultas agrupadas."""
+        self._recalcular_contadores()
+        return {'type': 'ir.actions.client', 'tag': 'reload'}
+
+    @api.model
+    def _recalcular_contadores(self):
         Task = self.env['luker.operation.task']
-        for c in self:
-            asigs = Assignment.search([('campana_id', '=', c.id)])
-            tareas = Task.search([('campana_id', '=', c.id)])
-            completadas = tareas.filtered(lambda t: t.estado == 'completado')
-            c.asignacion_count = len(asigs)
-            c.tarea_count = len(tareas)
-            c.tarea_completada_count = len(completadas)
-            c.pct_avance = (
-                len(completadas) / len(tareas) * 100
-                if tareas else 0.0
+        Executor = self.env['luker.operation.executor']
+        # El recálculo parte de las tablas: los deltas pendientes sobran
+        Delta = self.env['luker.operation.counter.delta']
+        self.env.cr.execute(f'DELETE FROM "{Delta._table}"')
+        for Model, campos in ((self, ('asignacion_count',) + CONTADORES_TAREA),
+                              (Executor, CONTADORES_TAREA)):
+            Model.flush_model()
+            self.env.cr.execute(
+                f'UPDATE "{Model._table}" SET '
+                + ', '.join(f'{campo} = 0' for campo in campos)
+                + (', pct_avance = 0' if 'pct_avance' in Model._fields else '')
             )
+            Model.invalidate_model()
+
+        por_campana = defaultdict(lambda: defaultdict(int))
+        por_ejecutor = defaultdict(lambda: defaultdict(int))
+        for campana, n in self.env['luker.operation.assignment']._read_group(
+                [], ['campana_id'], ['__count']):
+            por_campana[campana.id]['asignacion_count'] += n
+        for campana, ejecutor, estado, n in Task._read_group(
+                [], ['campana_id', 'executor_id', 'estado'], ['__count']):
+            for destino in (por_campana[campana.id], por_ejecutor[ejecutor.id]):
+                destino['tarea_count'] += n
+                if estado in CONTADOR_POR_ESTADO:
+                    destino[CONTADOR_POR_ESTADO[estado]] += n
+        _aplicar_deltas_contador(self.env, self._name, por_campana)
+        _aplicar_deltas_contador(self.env, Executor._name, por_ejecutor)
 
     # ── Constraints ──────────────────────────────────────────────────────────
     @api.constrains('fecha_inicio', 'fecha_fin')
@@ -164,31 +319,40 @@ class LukerOperationCampaign(models.Model):
             raise ValidationError(
                 'Selecciona al menos una institución en la pestaña de Asignaciones.'
             )
-        Participante = self.env['luker.participant']
-        Assignment = self.env['luker.operation.assignment']
-        creados = 0
-        for institucion in self.institucion_ids:
-            participantes = Participante.search([
-                ('institucion_actual_id', '=', institucion.id),
-                ('estado', '=', 'activo'),
-            ])
-            for p in participantes:
-                existe = Assignment.search([
-                    ('campana_id', '=', self.id),
-                    ('participante_id', '=', p.id),
-                ], limit=1)
-                if not existe:
-                    Assignment.create({
-                        'campana_id':      self.id,
-                        'participante_id': p.id,
-                    })
-                    creados += 1
+        participantes = self.env['luker.participant'].search([
+            ('institucion_actual_id', 'in', self.institucion_ids.ids),
+            ('estado', '=', 'activo'),
+        ])
+        resultado = self.env['luker.operation.assignment']._asignar_en_bloque(
+            self, participantes.ids)
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
                 'title': 'Asignación masiva completada',
-                'message': f'Se crearon {creados} asignaciones nuevas.',
+                'message': (
+                    f'Se crearon {resultado["creados"]} asignaciones nuevas; '
+                    f'{resultado["omitidos"]} participantes ya estaban asignados '
+                    f'({resultado["segundos"]} s).'
+                ),
+                'type': 'success',
+            }
+        }
+
+    def action_generar_snapshots(self):
+        """Congela el contexto de toda la población asignada a la campaña."""
+        self.ensure_one()
+        asignaciones = self.env['luker.operation.assignment'].search_fetch(
+            [('campana_id', '=', self.id)], ['participante_id'])
+        snapshots = self.env['luker.participant.snapshot'].generar_snapshots(
+            asignaciones.participante_id, campana_id=self.id)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Snapshots de contexto',
+                'message': f'{len(snapshots)} participantes con contexto congelado '
+                           f'(se reutilizan los snapshots sin cambios).',
                 'type': 'success',
             }
         }
@@ -103,26 +103,22 @@ class LukerOperationExecutor(models.Model):
     )
 
     # ── Estadísticas ──────────────────────────────────────────────────────────
+    # Se mantienen desde las tareas (ver luker.operation.task)
     tarea_count = fields.Integer(
-        string='Tareas',
-        compute='_compute_tarea_count',
-        store=False,
+        string='Tareas', readonly=True, copy=False, default=0,
+    )
+    tarea_pendiente_count = fields.Integer(
+        string='Pendientes', readonly=True, copy=False, default=0,
+    )
+    tarea_en_progreso_count = fields.Integer(
+        string='En progreso', readonly=True, copy=False, default=0,
     )
     tarea_completada_count = fields.Integer(
-        string='Completadas',
-        compute='_compute_tarea_count',
-        store=False,
-    )
-
-    @api.depends()
-    def _compute_tarea_count(self):
-        Task = self.env['luker.operation.task']
-        for ex in self:
-            tareas = Task.search([('executor_id', '=', ex.id)])
-            ex.tarea_count = len(tareas)
-            ex.tarea_completada_count = len(
-                tareas.filtered(lambda t: t.estado == 'completado')
-            )
+        string='Completadas', readonly=True, copy=False, default=0,
+    )
+    tarea_fallida_count = fields.Integer(
+        string='Fallidas', readonly=True, copy=False, default=0,
+    )
 
     # ── Constraint: un empleado = un ejecutor ─────────────────────────────────
     _sql_constraints = [
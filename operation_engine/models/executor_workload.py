@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+# Carga y productividad de aplicadores — cubo materializado.
+#
+# Una fila por (campaña, aplicador, día, institución) con tareas del día,
+# completadas, fallidas, duración acumulada y novedades reportadas. El día
+# de una tarea es el de su cierre (fecha_fin_real) o, si sigue abierta, el
+# programado; se toma en la zona horaria de operación.
+#
+# El refresco es incremental por particiones (campaña, día): se recalculan
+# completas las que tienen tareas o novedades con write_date posterior a la
+# marca de agua, más las que quedaron anotadas como sucias cuando una tarea
+# o novedad cambió de día o de campaña (la partición de origen ya no se ve
+# desde el estado nuevo). Esas particiones se anotan en una tabla de solo
+# inserción (luker.operation.executor.workload.dirty) que consume el cron:
+# la transacción del usuario no toca filas del cubo. Recalcular una
+# partición es idempotente, así que la marca se solapa unos minutos para no
+# perder transacciones que confirmaron tarde.
+import logging
+from datetime import timedelta
+
+from odoo import models, fields, api, tools
+
+_logger = logging.getLogger(__name__)
+
+PARAM_MARCA = 'operation_engine.carga_ejecutor_marca'
+# Solape de la marca de agua con el refresco anterior
+SOLAPE_MARCA = timedelta(minutes=10)
+# Zona horaria de operación para asignar el día
+TZ_OPERACION = 'America/Bogota'
+# Conteos acumulables del cubo
+CONTADORES = ('tareas', 'completadas', 'fallidas', 'suma_duracion', 'con_duracion', 'incidentes')
+# Campos que pueden mover una tarea o novedad de partición
+CAMPOS_PARTICION_TAREA = ('campana_id', 'estado', 'fecha_programada', 'fecha_fin_real')
+CAMPOS_PARTICION_INCIDENTE = ('campana_id', 'fecha_incidente')
+
+# Día de la tarea en la zona de operación
+DIA_TAREA = ("(COALESCE(t.fecha_fin_real, t.fecha_programada) "
+             "AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date")
+DIA_INCIDENTE = "(i.fecha_incidente AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date"
+
+
+def _calcular_tasas(valores):
+    """Métricas derivadas de los conteos (sirve para filas y para grupos)."""
+    con_duracion = valores.get('con_duracion') or 0
+    atendidas = (valores.get('completadas') or 0) + (valores.get('fallidas') or 0)
+    return {
+        'duracion_promedio': (valores.get('suma_duracion') or 0) / con_duracion if con_duracion else 0.0,
+        'tasa_incidentes': (valores.get('incidentes') or 0) / atendidas * 100 if atendidas else 0.0,
+    }
+
+
+class LukerOperationExecutorWorkload(models.Model):
+    _name        = 'luker.operation.executor.workload'
+    _description = 'Carga y productividad de aplicadores'
+    _order       = 'fecha desc, campana_id, executor_id'
+    _rec_name    = 'executor_id'
+
+    # ── Dimensiones ──────────────────────────────────────────────────────────
+    campana_id = fields.Many2one(
+        'luker.operation.campaign', string='Campaña',
+        readonly=True, ondelete='cascade', index=True,
+    )
+    executor_id = fields.Many2one(
+        'luker.operation.executor', string='Aplicador',
+        readonly=True, ondelete='cascade', index=True,
+    )
+    fecha = fields.Date(string='Día', readonly=True, index=True)
+    institucion_id = fields.Many2one(
+        'luker.organization', string='Institución',
+        readonly=True, ondelete='set null',
+    )
+
+    # ── Conteos ──────────────────────────────────────────────────────────────
+    tareas        = fields.Integer(string='Tareas del día', readonly=True)
+    completadas   = fields.Integer(string='Completadas', readonly=True)
+    fallidas      = fields.Integer(string='Fallidas', readonly=True)
+    suma_duracion = fields.Integer(string='Minutos de aplicación', readonly=True)
+    con_duracion  = fields.Integer(
+        string='Sesiones con duración', readonly=True,
+        help='Tareas completadas con duración registrada.')
+    incidentes    = fields.Integer(string='Novedades', readonly=True)
+
+    # ── Tasas (en agrupaciones se recalculan desde los conteos) ──────────────
+    duracion_promedio = fields.Float(
+        string='Duración media (min)', digits=(16, 1), aggregator='avg', readonly=True)
+    tasa_incidentes = fields.Float(
+        string='Novedades por 100 tareas', digits=(5, 1), aggregator='avg', readonly=True)
+
+    fecha_actualizacion = fields.Datetime(string='Última actualización', readonly=True)
+
+    def init(self):
+        tools.create_unique_index(
+            self._cr,
+            'luker_operation_executor_workload_dim_uniq',
+            self._table,
+            [
+                'COALESCE(campana_id, 0)', 'COALESCE(executor_id, 0)', 'fecha',
+                'COALESCE(institucion_id, 0)',
+            ],
+        )
+        tools.create_index(
+            self._cr,
+            'luker_operation_executor_workload_particion_idx',
+            self._table,
+            ['campana_id', 'fecha'],
+        )
+
+    @api.model
+    def read_group(self, domain, fields, groupby, offset=0, limit=None, orderby=False, lazy=True):
+        """Las tasas de cada grupo se ponderan con sus conteos, no se promedian."""
+        tasas = set(_calcular_tasas({}))
+        pedidos = {spec.split(':')[0] for spec in fields}
+        if not tasas & pedidos:
+            return super().read_group(
+                domain, fields, groupby, offset=offset, limit=limit,
+                orderby=orderby, lazy=lazy)
+        extra = [f'{c}:sum' for c in CONTADORES if c not in pedidos]
+        resultado = super().read_group(
+            domain, list(fields) + extra, groupby, offset=offset, limit=limit,
+            orderby=orderby, lazy=lazy)
+        for fila in resultado:
+            for nombre, valor in _calcular_tasas(fila).items():
+                if nombre in pedidos:
+                    fila[nombre] = valor
+        return resultado
+
+    # ── Refresco incremental ─────────────────────────────────────────────────
+    @api.model
+    def _cron_refrescar(self):
+        return self._refrescar_incremental()
+
+    @api.model
+    def _refrescar_incremental(self):
+        """
+        Recalcula las particiones tocadas desde la marca de agua y las
+        anotadas como sucias (que se consumen). Devuelve el número de
+        particiones recalculadas.
+        """
+        Param = self.env['ir.config_parameter'].sudo()
+        marca = fields.Datetime.to_datetime(Param.get_param(PARAM_MARCA) or False)
+        self.env.cr.execute('SELECT now() AT TIME ZONE \'UTC\'')
+        [ahora] = self.env.cr.fetchone()
+        self.env['luker.operation.task'].flush_model()
+        self.env['luker.operation.incident'].flush_model()
+        self.flush_model()
+
+        params = {'tz': TZ_OPERACION, 'desde': marca - SOLAPE_MARCA if marca else None}
+        Sucia = self.env['luker.operation.executor.workload.dirty']
+        self.env.cr.execute(
+            f'''
+            WITH sucias AS (
+                DELETE FROM "{Sucia._table}" RETURNING campana_id, fecha
+            )
+            SELECT t.campana_id, {DIA_TAREA}
+              FROM luker_operation_task t
+             WHERE (%(desde)s IS NULL OR t.write_date >= %(desde)s)
+               AND COALESCE(t.fecha_fin_real, t.fecha_programada) IS NOT NULL
+            UNION
+            SELECT i.campana_id, {DIA_INCIDENTE}
+              FROM luker_operation_incident i
+             WHERE (%(desde)s IS NULL OR i.write_date >= %(desde)s)
+               AND i.fecha_incidente IS NOT NULL
+            UNION
+            SELECT campana_id, fecha FROM sucias
+            ''',
+            params,
+        )
+        particiones = self.env.cr.fetchall()
+        self._recalcular_particiones(particiones)
+        Param.set_param(PARAM_MARCA, fields.Datetime.to_string(ahora))
+        _logger.info('Carga de aplicadores: %s particiones recalculadas.', len(particiones))
+        return len(particiones)
+
+    @api.model
+    def _recalcular_particiones(self, particiones):
+        """Reemplaza las filas de las particiones [(campaña, día)] en dos sentencias."""
+        if not particiones:
+            return
+        params = {
+            'tz': TZ_OPERACION,
+            'campanas': [c for c, _d in particiones],
+            'fechas': [d for _c, d in particiones],
+            # Prefiltro en UTC con un día de margen por la zona horaria
+            'desde': min(d for _c, d in particiones) - timedelta(days=1),
+            'hasta': max(d for _c, d in particiones) + timedelta(days=2),
+            'uid': self.env.uid,
+        }
+        cr = self.env.cr
+        cr.execute(
+            f'''
+            DELETE FROM "{self._table}" w
+             USING unnest(%(campanas)s::int[], %(fechas)s::date[]) AS p(campana_id, fecha)
+             WHERE w.campana_id = p.campana_id AND w.fecha = p.fecha
+            ''',
+            params,
+        )
+        cr.execute(
+            f'''
+            WITH p AS (
+                SELECT DISTINCT campana_id, fecha
+                  FROM unnest(%(campanas)s::int[], %(fechas)s::date[]) AS p(campana_id, fecha)
+            ), hechos AS (
+                SELECT t.campana_id, t.executor_id, {DIA_TAREA} AS fecha,
+                       COALESCE(a.institucion_id, pa.institucion_actual_id) AS institucion_id,
+                       1 AS tareas,
+                       (t.estado = 'completado')::int AS completadas,
+                       (t.estado = 'fallido')::int AS fallidas,
+                       CASE WHEN t.estado = 'completado' THEN COALESCE(t.duracion_minutos, 0) ELSE 0 END
+                           AS suma_duracion,
+                       (t.estado = 'completado' AND t.duracion_minutos > 0)::int AS con_duracion,
+                       0 AS incidentes
+                  FROM luker_operation_task t
+                  LEFT JOIN luker_operation_assignment a ON a.id = t.asignacion_id
+                  LEFT JOIN luker_participant pa ON pa.id = t.participante_id
+                 WHERE t.campana_id = ANY(%(campanas)s)
+                   AND t.estado != 'cancelado'
+                   AND COALESCE(t.fecha_fin_real, t.fecha_programada) >= %(desde)s
+                   AND COALESCE(t.fecha_fin_real, t.fecha_programada) < %(hasta)s
+                UNION ALL
+                SELECT i.campana_id, i.executor_id, {DIA_INCIDENTE},
+                       COALESCE(a.institucion_id, pa.institucion_actual_id),
+                       0, 0, 0, 0, 0, 1
+                  FROM luker_operation_incident i
+                  LEFT JOIN luker_operation_task t ON t.id = i.task_id
+                  LEFT JOIN luker_operation_assignment a ON a.id = t.asignacion_id
+                  LEFT JOIN luker_participant pa ON pa.id = t.participante_id
+                 WHERE i.campana_id = ANY(%(campanas)s)
+                   AND i.fecha_incidente >= %(desde)s
+                   AND i.fecha_incidente < %(hasta)s
+            )
+            INSERT INTO "{self._table}" (
+                campana_id, executor_id, fecha, institucion_id,
+                tareas, completadas, fallidas, suma_duracion, con_duracion, incidentes,
+                duracion_promedio, tasa_incidentes, fecha_actualizacion,
+                create_uid, create_date, write_uid, write_date)
+            SELECT h.campana_id, h.executor_id, h.fecha, h.institucion_id,
+                   sum(h.tareas), sum(h.completadas), sum(h.fallidas),
+                   sum(h.suma_duracion), sum(h.con_duracion), sum(h.incidentes),
+                   COALESCE(sum(h.suma_duracion)::float / NULLIF(sum(h.con_duracion), 0), 0),
+                   COALESCE(100.0 * sum(h.incidentes) / NULLIF(sum(h.completadas) + sum(h.fallidas), 0), 0),
+                   now() AT TIME ZONE 'UTC',
+                   %(uid)s, now() AT TIME ZONE 'UTC', %(uid)s, now() AT TIME ZONE 'UTC'
+              FROM hechos h
+              JOIN p ON p.campana_id = h.campana_id AND p.fecha = h.fecha
+             GROUP BY h.campana_id, h.executor_id, h.fecha, h.institucion_id
+            ''',
+            params,
+        )
+        self.invalidate_model()
+
+    @api.model
+    def _marcar_sucias(self, tabla, alias, dia_sql, ids):
+        """
+        Anota como sucias las particiones actuales de los registros ``ids``
+        de ``tabla`` (``dia_sql`` usa el alias ``alias``). Solo inserta: no
+        bloquea filas del cubo ni choca con el recálculo del cron.
+        """
+        if not ids:
+            return
+        Sucia = self.env['luker.operation.executor.workload.dirty']
+        self.env.cr.execute(
+            f'''
+            INSERT INTO "{Sucia._table}" (campana_id, fecha)
+            SELECT DISTINCT {alias}.campana_id, {dia_sql}
+              FROM {tabla} {alias}
+             WHERE {alias}.id = ANY(%(ids)s)
+               AND {dia_sql} IS NOT NULL
+            ''',
+            {'tz': TZ_OPERACION, 'ids': list(ids)},
+        )
+
+    @api.model
+    def action_reconstruir(self):
+        """Vacía el cubo y lo recalcula completo."""
+        self.env['ir.config_parameter'].sudo().set_param(PARAM_MARCA, False)
+        self.env.cr.execute(f'DELETE FROM "{self._table}"')
+        self.invalidate_model()
+        self._refrescar_incremental()
+        return {'type': 'ir.actions.client', 'tag': 'reload'}
+
+
+class LukerOperationExecutorWorkloadDirty(models.Model):
+    _name        = 'luker.operation.executor.workload.dirty'
+    _description = 'Partición pendiente del cubo de carga'
+    _log_access  = False
+
+    campana_id = fields.Integer(string='Campaña', readonly=True)
+    fecha      = fields.Date(string='Día', required=True, readonly=True)
+
+
+class LukerOperationTaskWorkload(models.Model):
+    _inherit = 'luker.operation.task'
+
+    def write(self, vals):
+        if any(f in vals for f in CAMPOS_PARTICION_TAREA):
+            self._marcar_particion_carga()
+        return super().write(vals)
+
+    def unlink(self):
+        self._marcar_particion_carga()
+        return super().unlink()
+
+    def _marcar_particion_carga(self):
+        self.flush_recordset(list(CAMPOS_PARTICION_TAREA))
+        self.env['luker.operation.executor.workload']._marcar_sucias(
+            'luker_operation_task', 't', DIA_TAREA, self.ids)
+
+
+class LukerOperationIncidentWorkload(models.Model):
+    _inherit = 'luker.operation.incident'
+
+    def write(self, vals):
+        if any(f in vals for f in CAMPOS_PARTICION_INCIDENTE):
+            self._marcar_particion_carga()
+        return super().write(vals)
+
+    def unlink(self):
+        self._marcar_particion_carga()
+        return super().unlink()
+
+    def _marcar_particion_carga(self):
+        self.flush_recordset(list(CAMPOS_PARTICION_INCIDENTE))
+        self.env['luker.operation.executor.workload']._marcar_sucias(
+            'luker_operation_incident', 'i', DIA_INCIDENTE, self.ids)
@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+# Analítica de respuestas por campaña — tabla materializada.
+#
+# Una fila por (campaña, instrumento, pregunta, institución, grado) con
+# conteos acumulados. Se alimenta de forma incremental desde las sesiones
+# (luker.application.result) completadas que aún no se han procesado, así
+# los tableros pivot/graph no recorren survey.response.line ni recalculan
+# la corrección línea por línea.
+#
+# Cada sesión guarda el aporte que sumó a la tabla. Si la sesión o sus
+# líneas de respuesta cambian vuelve a la cola, y el cron resta ese aporte
+# antes de sumar el nuevo.
+from collections import defaultdict
+
+from odoo import models, fields, api, tools
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Conteos acumulables (se suman al incorporar nuevas sesiones)
+CONTADORES = (
+    'total_respuestas', 'respondidas', 'omitidas',
+    'calificables', 'correctas', 'suma_puntaje',
+)
+TIPOS_CALIFICABLES = ('simple_choice', 'multiple_choice')
+LOTE_SESIONES = 500
+# Campos de la sesión y de la línea de respuesta que alteran su aporte
+CAMPOS_SESION_ANALITICA = (
+    'estado_sesion', 'campana_id', 'participante_id',
+    'snapshot_grado_grupo', 'survey_input_id', 'fecha_hora_inicio_dispositivo',
+)
+CAMPOS_LINEA_ANALITICA = (
+    'id_response_header', 'id_instrument', 'id_question',
+    'id_question_option', 'flg_omitted', 'num_score', 'val_text', 'val_json',
+)
+
+
+def _calcular_tasas(valores):
+    """Tasas derivadas de los conteos (sirve para filas y para grupos)."""
+    total = valores.get('total_respuestas') or 0
+    respondidas = valores.get('respondidas') or 0
+    calificables = valores.get('calificables') or 0
+    return {
+        'tasa_correctas': (valores.get('correctas') or 0) / calificables * 100 if calificables else 0.0,
+        'tasa_omision': (valores.get('omitidas') or 0) / total * 100 if total else 0.0,
+        'puntaje_promedio': (valores.get('suma_puntaje') or 0.0) / respondidas if respondidas else 0.0,
+    }
+
+
+class LukerOperationResponseAnalytics(models.Model):
+    _name        = 'luker.operation.response.analytics'
+    _description = 'Analítica de respuestas por campaña'
+    _order       = 'campana_id, survey_id, question_id, institucion_id, grado'
+    _rec_name    = 'question_id'
+
+    # ── Dimensiones ──────────────────────────────────────────────────────────
+    campana_id = fields.Many2one(
+        'luker.operation.campaign', string='Campaña',
+        readonly=True, ondelete='cascade', index=True,
+    )
+    survey_id = fields.Many2one(
+        'survey.survey', string='Instrumento',
+        required=True, readonly=True, ondelete='cascade', index=True,
+    )
+    question_id = fields.Many2one(
+        'survey.question', string='Pregunta',
+        required=True, readonly=True, ondelete='cascade',
+    )
+    institucion_id = fields.Many2one(
+        'luker.organization', string='Institución',
+        readonly=True, ondelete='set null', index=True,
+    )
+    grado = fields.Char(string='Grado', readonly=True)
+
+    # ── Conteos ──────────────────────────────────────────────────────────────
+    total_respuestas = fields.Integer(string='Respuestas', readonly=True)
+    respondidas      = fields.Integer(string='Respondidas', readonly=True)
+    omitidas         = fields.Integer(string='Omitidas', readonly=True)
+    calificables     = fields.Integer(
+        string='Calificables', readonly=True,
+        help='Respuestas no omitidas de preguntas de selección (única o múltiple).')
+    correctas        = fields.Integer(string='Correctas', readonly=True)
+    suma_puntaje     = fields.Float(string='Puntaje total', readonly=True)
+
+    # ── Tasas (en agrupaciones se recalculan desde los conteos) ──────────────
+    tasa_correctas = fields.Float(
+        string='% Correctas', digits=(5, 1), aggregator='avg',
+        compute='_compute_tasas', store=True)
+    tasa_omision = fields.Float(
+        string='% Omisión', digits=(5, 1), aggregator='avg',
+        compute='_compute_tasas', store=True)
+    puntaje_promedio = fields.Float(
+        string='Puntaje promedio', digits=(16, 2), aggregator='avg',
+        compute='_compute_tasas', store=True)
+
+    fecha_actualizacion = fields.Datetime(string='Última actualización', readonly=True)
+
+    def init(self):
+        # Una sola fila por combinación de dimensiones (los vacíos cuentan
+        # como un valor más para la unicidad).
+        tools.create_unique_index(
+            self._cr,
+            'luker_operation_response_analytics_dim_uniq',
+            self._table,
+            [
+                'COALESCE(campana_id, 0)', 'survey_id', 'question_id',
+                'COALESCE(institucion_id, 0)', "COALESCE(grado, '')",
+            ],
+        )
+
+    @api.depends(*CONTADORES)
+    def _compute_tasas(self):
+        for rec in self:
+            rec.update(_calcular_tasas({c: rec[c] for c in CONTADORES}))
+
+    @api.model
+    def read_group(self, domain, fields, groupby, offset=0, limit=None, orderby=False, lazy=True):
+        """Las tasas de cada grupo se ponderan con sus conteos, no se promedian."""
+        tasas = set(_calcular_tasas({}))
+        pedidos = {spec.split(':')[0] for spec in fields}
+        if not tasas & pedidos:
+            return super().read_group(
+                domain, fields, groupby, offset=offset, limit=limit,
+                orderby=orderby, lazy=lazy)
+        extra = [f'{c}:sum' for c in CONTADORES if c not in pedidos]
+        resultado = super().read_group(
+            domain, list(fields) + extra, groupby, offset=offset, limit=limit,
+            orderby=orderby, lazy=lazy)
+        for fila in resultado:
+            for nombre, valor in _calcular_tasas(fila).items():
+                if nombre in pedidos:
+                    fila[nombre] = valor
+        return resultado
+
+    # ── Refresco incremental ─────────────────────────────────────────────────
+    @api.model
+    def _cron_refrescar(self, limite=LOTE_SESIONES):
+        """Incorpora un lote de sesiones completadas; se re-dispara si quedan."""
+        procesadas = self._refrescar_incremental(limite)
+        if procesadas >= limite:
+            self.env.ref(
+                'operation_engine.cron_refrescar_analitica_respuestas'
+            )._trigger()
+        return procesadas
+
+    @api.model
+    def _sesiones_pendientes_domain(self):
+        # Completadas sin procesar, o procesadas antes y editadas/reabiertas
+        # (estas últimas conservan el aporte que hay que restar).
+        return [
+            ('analitica_procesada', '=', False),
+            '|',
+            '&', ('estado_sesion', '=', 'completada'), ('survey_input_id', '!=', False),
+            ('analitica_aporte', '!=', False),
+        ]
+
+    @api.model
+    def _refrescar_incremental(self, limite=LOTE_SESIONES):
+        """
+        Procesa hasta ``limite`` sesiones pendientes: resta el aporte que
+        tuvieran, suma el de sus respuestas actuales si siguen completadas y
+        las marca. Devuelve el número de sesiones procesadas.
+        """
+        Result = self.env['luker.application.result'].sudo()
+        sesiones = Result.search_fetch(
+            self._sesiones_pendientes_domain(),
+            ['campana_id', 'survey_input_id', 'participante_id', 'snapshot_grado_grupo',
+             'fecha_hora_inicio_dispositivo', 'estado_sesion', 'analitica_aporte'],
+            limit=limite, order='id',
+        )
+        if not sesiones:
+            return 0
+
+        # Dimensiones de contexto por aplicación (survey.user_input), según
+        # la asignación vigente en la fecha de la sesión: un cambio posterior
+        # de institución o grado no re-atribuye resultados ya aplicados.
+        vigentes = sesiones.filtered(
+            lambda s: s.estado_sesion == 'completada' and s.survey_input_id
+        )
+        por_fecha = defaultdict(lambda: self.env['luker.application.result'])
+        for sesion in vigentes:
+            fecha = (sesion.fecha_hora_inicio_dispositivo or sesion.create_date).date()
+            por_fecha[fecha] |= sesion
+        sin_asignacion = {'asignacion': self.env['luker.participant.assignment']}
+        contexto = {}
+        for fecha, del_dia in por_fecha.items():
+            en_fecha = del_dia.participante_id._get_contexto_en_fecha(fecha)
+            for sesion in del_dia:
+                asignacion = en_fecha.get(sesion.participante_id.id, sin_asignacion)['asignacion']
+                contexto[sesion.survey_input_id.id] = (
+                    sesion.campana_id.id or False,
+                    asignacion.institucion_id.id or False,
+                    asignacion.unidad_id.nom_grado
+                    or sesion.snapshot_grado_grupo
+                    or False,
+                )
+        por_aplicacion = self._acumular_respuestas(contexto)
+
+        deltas = {}
+        for sesion in sesiones:
+            for *clave, conteo in sesion.analitica_aporte or []:
+                acumulado = deltas.setdefault(tuple(clave), dict.fromkeys(CONTADORES, 0))
+                for campo in CONTADORES:
+                    acumulado[campo] -= conteo.get(campo, 0)
+            aporte = (
+                por_aplicacion.get(sesion.survey_input_id.id, {})
+                if sesion in vigentes else {}
+            )
+            for clave, conteo in aporte.items():
+                acumulado = deltas.setdefault(clave, dict.fromkeys(CONTADORES, 0))
+                for campo in CONTADORES:
+                    acumulado[campo] += conteo[campo]
+            sesion.write({
+                'analitica_procesada': True,
+                'analitica_aporte': [
+                    [*clave, conteo] for clave, conteo in aporte.items()
+                ] or False,
+            })
+
+        self._aplicar_deltas(deltas)
+        _logger.info(
+            'Analítica de respuestas: %s sesiones procesadas (%s combinaciones).',
+            len(sesiones), len(deltas),
+        )
+        return len(sesiones)
+
+    @api.model
+    def _acumular_respuestas(self, contexto):
+        """
+        Lee en bloque las líneas de respuesta de las aplicaciones de
+        ``contexto`` ({user_input_id: (campaña, institución, grado)}) y
+        devuelve, por aplicación, los conteos por clave de dimensiones.
+        """
+        Line = self.env['survey.response.line'].sudo()
+        lineas = Line.search_fetch(
+            [('id_response_header', 'in', list(contexto))],
+            [
+                'id_response_header', 'id_instrument', 'id_question',
+                'id_question_option', 'flg_omitted', 'num_score',
+                'val_text', 'val_json',
+            ],
+        )
+        preguntas = lineas.id_question
+        preguntas.fetch(['question_type', 'survey_id'])
+        opciones_correctas = Line._get_opciones_correctas_por_pregunta(preguntas)
+
+        por_aplicacion = {}
+        for linea in lineas:
+            campana_id, institucion_id, grado = contexto[linea.id_response_header.id]
+            pregunta = linea.id_question
+            clave = (
+                campana_id,
+                (linea.id_instrument or pregunta.survey_id).id,
+                pregunta.id,
+                institucion_id,
+                grado,
+            )
+            deltas = por_aplicacion.setdefault(linea.id_response_header.id, {})
+            conteo = deltas.setdefault(clave, dict.fromkeys(CONTADORES, 0))
+            conteo['total_respuestas'] += 1
+            if linea.flg_omitted:
+                conteo['omitidas'] += 1
+                continue
+            conteo['respondidas'] += 1
+            conteo['suma_puntaje'] += linea.num_score or 0.0
+            if pregunta.question_type in TIPOS_CALIFICABLES:
+                conteo['calificables'] += 1
+                _estado, es_correcta = linea._evaluar_correccion(
+                    opciones_correctas.get(pregunta.id)
+                )
+                if es_correcta:
+                    conteo['correctas'] += 1
+        return por_aplicacion
+
+    @api.model
+    def _aplicar_deltas(self, deltas):
+        """
+        Suma los conteos (positivos o negativos) a las filas existentes, crea
+        las que falten y elimina las que se quedan sin respuestas.
+        """
+        if not deltas:
+            return
+        ahora = fields.Datetime.now()
+        existentes = self.sudo().search_fetch(
+            [
+                ('survey_id', 'in', list({k[1] for k in deltas})),
+                ('question_id', 'in', list({k[2] for k in deltas})),
+            ],
+            ['campana_id', 'survey_id', 'question_id', 'institucion_id', 'grado']
+            + list(CONTADORES),
+        )
+        por_clave = {
+            (r.campana_id.id or False, r.survey_id.id, r.question_id.id,
+             r.institucion_id.id or False, r.grado or False): r
+            for r in existentes
+        }
+
+        nuevos = []
+        vacias = self.browse()
+        for clave, conteo in deltas.items():
+            fila = por_clave.get(clave)
+            if fila:
+                vals = {c: fila[c] + conteo[c] for c in CONTADORES}
+                if vals['total_respuestas'] <= 0:
+                    vacias |= fila
+                    continue
+                vals['fecha_actualizacion'] = ahora
+                fila.write(vals)
+            elif conteo['total_respuestas'] > 0:
+                campana_id, survey_id, question_id, institucion_id, grado = clave
+                nuevos.append(dict(
+                    conteo,
+                    campana_id=campana_id,
+                    survey_id=survey_id,
+                    question_id=question_id,
+                    institucion_id=institucion_id,
+                    grado=grado,
+                    fecha_actualizacion=ahora,
+                ))
+        if nuevos:
+            self.sudo().create(nuevos)
+        if vacias:
+            vacias.sudo().unlink()
+
+    @api.model
+    def action_reconstruir(self):
+        """
+        Vacía la tabla y devuelve todas las sesiones a la cola; el cron las
+        vuelve a incorporar por lotes, cada uno en su propia transacción.
+        """
+        Result = self.env['luker.application.result']
+        Result.flush_model(['analitica_procesada', 'analitica_aporte'])
+        self.env.cr.execute(f'DELETE FROM "{self._table}"')
+        self.env.cr.execute(f"""
+            UPDATE "{Result._table}"
+               SET analitica_procesada = FALSE, analitica_aporte = NULL
+             WHERE analitica_procesada OR analitica_aporte IS NOT NULL
+        """)
+        self.invalidate_model()
+        Result.invalidate_model(['analitica_procesada', 'analitica_aporte'])
+        self.env.ref('operation_engine.cron_refrescar_analitica_respuestas')._trigger()
+        return {'type': 'ir.actions.client', 'tag': 'reload'}
+
+
+class LukerApplicationResultAnalytics(models.Model):
+    _inherit = 'luker.application.result'
+
+    analitica_procesada = fields.Boolean(
+        string='Incluida en analítica', default=False, readonly=True,
+        copy=False, index=True,
+        help='Marca de agua del refresco incremental de la analítica de respuestas.',
+    )
+    analitica_aporte = fields.Json(
+        string='Aporte a la analítica', readonly=True, copy=False,
+        help='Conteos que la sesión sumó a la analítica, por clave de dimensiones; '
+             'se restan si la sesión o sus respuestas cambian.',
+    )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        if any(r.estado_sesion == 'completada' for r in records):
+            self._disparar_refresco_analitica()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        if set(CAMPOS_SESION_ANALITICA) & set(vals):
+            self._marcar_analitica_pendiente()
+        return res
+
+    def unlink(self):
+        # El aporte de las sesiones eliminadas se resta en el momento: ya no
+        # quedará fila que el cron pueda revisar.
+        procesadas = self.filtered('analitica_aporte')
+        if procesadas:
+            deltas = {}
+            for sesion in procesadas:
+                for *clave, conteo in sesion.analitica_aporte:
+                    acumulado = deltas.setdefault(tuple(clave), dict.fromkeys(CONTADORES, 0))
+                    for campo in CONTADORES:
+                        acumulado[campo] -= conteo.get(campo, 0)
+            self.env['luker.operation.response.analytics']._aplicar_deltas(deltas)
+        return super().unlink()
+
+    def _marcar_analitica_pendiente(self):
+        """Devuelve las sesiones a la cola del refresco de la analítica."""
+        procesadas = self.filtered('analitica_procesada')
+        if procesadas:
+            procesadas.sudo().write({'analitica_procesada': False})
+        if procesadas or any(r.estado_sesion == 'completada' for r in self):
+            self._disparar_refresco_analitica()
+
+    @api.model
+    def _marcar_analitica_por_aplicacion(self, user_input_ids):
+        """Sesiones ya procesadas cuyas respuestas (survey.user_input) cambiaron."""
+        if not user_input_ids:
+            return
+        self.sudo().search([
+            ('survey_input_id', 'in', list(set(user_input_ids))),
+            ('analitica_procesada', '=', True),
+        ])._marcar_analitica_pendiente()
+
+    @api.model
+    def _disparar_refresco_analitica(self):
+        """Las sesiones completadas se incorporan en segundo plano."""
+        cron = self.env.ref(
+            'operation_engine.cron_refrescar_analitica_respuestas',
+            raise_if_not_found=False,
+        )
+        if cron:
+            cron._trigger()
+
+
+class SurveyResponseLineAnalytics(models.Model):
+    _inherit = 'survey.response.line'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env['luker.application.result']._marcar_analitica_por_aplicacion(
+            records.id_response_header.ids
+        )
+        return records
+
+    def write(self, vals):
+        if not set(CAMPOS_LINEA_ANALITICA) & set(vals):
+            return super().write(vals)
+        header_ids = self.id_response_header.ids
+        res = super().write(vals)
+        self.env['luker.application.result']._marcar_analitica_por_aplicacion(
+            header_ids + self.id_response_header.ids
+        )
+        return res
+
+    def unlink(self):
+        header_ids = self.id_response_header.ids
+        res = super().unlink()
+        self.env['luker.application.result']._marcar_analitica_por_aplicacion(header_ids)
+        return res
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Orden de visita entre sedes.
+# Funciones puras (sin modelos): las usan la programación de agendas y el
+# plan del día que se envía a la PWA. No hay servicios externos: la distancia
+# es la geodésica (haversine) por un factor de desvío vial, la ruta inicial
+# es la del vecino más cercano y se mejora con 2-opt.
+import math
+
+RADIO_TIERRA_KM = 6371.0
+# Recorrido por vía respecto a la línea recta
+FACTOR_DESVIO = 1.3
+# Pasadas completas máximas de 2-opt
+MAX_PASADAS_2OPT = 50
+
+
+def distancia_km(a, b):
+    """Distancia estimada por vía, en km, entre los puntos (lat, lon) a y b."""
+    lat1, lon1 = map(math.radians, a)
+    lat2, lon2 = map(math.radians, b)
+    h = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * RADIO_TIERRA_KM * math.asin(min(1.0, math.sqrt(h))) * FACTOR_DESVIO
+
+
+def ordenar_recorrido(puntos, inicio=None):
+    """
+    Orden de visita de ``puntos`` ({clave: (lat, lon)}) como camino abierto
+    que arranca en ``inicio`` (o en la primera clave). Devuelve las claves.
+    """
+    claves = list(puntos)
+    if not claves:
+        return []
+    arranque = claves.index(inicio) if inicio in puntos else 0
+    d = [[distancia_km(puntos[a], puntos[b]) for b in claves] for a in claves]
+
+    ruta = [arranque]
+    pendientes = set(range(len(claves))) - {arranque}
+    while pendientes:
+        ultimo = ruta[-1]
+        siguiente = min(pendientes, key=lambda j: (d[ultimo][j], j))
+        ruta.append(siguiente)
+        pendientes.remove(siguiente)
+    return [claves[i] for i in _dos_opt(ruta, d)]
+
+
+def _dos_opt(ruta, d):
+    """Invierte tramos mientras acorten el camino; el punto de arranque no se mueve."""
+    n = len(ruta)
+    for _pasada in range(MAX_PASADAS_2OPT):
+        mejoro = False
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                a, b, c = ruta[i - 1], ruta[i], ruta[j]
+                antes = d[a][b]
+                despues = d[a][c]
+                if j + 1 < n:
+                    e = ruta[j + 1]
+                    antes += d[c][e]
+                    despues += d[b][e]
+                if despues < antes - 1e-9:
+                    ruta[i:j + 1] = ruta[i:j + 1][::-1]
+                    mejoro = True
+        if not mejoro:
+            break
+    return ruta
+
+
+def longitud_recorrido(claves, puntos):
+    """Km del camino que visita ``claves`` en ese orden."""
+    return sum(distancia_km(puntos[a], puntos[b]) for a, b in zip(claves, claves[1:]))
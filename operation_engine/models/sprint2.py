@@ -1,10 +1,22 @@
 # -*- coding: utf-8 -*-
 # Sprint 2 — Logística de campo SISPAR
 # Modelos: equipo logístico, agenda, incidentes, progreso
-from odoo import models, fields, api
+import logging
+from collections import defaultdict
+
+from psycopg2 import Error as PsycopgError, IntegrityError
+
+from odoo import models, fields, api, tools
 from odoo.exceptions import ValidationError
 import uuid as _uuid
 
+_logger = logging.getLogger(__name__)
+
+# Estados de tarea que cuentan como pendientes en el progreso
+ESTADOS_PENDIENTES = ('pendiente', 'programado')
+# Granularidades admitidas en las series de progreso
+GRANULARIDADES_SERIE = ('hour', 'day', 'week', 'month')
+
 
 # ── Equipo Logístico ──────────────────────────────────────────────────────────
 
@@ -242,6 +254,138 @@ class LukerOperationIncident(models.Model):
                 vals['uuid_local'] = str(_uuid.uuid4())
         return super().create(vals_list)
 
+    def init(self):
+        # Respaldo de la deduplicación por uuid_local ante envíos concurrentes
+        try:
+            with self._cr.savepoint():
+                tools.create_unique_index(
+                    self._cr, 'luker_operation_incident_uuid_local_uniq',
+                    self._table, ['uuid_local'])
+        except PsycopgError as exc:
+            _logger.warning(
+                'Sin índice único de uuid_local en novedades (%s); la '
+                'deduplicación queda solo en la aplicación.', exc)
+
+    @api.model
+    def registrar_lote(self, items, executor_id=False):
+        """
+        Registra novedades capturadas offline
+        [{uuid_local, tipo_cod, descripcion, task_id?, campana_id?, timestamp?}]
+        con un solo create. Tipos, tareas, campañas y uuid_local ya
+        registrados se resuelven con una consulta cada uno. Devuelve un
+        resultado por ítem, en el orden recibido.
+        """
+        def valores(campo, tipo=str):
+            return list({i[campo] for i in items if isinstance(i.get(campo), tipo)})
+
+        tipos = {
+            t.cod_tipo: t.id
+            for t in self.env['luker.operation.incident.type'].search_fetch(
+                [('cod_tipo', 'in', valores('tipo_cod'))], ['cod_tipo'])
+        }
+        tareas = {
+            t.id: t.campana_id.id
+            for t in self.env['luker.operation.task'].search_fetch(
+                [('id', 'in', valores('task_id', int))], ['campana_id'])
+        }
+        campanas = set(self.env['luker.operation.campaign'].search(
+            [('id', 'in', valores('campana_id', int))]).ids)
+
+        # Si otro envío registra los mismos uuid entre la consulta y el
+        # create, el índice único lo rechaza y se recalcula una vez.
+        for intento in (1, 2):
+            existentes = {
+                n.uuid_local: n
+                for n in self.search_fetch(
+                    [('uuid_local', 'in', valores('uuid_local'))],
+                    ['uuid_local', 'estado', 'cod_incidente'])
+            }
+            resultados, nuevos, repetidos = self._preparar_lote(
+                items, tipos, tareas, campanas, existentes, executor_id)
+            try:
+                with self.env.cr.savepoint():
+                    creadas = self.with_context(
+                        tracking_disable=True, mail_create_nolog=True,
+                        mail_create_nosubscribe=True,
+                    ).create([vals for _pos, vals in nuevos])
+                break
+            except IntegrityError:
+                if intento == 2:
+                    raise
+                self.invalidate_model()
+
+        for (pos, _vals), novedad in zip(nuevos, creadas):
+            resultados[pos] = {
+                'uuid_local': novedad.uuid_local, 'ok': True, 'id': novedad.id,
+                'estado': novedad.estado, 'codigo': novedad.cod_incidente,
+            }
+        for pos, primera in repetidos.items():
+            resultados[pos] = dict(resultados[primera], duplicado=True)
+        return resultados
+
+    def _preparar_lote(self, items, tipos, tareas, campanas, existentes, executor_id):
+        """
+        Valida los ítems de registrar_lote. Devuelve (resultados con los
+        rechazos y duplicados ya resueltos, [(posición, vals)] a crear,
+        {posición: posición del primer ítem con el mismo uuid}).
+        """
+        resultados = [None] * len(items)
+        nuevos = []
+        repetidos = {}
+        primera_pos = {}
+        for pos, item in enumerate(items):
+            uuid_op = item.get('uuid_local')
+            if not uuid_op or not isinstance(uuid_op, str):
+                resultados[pos] = {'uuid_local': uuid_op, 'ok': False,
+                                   'error': 'UUID_REQUIRED', 'mensaje': 'uuid_local requerido.'}
+                continue
+            existente = existentes.get(uuid_op)
+            if existente:
+                resultados[pos] = {
+                    'uuid_local': uuid_op, 'ok': True, 'id': existente.id,
+                    'estado': existente.estado, 'codigo': existente.cod_incidente,
+                    'duplicado': True,
+                }
+                continue
+            if uuid_op in primera_pos:
+                repetidos[pos] = primera_pos[uuid_op]
+                continue
+
+            task_id = item.get('task_id') if isinstance(item.get('task_id'), int) else None
+            campana_id = item.get('campana_id') if isinstance(item.get('campana_id'), int) else None
+            task_id = task_id if task_id in tareas else False
+            campana_id = tareas[task_id] if task_id else (campana_id in campanas and campana_id)
+            tipo_cod = item.get('tipo_cod') if isinstance(item.get('tipo_cod'), str) else None
+            error = None
+            if tipo_cod not in tipos:
+                error = ('TYPE_NOT_FOUND', 'Tipo de incidente no encontrado.')
+            elif not campana_id:
+                error = ('CAMPAIGN_REQUIRED', 'Se requiere una tarea o campaña válida.')
+            fecha = fields.Datetime.now()
+            if not error and item.get('timestamp'):
+                try:
+                    fecha = fields.Datetime.to_datetime(
+                        str(item['timestamp']).replace('T', ' ')[:19])
+                except ValueError:
+                    error = ('INVALID_VALUE', 'timestamp inválido.')
+            if error:
+                resultados[pos] = {'uuid_local': uuid_op, 'ok': False,
+                                   'error': error[0], 'mensaje': error[1]}
+                continue
+
+            primera_pos[uuid_op] = pos
+            nuevos.append((pos, {
+                'uuid_local':      uuid_op,
+                'tipo_id':         tipos[tipo_cod],
+                'descripcion':     item.get('descripcion') or '',
+                'task_id':         task_id,
+                'campana_id':      campana_id,
+                'executor_id':     executor_id or False,
+                'enviado_offline': True,
+                'fecha_incidente': fecha,
+            }))
+        return resultados, nuevos, repetidos
+
     def action_resolver(self):
         self.write({'estado': 'resuelto'})
 
@@ -263,6 +407,7 @@ class LukerOperationProgress(models.Model):
     )
     fecha_snapshot     = fields.Datetime(
         string='Fecha del snapshot', default=fields.Datetime.now, readonly=True,
+        index=True,
     )
     # Métricas
     total_asignaciones = fields.Integer(string='Total asignaciones')
@@ -270,7 +415,16 @@ class LukerOperationProgress(models.Model):
     pendientes         = fields.Integer(string='Pendientes')
     fallidas           = fields.Integer(string='Fallidas')
     incidentes_abiertos = fields.Integer(string='Incidentes abiertos')
-    pct_avance         = fields.Float(string='Avance %', digits=(5, 1))
+    pct_avance         = fields.Float(string='Avance %', digits=(5, 1), aggregator='avg')
+
+    def init(self):
+        # Series por campaña ordenadas en el tiempo (burndown)
+        tools.create_index(
+            self._cr,
+            'luker_operation_progress_campana_fecha_idx',
+            self._table,
+            ['campana_id', 'fecha_snapshot'],
+        )
 
     @api.model
     def generar_snapshot(self, campana_id):
@@ -278,27 +432,105 @@ class LukerOperationProgress(models.Model):
         campana = self.env['luker.operation.campaign'].browse(campana_id)
         if not campana.exists():
             return
+        return self._generar_snapshots(campana)
+
+    @api.model
+    def _cron_generar_snapshots(self):
+        """Snapshot horario de todas las campañas activas."""
+        campanas = self.env['luker.operation.campaign'].search([('estado', '=', 'activa')])
+        return self._generar_snapshots(campanas)
 
-        Task = self.env['luker.operation.task']
-        Incident = self.env['luker.operation.incident']
-
-        tareas = Task.search([('campana_id', '=', campana_id)])
-        incidentes = Incident.search([
-            ('campana_id', '=', campana_id),
-            ('estado', 'in', ('abierto', 'en_gestion')),
-        ])
-
-        completadas = len(tareas.filtered(lambda t: t.estado == 'completado'))
-        total = len(tareas)
-
-        self.create({
-            'campana_id':          campana_id,
-            'total_asignaciones':  campana.asignacion_count,
-            'completadas':         completadas,
-            'pendientes':          len(tareas.filtered(
-                lambda t: t.estado in ('pendiente', 'programado')
-            )),
-            'fallidas':            len(tareas.filtered(lambda t: t.estado == 'fallido')),
-            'incidentes_abiertos': len(incidentes),
-            'pct_avance':          (completadas / total * 100) if total else 0.0,
-        })
+    @api.model
+    def _generar_snapshots(self, campanas):
+        """
+        Un snapshot por campaña con tres consultas agrupadas (tareas por
+        campaña y estado, asignaciones e incidentes abiertos por campaña) y un
+        solo create.
+        """
+        if not campanas:
+            return self.browse()
+        por_estado = defaultdict(lambda: defaultdict(int))
+        for campana, estado, n in self.env['luker.operation.task']._read_group(
+                [('campana_id', 'in', campanas.ids)], ['campana_id', 'estado'], ['__count']):
+            por_estado[campana.id][estado] = n
+        # Conteo directo: el contador de la campaña puede llevar deltas sin
+        # consolidar, y esa tabla la vacía solo su propio cron.
+        asignaciones = {
+            campana.id: n
+            for campana, n in self.env['luker.operation.assignment']._read_group(
+                [('campana_id', 'in', campanas.ids)], ['campana_id'], ['__count'])
+        }
+        incidentes = {
+            campana.id: n
+            for campana, n in self.env['luker.operation.incident']._read_group(
+                [('campana_id', 'in', campanas.ids), ('estado', 'in', ('abierto', 'en_gestion'))],
+                ['campana_id'], ['__count'])
+        }
+        ahora = fields.Datetime.now()
+        vals_list = []
+        for campana in campanas:
+            estados = por_estado[campana.id]
+            total = sum(estados.values())
+            completadas = estados['completado']
+            vals_list.append({
+                'campana_id':          campana.id,
+                'fecha_snapshot':      ahora,
+                'total_asignaciones':  asignaciones.get(campana.id, 0),
+                'completadas':         completadas,
+                'pendientes':          sum(estados[e] for e in ESTADOS_PENDIENTES),
+                'fallidas':            estados['fallido'],
+                'incidentes_abiertos': incidentes.get(campana.id, 0),
+                'pct_avance':          (completadas / total * 100) if total else 0.0,
+            })
+        return self.create(vals_list)
+
+    @api.model
+    def serie_progreso(self, campana_ids, desde=None, hasta=None, granularidad='day'):
+        """
+        Serie temporal para gráficas de avance: por campaña y periodo, las
+        métricas del último snapshot del periodo (las tareas pueden volver
+        de completadas o fallidas, así que no se toman máximos ni mínimos).
+
+            {campana_id: [{'periodo', 'completadas', 'pendientes',
+                           'fallidas', 'pct_avance'}, ...]}
+        """
+        if granularidad not in GRANULARIDADES_SERIE:
+            raise ValidationError(f'Granularidad no válida: {granularidad}')
+        dominio = [('campana_id', 'in', list(campana_ids))]
+        if desde:
+            dominio.append(('fecha_snapshot', '>=', desde))
+        if hasta:
+            dominio.append(('fecha_snapshot', '<=', hasta))
+        # Los periodos (con la zona horaria del usuario) los arma _read_group;
+        # de cada uno basta la fecha del último snapshot por campaña.
+        periodos = self._read_group(
+            dominio, ['campana_id', f'fecha_snapshot:{granularidad}'],
+            ['fecha_snapshot:max'],
+            order=f'campana_id, fecha_snapshot:{granularidad}')
+        if not periodos:
+            return {}
+
+        # Equivale a DISTINCT ON (campaña, periodo) ... ORDER BY fecha DESC,
+        # id DESC: una lectura por (campaña, fecha) sobre el índice
+        ultimos = {}
+        for snap in self.search_fetch(
+                [('campana_id', 'in', list({c.id for c, _p, _f in periodos})),
+                 ('fecha_snapshot', 'in', list({f for _c, _p, f in periodos}))],
+                ['campana_id', 'fecha_snapshot', 'completadas', 'pendientes',
+                 'fallidas', 'pct_avance'],
+                order='id'):
+            ultimos[snap.campana_id.id, snap.fecha_snapshot] = snap
+
+        serie = defaultdict(list)
+        for campana, periodo, fecha in periodos:
+            snap = ultimos.get((campana.id, fecha))
+            if not snap:
+                continue
+            serie[campana.id].append({
+                'periodo':     periodo,
+                'completadas': snap.completadas,
+                'pendientes':  snap.pendientes,
+                'fallidas':    snap.fallidas,
+                'pct_avance':  snap.pct_avance,
+            })
+        return dict(serie)
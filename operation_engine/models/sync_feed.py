@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+# Feed de cambios por aplicador — sincronización delta de la PWA.
+#
+# El dispositivo pide los cambios posteriores a su token y recibe, paginados,
+# las tareas, novedades e ítems de agenda que le corresponden, en orden
+# (write_date, id) dentro de cada fuente. Lo que deja de corresponderle
+# llega como baja: tareas canceladas, ítems cancelados o de agendas
+# canceladas y, desde luker.operation.sync.tombstone, lo eliminado y lo
+# reasignado a otro aplicador (que ya no se ve desde la tabla de origen).
+#
+# El token es opaco para el dispositivo: guarda un cursor (fecha, id) por
+# fuente. write_date es el inicio de la transacción que escribe, así que una
+# transacción larga puede confirmar filas con fecha anterior a un cursor ya
+# entregado; por eso, al retomar una sincronización terminada, los cursores
+# retroceden SOLAPE_CURSOR y el dispositivo aplica los cambios de forma
+# idempotente.
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+
+from odoo import models, fields, api, tools
+from odoo.exceptions import ValidationError
+
+VERSION_TOKEN = 1
+# Retroceso de los cursores al retomar una sincronización terminada
+SOLAPE_CURSOR = timedelta(minutes=10)
+# Tareas y novedades cerradas que recibe un dispositivo en su primera sincronización
+VENTANA_HISTORIAL = timedelta(days=30)
+# Días que se conservan las bajas; un token más viejo obliga a resincronizar
+RETENCION_BAJAS_DIAS = 90
+MAX_LIMITE_CAMBIOS = 1000
+
+# Fuentes del feed en orden de desempate: una baja va antes que un alta
+# de la misma transacción
+FUENTES = ('baja', 'tarea', 'novedad', 'agenda_item')
+FUENTES_BAJA = [
+    ('tarea',       'Tarea'),
+    ('novedad',     'Novedad'),
+    ('agenda_item', 'Ítem de agenda'),
+]
+
+
+class LukerOperationSyncTombstone(models.Model):
+    _name        = 'luker.operation.sync.tombstone'
+    _description = 'Baja para la sincronización de dispositivos'
+    _order       = 'create_date desc, id desc'
+    _rec_name    = 'fuente'
+
+    fuente = fields.Selection(FUENTES_BAJA, string='Fuente', required=True, readonly=True)
+    res_id = fields.Integer(string='ID del registro', required=True, readonly=True)
+    executor_id = fields.Many2one(
+        'luker.operation.executor', string='Aplicador',
+        required=True, readonly=True, ondelete='cascade',
+    )
+    motivo = fields.Selection([
+        ('eliminado',  'Eliminado'),
+        ('reasignado', 'Reasignado a otro aplicador'),
+    ], string='Motivo', required=True, readonly=True)
+
+    def init(self):
+        tools.create_index(
+            self._cr,
+            'luker_operation_sync_tombstone_feed_idx',
+            self._table,
+            ['executor_id', 'create_date', 'id'],
+        )
+
+    @api.model
+    def _registrar(self, fuente, pares, motivo):
+        """Registra las bajas [(id del registro, aplicador que lo tenía)] de ``fuente``."""
+        vals_list = [
+            {'fuente': fuente, 'res_id': res_id, 'executor_id': ejecutor_id, 'motivo': motivo}
+            for res_id, ejecutor_id in pares if ejecutor_id
+        ]
+        if vals_list:
+            self.sudo().create(vals_list)
+
+    @api.model
+    def _cron_purgar(self):
+        """Elimina las bajas más viejas que la retención."""
+        self.env.cr.execute(
+            f'DELETE FROM "{self._table}" WHERE create_date < %s',
+            [self.env.cr.now() - timedelta(days=RETENCION_BAJAS_DIAS)],
+        )
+
+
+class LukerOperationExecutorSync(models.Model):
+    _inherit = 'luker.operation.executor'
+
+    def leer_cambios(self, token=None, limite=500):
+        """
+        Página de cambios del aplicador desde ``token`` (sin token, la
+        sincronización inicial). Devuelve
+        {'cambios': [(fuente, id, baja)], 'token', 'hay_mas'}, o
+        {'reiniciar': True} si el token es anterior a la retención de bajas.
+        """
+        self.ensure_one()
+        limite = max(1, min(int(limite), MAX_LIMITE_CAMBIOS))
+        ahora = self.env.cr.now()
+        if token:
+            estado = self._decodificar_token(token)
+        else:
+            estado = {'c': {'baja': [ahora, 0]}, 'i': ahora, 'f': False}
+        cursores = dict(estado['c'])
+        if estado['f']:
+            # Sincronización terminada: se retoma con solape
+            cursores = {f: [c[0] - SOLAPE_CURSOR, 0] for f, c in cursores.items()}
+        baja = cursores.get('baja')
+        if not estado['i'] and (not baja or baja[0] < ahora - timedelta(days=RETENCION_BAJAS_DIAS)):
+            return {'reiniciar': True}
+
+        for model in ('luker.operation.task', 'luker.operation.incident',
+                      'luker.operation.agenda.item', 'luker.operation.agenda',
+                      'luker.operation.sync.tombstone'):
+            self.env[model].flush_model()
+        filas = []
+        for orden, fuente in enumerate(FUENTES):
+            for fecha, cursor_id, tipo, res_id, es_baja in self._consultar_fuente(
+                    fuente, cursores.get(fuente), estado['i'], ahora, limite + 1):
+                filas.append((fecha, orden, cursor_id, fuente, tipo, res_id, es_baja))
+        filas.sort(key=lambda f: f[:3])
+        pagina = filas[:limite]
+        for fecha, _orden, cursor_id, fuente, _t, _r, _b in pagina:
+            cursores[fuente] = [fecha, cursor_id]
+
+        hay_mas = len(filas) > len(pagina)
+        if not hay_mas:
+            # Todo lo confirmado hasta ahora quedó leído en todas las fuentes
+            for fuente in FUENTES:
+                cursores[fuente] = max(cursores.get(fuente) or [ahora, 0], [ahora, 0])
+        nuevo = {
+            'c': cursores,
+            'i': estado['i'] if hay_mas else None,
+            'f': not hay_mas,
+        }
+        return {
+            'cambios': [(tipo, res_id, es_baja) for *_x, tipo, res_id, es_baja in pagina],
+            'token':   self._codificar_token(nuevo),
+            'hay_mas': hay_mas,
+        }
+
+    def _consultar_fuente(self, fuente, cursor, inicio, ahora, limite):
+        """
+        Filas [(fecha, id del cursor, fuente del registro, id, baja)] de
+        ``fuente`` posteriores a ``cursor``. Durante la sincronización
+        inicial (``inicio``), lo escrito antes de empezar se limita a lo
+        vigente y al historial reciente.
+        """
+        params = {'ejecutor': self.id, 'limite': limite, 'inicio': inicio,
+                  'historial': ahora - VENTANA_HISTORIAL}
+        condiciones = []
+        if cursor:
+            params['fecha'], params['id'] = cursor
+
+        if fuente == 'baja':
+            fecha, tabla = 'r.create_date', 'luker_operation_sync_tombstone r'
+            columnas = 'r.fuente, r.res_id, true'
+            condiciones.append('r.executor_id = %(ejecutor)s')
+        elif fuente == 'tarea':
+            fecha, tabla = 'r.write_date', 'luker_operation_task r'
+            columnas = "'tarea', r.id, r.estado = 'cancelado'"
+            condiciones.append('r.executor_id = %(ejecutor)s')
+            if inicio:
+                condiciones.append(
+                    "(r.write_date >= %(inicio)s OR (r.estado != 'cancelado' AND ("
+                    "r.estado NOT IN ('completado', 'fallido') OR r.write_date >= %(historial)s)))")
+        elif fuente == 'novedad':
+            fecha, tabla = 'r.write_date', 'luker_operation_incident r'
+            columnas = "'novedad', r.id, false"
+            condiciones.append('r.executor_id = %(ejecutor)s')
+            if inicio:
+                condiciones.append(
+                    "(r.estado IN ('abierto', 'en_gestion') OR r.write_date >= %(historial)s)")
+        else:
+            # El ítem cambia también cuando cambia su agenda (fecha, estado)
+            fecha = 'GREATEST(r.write_date, g.write_date)'
+            tabla = ('luker_operation_agenda_item r '
+                     'JOIN luker_operation_agenda g ON g.id = r.agenda_id')
+            columnas = "'agenda_item', r.id, (r.estado = 'cancelado' OR g.estado = 'cancelada')"
+            condiciones.append('r.executor_id = %(ejecutor)s')
+            if inicio:
+                condiciones.append(
+                    f"({fecha} >= %(inicio)s OR (r.estado != 'cancelado' "
+                    "AND g.estado != 'cancelada' AND g.fecha >= %(historial)s::date))")
+        if cursor:
+            condiciones.append(f'({fecha}, r.id) > (%(fecha)s, %(id)s)')
+
+        self.env.cr.execute(
+            f'''
+            SELECT {fecha} AS fecha, r.id, {columnas}
+              FROM {tabla}
+             WHERE {' AND '.join(condiciones)}
+             ORDER BY 1, 2
+             LIMIT %(limite)s
+            ''',
+            params,
+        )
+        return self.env.cr.fetchall()
+
+    @api.model
+    def _codificar_token(self, estado):
+        datos = {
+            'v': VERSION_TOKEN,
+            'c': {f: [fecha.isoformat(), cid] for f, (fecha, cid) in estado['c'].items()},
+            'i': estado['i'].isoformat() if estado['i'] else None,
+            'f': estado['f'],
+        }
+        return base64.urlsafe_b64encode(json.dumps(datos, separators=(',', ':')).encode()).decode()
+
+    @api.model
+    def _decodificar_token(self, token):
+        try:
+            datos = json.loads(base64.urlsafe_b64decode(token.encode()))
+            if datos.get('v') != VERSION_TOKEN:
+                raise ValueError('versión')
+            return {
+                'c': {
+                    f: [datetime.fromisoformat(fecha), int(cid)]
+                    for f, (fecha, cid) in datos['c'].items() if f in FUENTES
+                },
+                'i': datetime.fromisoformat(datos['i']) if datos.get('i') else None,
+                'f': bool(datos.get('f')),
+            }
+        except (ValueError, TypeError, KeyError, AttributeError, binascii.Error) as exc:
+            raise ValidationError('Token de sincronización inválido.') from exc
+
+
+# ── Bajas: lo que sale del alcance de un aplicador ────────────────────────────
+
+class LukerOperationTaskSync(models.Model):
+    _inherit = 'luker.operation.task'
+
+    def init(self):
+        super().init()
+        tools.create_index(
+            self._cr, 'luker_operation_task_feed_idx', self._table,
+            ['executor_id', 'write_date', 'id'])
+
+    def write(self, vals):
+        if 'executor_id' not in vals:
+            return super().write(vals)
+        previos = {t.id: t.executor_id.id for t in self}
+        res = super().write(vals)
+        salen = [(tid, eid) for tid, eid in previos.items() if eid and eid != vals['executor_id']]
+        if salen:
+            self._registrar_bajas(salen, 'reasignado')
+            # El aplicador del ítem es un related almacenado: su recómputo no
+            # toca write_date y el nuevo aplicador no vería el cambio
+            Item = self.env['luker.operation.agenda.item']
+            Item.flush_model(['task_id', 'executor_id'])
+            self.env.cr.execute(
+                f'UPDATE "{Item._table}" SET write_date = %s WHERE task_id = ANY(%s)',
+                [self.env.cr.now(), [tid for tid, _e in salen]],
+            )
+            Item.invalidate_model(['write_date'])
+        return res
+
+    def unlink(self):
+        self._registrar_bajas([(t.id, t.executor_id.id) for t in self], 'eliminado')
+        return super().unlink()
+
+    def _registrar_bajas(self, pares, motivo):
+        """Bajas de las tareas [(tarea, aplicador anterior)] y de sus ítems de agenda."""
+        Tombstone = self.env['luker.operation.sync.tombstone']
+        Tombstone._registrar('tarea', pares, motivo)
+        anterior = dict(pares)
+        items = self.env['luker.operation.agenda.item'].search_fetch(
+            [('task_id', 'in', list(anterior))], ['task_id'])
+        Tombstone._registrar(
+            'agenda_item', [(i.id, anterior[i.task_id.id]) for i in items], motivo)
+
+
+class LukerOperationIncidentSync(models.Model):
+    _inherit = 'luker.operation.incident'
+
+    def init(self):
+        super().init()
+        tools.create_index(
+            self._cr, 'luker_operation_incident_feed_idx', self._table,
+            ['executor_id', 'write_date', 'id'])
+
+    def write(self, vals):
+        if 'executor_id' not in vals:
+            return super().write(vals)
+        previos = {n.id: n.executor_id.id for n in self}
+        res = super().write(vals)
+        self.env['luker.operation.sync.tombstone']._registrar(
+            'novedad',
+            [(nid, eid) for nid, eid in previos.items() if eid and eid != vals['executor_id']],
+            'reasignado')
+        return res
+
+    def unlink(self):
+        self.env['luker.operation.sync.tombstone']._registrar(
+            'novedad', [(n.id, n.executor_id.id) for n in self], 'eliminado')
+        return super().unlink()
+
+
+class LukerOperationAgendaItemSync(models.Model):
+    _inherit = 'luker.operation.agenda.item'
+
+    def init(self):
+        super().init()
+        tools.create_index(
+            self._cr, 'luker_operation_agenda_item_executor_idx', self._table, ['executor_id'])
+
+    def unlink(self):
+        self.env['luker.operation.sync.tombstone']._registrar(
+            'agenda_item', [(i.id, i.executor_id.id) for i in self], 'eliminado')
+        return super().unlink()
+
+
+class LukerOperationAgendaSync(models.Model):
+    _inherit = 'luker.operation.agenda'
+
+    def unlink(self):
+        # Los ítems se borran en cascada en la base, sin pasar por su unlink()
+        self.env['luker.operation.sync.tombstone']._registrar(
+            'agenda_item', [(i.id, i.executor_id.id) for i in self.item_ids], 'eliminado')
+        return super().unlink()
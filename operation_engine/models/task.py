@@ -2,9 +2,16 @@
 # OPE_Tarea — Tarea ejecutable SISPAR
 # Unidad mínima de trabajo: un aplicador aplica un instrumento a un participante.
 import uuid as _uuid
+from collections import Counter, defaultdict
+
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
 
+from .campaign import CONTADOR_POR_ESTADO, _registrar_deltas_contador
+
+# Campos que cambian a qué contadores aporta una tarea
+CAMPOS_CONTADOR = ('campana_id', 'executor_id', 'estado')
+
 
 ESTADOS_TAREA = [
     ('pendiente',    'Pendiente'),
@@ -16,6 +23,19 @@ ESTADOS_TAREA = [
     ('cancelado',    'Cancelado'),
 ]
 
+# Estados de origen desde los que se puede pasar a cada estado
+TRANSICIONES = {
+    'pendiente':    ('programado', 'reprogramado'),
+    'programado':   ('pendiente', 'reprogramado'),
+    'en_progreso':  ('pendiente', 'programado', 'reprogramado'),
+    'completado':   ('en_progreso',),
+    'fallido':      ('pendiente', 'programado', 'en_progreso', 'reprogramado'),
+    'reprogramado': ('pendiente', 'programado', 'en_progreso', 'fallido', 'reprogramado'),
+    'cancelado':    ('pendiente', 'programado', 'en_progreso', 'fallido', 'reprogramado'),
+}
+# Campos que pueden acompañar una transición por lote
+CAMPOS_TRANSICION = ('fecha_programada',)
+
 
 class LukerOperationTask(models.Model):
     _name        = 'luker.operation.task'
@@ -139,35 +159,141 @@ class LukerOperationTask(models.Model):
                 ) or 'TAR-0001'
             if not vals.get('uuid_local'):
                 vals['uuid_local'] = str(_uuid.uuid4())
-        return super().create(vals_list)
+        records = super().create(vals_list)
+        records._ajustar_contadores(+1)
+        return records
+
+    def write(self, vals):
+        if not any(f in vals for f in CAMPOS_CONTADOR):
+            return super().write(vals)
+        self._ajustar_contadores(-1)
+        res = super().write(vals)
+        self._ajustar_contadores(+1)
+        return res
+
+    def unlink(self):
+        self._ajustar_contadores(-1)
+        return super().unlink()
+
+    def _ajustar_contadores(self, signo):
+        """Anota las tareas de self (signo +1/-1) en los contadores de campaña y aplicador."""
+        por_campana = defaultdict(lambda: defaultdict(int))
+        por_ejecutor = defaultdict(lambda: defaultdict(int))
+        for t in self:
+            campo = CONTADOR_POR_ESTADO.get(t.estado)
+            for destino in (por_campana[t.campana_id.id], por_ejecutor[t.executor_id.id]):
+                destino['tarea_count'] += signo
+                if campo:
+                    destino[campo] += signo
+        _registrar_deltas_contador(self.env, 'luker.operation.campaign', por_campana)
+        _registrar_deltas_contador(self.env, 'luker.operation.executor', por_ejecutor)
 
     # ── Transiciones de estado ────────────────────────────────────────────────
     def action_iniciar(self):
-        for t in self:
-            if t.estado not in ('pendiente', 'programado', 'reprogramado'):
-                raise ValidationError('Solo se pueden iniciar tareas pendientes o programadas.')
-            t.write({
-                'estado': 'en_progreso',
-                'fecha_inicio_real': fields.Datetime.now(),
-            })
+        self.transicion_masiva('en_progreso')
 
     def action_completar(self):
-        for t in self:
-            if t.estado != 'en_progreso':
-                raise ValidationError('Solo se pueden completar tareas en progreso.')
-            t.write({
-                'estado': 'completado',
-                'fecha_fin_real': fields.Datetime.now(),
-            })
+        self.transicion_masiva('completado')
 
     def action_reprogramar(self):
-        self.write({'estado': 'reprogramado'})
+        self.transicion_masiva('reprogramado')
 
     def action_cancelar(self):
-        self.write({'estado': 'cancelado'})
+        self.transicion_masiva('cancelado')
 
     def action_marcar_fallido(self):
-        self.write({
-            'estado': 'fallido',
-            'fecha_fin_real': fields.Datetime.now(),
-        })
+        self.transicion_masiva('fallido')
+
+    def transicion_masiva(self, estado, vals=None, motivo=None):
+        """
+        Lleva todas las tareas de self a ``estado`` con un solo write. Con
+        más de una tarea no se rastrea cada cambio: queda un mensaje
+        resumen por campaña. Falla completa si alguna tarea no admite la
+        transición.
+        """
+        etiquetas = dict(ESTADOS_TAREA)
+        if estado not in TRANSICIONES:
+            raise ValidationError(f'Estado de tarea desconocido: {estado}.')
+        invalidas = self.filtered(lambda t: t.estado not in TRANSICIONES[estado])
+        if invalidas:
+            raise ValidationError(
+                f'{len(invalidas)} tareas no pueden pasar a {etiquetas[estado]}: '
+                f'{", ".join(invalidas[:10].mapped("cod_tarea"))}.')
+        vals = dict(vals or {}, estado=estado)
+        if estado == 'en_progreso':
+            vals.setdefault('fecha_inicio_real', fields.Datetime.now())
+        elif estado in ('completado', 'fallido'):
+            vals.setdefault('fecha_fin_real', fields.Datetime.now())
+        if len(self) <= 1:
+            return self.write(vals)
+
+        previos = defaultdict(Counter)
+        for t in self:
+            previos[t.campana_id][t.estado] += 1
+        res = self.with_context(tracking_disable=True).write(vals)
+        for campana, conteo in previos.items():
+            origen = ', '.join(f'{etiquetas[e]}: {n}' for e, n in sorted(conteo.items()))
+            partes = [f'{sum(conteo.values())} tareas pasaron a {etiquetas[estado]} ({origen}).']
+            if vals.get('fecha_programada'):
+                partes.append(f'Nueva fecha programada: {vals["fecha_programada"]}.')
+            if motivo:
+                partes.append(f'Motivo: {motivo}.')
+            campana.message_post(body=' '.join(partes), subtype_xmlid='mail.mt_note')
+        return res
+
+    @api.model
+    def aplicar_transiciones_lote(self, cambios, motivo=None, vals_comunes=None,
+                                  executor_id=None):
+        """
+        Aplica [{'id', 'estado', <CAMPOS_TRANSICION>}] agrupando por estado
+        destino y valores: un write y un resumen por grupo. Los cambios que
+        no proceden se informan sin detener el resto; repetir el estado
+        actual es un no-op, para que los reintentos offline sean seguros.
+        Con ``executor_id`` solo se consideran las tareas de ese aplicador;
+        las demás se informan como no encontradas.
+        Devuelve [{'id', 'ok', 'codigo'?, 'mensaje'?}] en el orden recibido.
+        """
+        ids = {c.get('id') for c in cambios if isinstance(c.get('id'), int)}
+        dominio = [('id', 'in', list(ids))]
+        if executor_id is not None:
+            dominio.append(('executor_id', '=', executor_id))
+        tareas = {t.id: t for t in self.search(dominio)}
+        grupos = defaultdict(list)
+        vistos = set()
+        resultados = []
+        for cambio in cambios:
+            tid, estado = cambio.get('id'), cambio.get('estado')
+            tarea = tareas.get(tid)
+            extra = {c: cambio[c] for c in CAMPOS_TRANSICION if cambio.get(c)}
+            if extra.get('fecha_programada'):
+                try:
+                    extra['fecha_programada'] = fields.Datetime.to_datetime(
+                        str(extra['fecha_programada']).replace('T', ' ')[:19])
+                except ValueError:
+                    resultados.append({'id': tid, 'ok': False, 'codigo': 'INVALID_VALUE',
+                                       'mensaje': 'fecha_programada inválida.'})
+                    continue
+            if not tarea:
+                error = ('NOT_FOUND', 'Tarea no encontrada.')
+            elif tid in vistos:
+                error = ('DUPLICATED', 'La tarea aparece más de una vez en el lote.')
+            elif estado not in TRANSICIONES:
+                error = ('INVALID_STATE', f'Estado inválido. Válidos: {tuple(TRANSICIONES)}')
+            elif tarea.estado == estado and not extra:
+                vistos.add(tid)
+                resultados.append({'id': tid, 'ok': True, 'sin_cambio': True})
+                continue
+            elif tarea.estado not in TRANSICIONES[estado]:
+                error = ('INVALID_TRANSITION',
+                         f'No se puede pasar de {tarea.estado} a {estado}.')
+            else:
+                vistos.add(tid)
+                grupos[(estado, tuple(sorted(extra.items())))].append(tid)
+                resultados.append({'id': tid, 'ok': True})
+                continue
+            resultados.append({'id': tid, 'ok': False, 'codigo': error[0], 'mensaje': error[1]})
+
+        for (estado, extra), tarea_ids in grupos.items():
+            self.browse(tarea_ids).transicion_masiva(
+                estado, dict(extra, **(vals_comunes or {})), motivo=motivo)
+        return resultados
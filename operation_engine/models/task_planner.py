@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+# Planificación de tareas — genera las tareas de una campaña y las reparte
+# entre los aplicadores.
+#
+# Cada asignación sin tarea recibe una, con aplicador y día. Un aplicador es
+# elegible para una institución si está activo, la tiene en institucion_ids
+# y, cuando la campaña tiene equipos logísticos, es miembro activo de alguno
+# (dentro de sus fechas de membresía). Cada aplicador tiene un cupo diario;
+# las tareas ya programadas en el periodo descuentan del cupo.
+#
+# Heurística: las instituciones con menos aplicadores elegibles se reparten
+# primero; dentro de cada una, las tareas van en bloques de un día al
+# aplicador elegible con menor ocupación relativa (montículo), de modo que
+# cada aplicador visita pocas instituciones y la carga queda pareja.
+# O(N log E) para N tareas y E aplicadores.
+import heapq
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, time as dtime, timedelta
+
+import pytz
+
+from odoo import models, fields
+from odoo.exceptions import ValidationError
+
+_logger = logging.getLogger(__name__)
+
+# Hora local a la que se programan las tareas de cada día
+HORA_INICIO_JORNADA = 8
+# Tareas por create() en la generación masiva
+LOTE_TAREAS = 2000
+# Estados de tarea que no ocupan cupo
+ESTADOS_SIN_CUPO = ('completado', 'fallido', 'cancelado')
+
+
+class LukerOperationCampaignPlanner(models.Model):
+    _inherit = 'luker.operation.campaign'
+
+    capacidad_diaria_ejecutor = fields.Integer(
+        string='Tareas por aplicador al día', default=20,
+        help='Cupo diario de cada aplicador al generar tareas. Si el equipo '
+             'logístico tiene capacidad, el cupo no supera la parte que le '
+             'corresponde a cada miembro.')
+    incluir_sabados = fields.Boolean(
+        string='Programar sábados', default=False)
+
+    # ── Acción ────────────────────────────────────────────────────────────────
+    def action_generar_tareas(self):
+        self.ensure_one()
+        if self.capacidad_diaria_ejecutor <= 0:
+            raise ValidationError('Define el cupo diario de tareas por aplicador.')
+        resultado = self._generar_tareas()
+        partes = [f'Se crearon {resultado["creadas"]} tareas ({resultado["segundos"]} s).']
+        if resultado['sin_ejecutor']:
+            partes.append(f'{resultado["sin_ejecutor"]} asignaciones sin aplicador que '
+                          f'cubra su institución.')
+        if resultado['sin_cupo']:
+            partes.append(f'{resultado["sin_cupo"]} asignaciones sin cupo en el periodo.')
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Generación de tareas',
+                'message': ' '.join(partes),
+                'type': 'warning' if resultado['sin_ejecutor'] or resultado['sin_cupo'] else 'success',
+                'next': {'type': 'ir.actions.client', 'tag': 'reload'},
+            }
+        }
+
+    # ── Motor ────────────────────────────────────────────────────────────────
+    def _generar_tareas(self):
+        """
+        Crea las tareas de las asignaciones que aún no tienen una.
+        Devuelve {'creadas', 'sin_ejecutor', 'sin_cupo', 'segundos'}.
+        """
+        self.ensure_one()
+        inicio = time.monotonic()
+        dias = self._dias_planificables()
+        pendientes = self._asignaciones_sin_tarea()
+        por_institucion = defaultdict(list)
+        for asignacion_id, participante_id, institucion_id in pendientes:
+            por_institucion[institucion_id].append((asignacion_id, participante_id))
+
+        cupos = self._cupos_ejecutores(dias)
+        elegibles = self._ejecutores_por_institucion(list(cupos))
+
+        plan = []          # (asignacion_id, participante_id, ejecutor_id, día)
+        sin_ejecutor = sin_cupo = 0
+        carga = defaultdict(int)
+        capacidad_total = {eid: sum(dia_cupo.values()) for eid, dia_cupo in cupos.items()}
+        orden = sorted(por_institucion, key=lambda inst: (len(elegibles.get(inst, ())), inst or 0))
+        for institucion_id in orden:
+            tareas = por_institucion[institucion_id]
+            candidatos = [eid for eid in elegibles.get(institucion_id, ()) if capacidad_total[eid]]
+            if not candidatos:
+                sin_ejecutor += len(tareas)
+                continue
+            monticulo = [(carga[eid] / capacidad_total[eid], eid) for eid in candidatos]
+            heapq.heapify(monticulo)
+            pos = 0
+            while pos < len(tareas) and monticulo:
+                _ocupacion, eid = heapq.heappop(monticulo)
+                dia = next((d for d in dias if cupos[eid].get(d)), None)
+                if dia is None:
+                    continue
+                cantidad = min(cupos[eid][dia], len(tareas) - pos)
+                for asignacion_id, participante_id in tareas[pos:pos + cantidad]:
+                    plan.append((asignacion_id, participante_id, eid, dia))
+                pos += cantidad
+                cupos[eid][dia] -= cantidad
+                carga[eid] += cantidad
+                if any(cupos[eid].values()):
+                    heapq.heappush(monticulo, (carga[eid] / capacidad_total[eid], eid))
+            sin_cupo += len(tareas) - pos
+
+        creadas = self._crear_tareas_planificadas(plan)
+        resultado = {
+            'creadas':      creadas,
+            'sin_ejecutor': sin_ejecutor,
+            'sin_cupo':     sin_cupo,
+            'segundos':     round(time.monotonic() - inicio, 2),
+        }
+        _logger.info('Generación de tareas campaña %s: %s', self.id, resultado)
+        return resultado
+
+    def _dias_planificables(self):
+        """Días hábiles desde hoy (o el inicio) hasta el fin de la campaña."""
+        desde = max(self.fecha_inicio, fields.Date.context_today(self))
+        ultimo_dia_semana = 5 if self.incluir_sabados else 4
+        dias = []
+        dia = desde
+        while dia <= self.fecha_fin:
+            if dia.weekday() <= ultimo_dia_semana:
+                dias.append(dia)
+            dia += timedelta(days=1)
+        if not dias:
+            raise ValidationError('La campaña no tiene días disponibles para programar tareas.')
+        return dias
+
+    def _asignaciones_sin_tarea(self):
+        """[(asignación, participante, institución)] sin tarea activa, por anti-join."""
+        Assignment = self.env['luker.operation.assignment']
+        Task = self.env['luker.operation.task']
+        Assignment.flush_model(['campana_id', 'participante_id', 'institucion_id', 'estado'])
+        Task.flush_model(['asignacion_id', 'estado'])
+        self.env.cr.execute(
+            f'''
+            SELECT a.id, a.participante_id, a.institucion_id
+              FROM "{Assignment._table}" a
+             WHERE a.campana_id = %(campana)s
+               AND a.estado NOT IN ('completado', 'cancelado', 'no_aplico')
+               AND NOT EXISTS (
+                   SELECT 1 FROM "{Task._table}" t
+                    WHERE t.asignacion_id = a.id AND t.estado != 'cancelado')
+             ORDER BY a.institucion_id, a.id
+            ''',
+            {'campana': self.id},
+        )
+        return self.env.cr.fetchall()
+
+    def _miembros_por_ejecutor(self):
+        """{ejecutor: [(equipo, desde, hasta)]} de los equipos activos de la campaña."""
+        miembros = defaultdict(list)
+        for m in self.env['luker.operation.team.member'].search_fetch(
+                [('team_id.campana_id', '=', self.id), ('team_id.activo', '=', True),
+                 ('activo', '=', True)],
+                ['team_id', 'executor_id', 'fecha_inicio', 'fecha_fin']):
+            miembros[m.executor_id.id].append((m.team_id, m.fecha_inicio, m.fecha_fin))
+        return miembros
+
+    def _cupos_ejecutores(self, dias):
+        """{ejecutor: {día: cupo libre}} de los aplicadores que pueden recibir tareas."""
+        Executor = self.env['luker.operation.executor']
+        Task = self.env['luker.operation.task']
+        miembros = self._miembros_por_ejecutor()
+        con_equipos = bool(self.env['luker.operation.logistic.team'].search_count(
+            [('campana_id', '=', self.id), ('activo', '=', True)]))
+        if con_equipos:
+            ejecutores = Executor.browse(list(miembros)).filtered('activo')
+        else:
+            ejecutores = Executor.search([('activo', '=', True)])
+
+        # Parte de la capacidad del equipo que corresponde a cada miembro
+        tope_equipo = {}
+        for eid, membresias in miembros.items():
+            partes = [
+                max(equipo.capacidad // max(equipo.member_count, 1), 1)
+                for equipo, _desde, _hasta in membresias if equipo.capacidad
+            ]
+            if partes:
+                tope_equipo[eid] = max(partes)
+
+        # Tareas ya programadas en el periodo ocupan cupo
+        desde_utc, _h = self._rango_utc(dias[0])
+        _d, hasta_utc = self._rango_utc(dias[-1])
+        ocupado = defaultdict(int)
+        for ejecutor, dia, cantidad in Task._read_group(
+                [('executor_id', 'in', ejecutores.ids),
+                 ('fecha_programada', '>=', desde_utc),
+                 ('fecha_programada', '<', hasta_utc),
+                 ('estado', 'not in', ESTADOS_SIN_CUPO)],
+                ['executor_id', 'fecha_programada:day'], ['__count']):
+            ocupado[(ejecutor.id, fields.Date.to_date(dia))] += cantidad
+
+        cupos = {}
+        for ejecutor in ejecutores:
+            cupo_dia = min(self.capacidad_diaria_ejecutor,
+                           tope_equipo.get(ejecutor.id, self.capacidad_diaria_ejecutor))
+            membresias = miembros.get(ejecutor.id)
+            cupos[ejecutor.id] = {
+                dia: max(cupo_dia - ocupado[(ejecutor.id, dia)], 0)
+                for dia in dias
+                if not con_equipos or any(
+                    (not desde or desde <= dia) and (not hasta or dia <= hasta)
+                    for _equipo, desde, hasta in membresias)
+            }
+        return cupos
+
+    def _ejecutores_por_institucion(self, ejecutor_ids):
+        """{institución: [ejecutores]} según la cobertura de cada aplicador."""
+        if not ejecutor_ids:
+            return {}
+        self.env.cr.execute(
+            '''
+            SELECT organizacion_id, array_agg(executor_id ORDER BY executor_id)
+              FROM luker_executor_organizacion_rel
+             WHERE executor_id = ANY(%s)
+             GROUP BY organizacion_id
+            ''',
+            [ejecutor_ids],
+        )
+        return dict(self.env.cr.fetchall())
+
+    def _rango_utc(self, dia):
+        """(inicio, fin) en UTC sin zona del día local ``dia``."""
+        tz = pytz.timezone(self.env.user.tz or 'America/Bogota')
+        inicio = tz.localize(datetime.combine(dia, dtime.min)).astimezone(pytz.utc)
+        fin = tz.localize(datetime.combine(dia + timedelta(days=1), dtime.min)).astimezone(pytz.utc)
+        return inicio.replace(tzinfo=None), fin.replace(tzinfo=None)
+
+    def _crear_tareas_planificadas(self, plan):
+        """Crea las tareas del plan por lotes y marca las asignaciones."""
+        if not plan:
+            return 0
+        Task = self.env['luker.operation.task'].with_context(
+            tracking_disable=True, mail_create_nolog=True, mail_create_nosubscribe=True)
+        Assignment = self.env['luker.operation.assignment']
+        inicio_jornada = {}
+        for _a, _p, _e, dia in plan:
+            if dia not in inicio_jornada:
+                inicio_jornada[dia] = self._rango_utc(dia)[0] + timedelta(hours=HORA_INICIO_JORNADA)
+
+        for i in range(0, len(plan), LOTE_TAREAS):
+            Task.create([
+                {
+                    'campana_id':       self.id,
+                    'asignacion_id':    asignacion_id,
+                    'participante_id':  participante_id,
+                    'executor_id':      ejecutor_id,
+                    'fecha_programada': inicio_jornada[dia],
+                    'estado':           'programado',
+                }
+                for asignacion_id, participante_id, ejecutor_id, dia in plan[i:i + LOTE_TAREAS]
+            ])
+            Task.env.invalidate_all()
+
+        # Un write por aplicador sobre sus asignaciones
+        por_ejecutor = defaultdict(list)
+        for asignacion_id, _p, ejecutor_id, _d in plan:
+            por_ejecutor[ejecutor_id].append(asignacion_id)
+        for ejecutor_id, asignacion_ids in por_ejecutor.items():
+            Assignment.browse(asignacion_ids).write(
+                {'executor_id': ejecutor_id, 'estado': 'asignado'})
+        return len(plan)